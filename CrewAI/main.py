@@ -7,14 +7,26 @@ from dotenv import load_dotenv
 
 from crew import ASE
 import asyncio
-import json
+import time
 
-import requests
 import subprocess
 import os
 import stat
 import shutil
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.batch import record_result, tasks_to_run
+from common.bm25 import release_workspace_retriever, workspace_retriever
+from common.mirror import default_store
+from common.eval_cache import evaluate
+from common.instrumentation import Metrics, install_litellm_hooks, instrument_tool_object, track_task
+from common.results_store import TaskResult, repo_name
+from common.service_client import close_client
+from common.search_index import release_workspace_index
+from common.task_store import load_task
+from common.tracing import Trace, span, trace_dir, use_trace
+from common.workspace import use_workspace
 from langchain_community.agent_toolkits import FileManagementToolkit
 from crewai_tools import (
     FileReadTool, DirectoryReadTool,FileWriterTool
@@ -24,10 +36,8 @@ from crewai_tools import (
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
 load_dotenv()
-API_URL = "http://localhost:8081/task/index/"
-TEST_URL = "http://localhost:8082/test"
 REPOS_DIR = "repos"
-LOG_FILE = "results.log"
+RUNNER = "crewai"
 WORKSPACE_ROOT= "D:\\ProgrammingProjekts\\ASEPublic\\repos"
 os.environ.get("WORKSPACE_ROOT")
 os.environ["GOOGLE_API_KEY"] = API_KEY
@@ -38,115 +48,96 @@ os.environ["GOOGLE_API_KEY"] = API_KEY
 
 async def handle_task(index):
     load_dotenv()
-    api_url = f"{API_URL}{index}"
-    print(f"Fetching test case {index} from {api_url}...")
-    repo_dir = os.path.join(os.environ.get("WORKSPACE_ROOT"), f"repo_{index}")  # Use unique repo directory per task
-    start_dir = os.getcwd()  # Remember original working directory
-    os.environ["REPO_NAME"] = f"repo_{index}"
-
-    # Instantiate tools
-    reader = FileReadTool()
-    writer = FileWriterTool()
-    dir_reader = DirectoryReadTool()
-
-    try:
-        response = requests.get(api_url)
-        if response.status_code != 200:
-            raise Exception(f"Invalid response: {response.status_code}")
-
-        testcase = response.json()
-        prompt = testcase["Problem_statement"]
-        git_clone = testcase["git_clone"]
-        fail_tests = json.loads(testcase.get("FAIL_TO_PASS", "[]"))
-        pass_tests = json.loads(testcase.get("PASS_TO_PASS", "[]"))
-        instance_id = testcase["instance_id"]
-
-        # Extract repo URL and commit hash
-        parts = git_clone.split("&&")
-        clone_part = parts[0].strip()
-        checkout_part = parts[-1].strip() if len(parts) > 1 else None
-
-        repo_url = clone_part.split()[2]
-
-        print(f"Cloning repository {repo_url} into {repo_dir}...")
-        env = os.environ.copy()
-        env["GIT_TERMINAL_PROMPT"] = "0"
-        if not os.path.isdir(os.environ.get("WORKSPACE_ROOT")+ '\\' + os.environ.get('REPO_NAME', '')):
-            subprocess.run(["git", "clone", repo_url, repo_dir], check=True, env=env)
-
-        if checkout_part:
-            commit_hash = checkout_part.split()[-1]
-            print(f"Checking out commit: {commit_hash}")
-            subprocess.run(["git", "checkout", commit_hash], cwd=repo_dir, check=True, env=env)
-
-        print(f"Launching Agent-System (Crew AI)...")
-
-        inputs = {
-            'index': index,
-            'problem_statement': prompt
-        }
-    
+    print(f"Loading test case {index}...")
+    with use_workspace(os.environ.get("WORKSPACE_ROOT"), f"repo_{index}") as workspace, \
+            track_task(f"repo_{index}") as metrics, use_trace(Trace(f"repo_{index}")) as trace:
+        repo_dir = workspace.repo_path  # Use unique repo directory per task
+        repo_url = None
+        result = TaskResult(RUNNER, index)
+        error = None
+        started = time.perf_counter()
+
+        # Instantiate tools
+        reader = FileReadTool()
+        writer = FileWriterTool()
+        dir_reader = DirectoryReadTool()
+
         try:
-            os.environ["REPO_NAME"] = f"repo_{index}"
+            with span("fetch task", "http"):
+                record = await load_task(index)
+            prompt = record.problem_statement
+            fail_tests = record.fail_to_pass
+            pass_tests = record.pass_to_pass
+            instance_id = record.instance_id
+            repo_url = record.repo_url
+            commit_hash = record.commit_hash
+            result.instance_id, result.repo = instance_id, repo_name(repo_url)
+            print(f"Checking out {repo_url} at {commit_hash or 'HEAD'} into {repo_dir}...")
+            with span("checkout", "git"):
+                await asyncio.to_thread(default_store().add_worktree, repo_url, commit_hash, repo_dir)
+            with span("index", "index"):
+                retriever = await asyncio.to_thread(workspace_retriever, repo_dir, repo_url, commit_hash)
+                retrieved = retriever.search(prompt)
+            result.timings["prepare"] = time.perf_counter() - started
+
+            print(f"Launching Agent-System (Crew AI)...")
+
+            inputs = {
+                'index': index,
+                'problem_statement': prompt,
+                'retrieved_code': retrieved
+            }
+    
+            try:
 
 
-            tools = [reader, writer, dir_reader]
+                tools = [instrument_tool_object(tool) for tool in (reader, writer, dir_reader)]
 
-            mas = ASE(index, tools)
-            mas.crew().kickoff(inputs=inputs)
-        except Exception as e:
-            raise Exception(f"An error occurred while running the crew: {e}")
+                mas = ASE(index, tools)
+                with span("crew kickoff", "node"):
+                    mas.crew().kickoff(inputs=inputs)
+            except Exception as e:
+                raise Exception(f"An error occurred while running the crew: {e}")
+            result.timings["agent"] = time.perf_counter() - started - result.timings["prepare"]
 
         
-        # Call REST service instead for evaluation changes from agent
-        print(f"Calling SWE-Bench REST service with repo: {repo_dir}")
-        test_payload = {
-            "instance_id": instance_id,
-            "repoDir": f"\\repo_{index}",  # mount with docker
-            "FAIL_TO_PASS": fail_tests,
-            "PASS_TO_PASS": pass_tests
-        }
-        res = requests.post("http://localhost:8082/test", json=test_payload)
-        res.raise_for_status()
-        result_raw = res.json().get("harnessOutput", "{}")
-        result_json = json.loads(result_raw)
-        if not result_json:
-            raise ValueError("No data in harnessOutput – possible evaluation error or empty result")
-        instance_id = next(iter(result_json))
-        tests_status = result_json[instance_id]["tests_status"]
-        fail_pass_results = tests_status["FAIL_TO_PASS"]
-        fail_pass_total = len(fail_pass_results["success"]) + len(fail_pass_results["failure"])
-        fail_pass_passed = len(fail_pass_results["success"])
-        pass_pass_results = tests_status["PASS_TO_PASS"]
-        pass_pass_total = len(pass_pass_results["success"]) + len(pass_pass_results["failure"])
-        pass_pass_passed = len(pass_pass_results["success"])
-
-        # Log results
-        os.chdir(start_dir)
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\n--- TESTCASE {index} ---\n")
-            log.write(f"FAIL_TO_PASS passed: {fail_pass_passed}/{fail_pass_total}\n")
-            log.write(f"PASS_TO_PASS passed: {pass_pass_passed}/{pass_pass_total}\n")
-            #log.write(f"Total Tokens Used: {token_total}\n")
-        print(f"Test case {index} completed and logged.")
-        # if not os.access(repo_dir, os.W_OK):
-        #     os.chmod(repo_dir, stat.S_IWUSR)
-        # os.system(f"rd /s /q \"{repo_dir}\"")
-
-    except Exception as e:
-        os.chdir(start_dir)
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\n--- TESTCASE {index} ---\n")
-            log.write(f"Error: {e}\n")
-        print(f"Error in test case {index}: {e}")
-        # if not os.access(repo_dir, os.W_OK):
-        #     os.chmod(repo_dir, stat.S_IWUSR)
-        # os.system(f"rd /s /q \"{repo_dir}\"")
+            # Call REST service instead for evaluation changes from agent
+            print(f"Calling SWE-Bench REST service with repo: {repo_dir}")
+            test_payload = {
+                "instance_id": instance_id,
+                "repoDir": f"\\repo_{index}",  # mount with docker
+                "FAIL_TO_PASS": fail_tests,
+                "PASS_TO_PASS": pass_tests
+            }
+            res = await evaluate(repo_dir, test_payload)
+            result.add_tests(res)
+            result.timings["evaluate"] = time.perf_counter() - started - sum(result.timings.values())
+
+        except Exception as e:
+            error = e
+
+        finally:
+            release_workspace_retriever(repo_dir)
+            release_workspace_index(repo_dir)
+            if repo_url:
+                with span("remove worktree", "git"):
+                    await asyncio.to_thread(default_store().remove_worktree, repo_url, repo_dir)
+            print(f"Trace of test case {index} written to {trace.save(trace_dir())}")
+            await record_result(result, error, metrics)
+        print(metrics.summary())
+        return metrics
 
 
 async def main():
     #for issue_nr in range(1,31):
-        await handle_task(13)
+        install_litellm_hooks()
+        sweep = Metrics("sweep", tasks=0)
+        try:
+            for index in tasks_to_run(RUNNER, [13]):
+                sweep.merge(await handle_task(index))
+        finally:
+            print(sweep.summary())
+            await close_client()
 
 
 if __name__ == "__main__":
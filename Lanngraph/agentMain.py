@@ -1,151 +1,214 @@
+import argparse
 import asyncio
-import json
-import re
+import functools
+import time
 
-import requests
-import subprocess
 import os
-
-from your_langgraph_agent_moduleOpenAi import coding_agent
-
-API_URL = "http://localhost:8081/task/index/"  # API endpoint for SWE-Bench-Lite
-LOG_FILE = "results.log"
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.mirror import default_store
+from common.pipeline import Stage, run_pipeline
+from common.eval_cache import default_cache, evaluate
+from common.instrumentation import Metrics, track_task
+from common.batch import record_result, tasks_to_run
+from common.results_store import TaskResult, default_results_store, repo_name
+from common.service_client import close_client
+from common.task_store import load_task, parse_indices
+from common.tracing import Trace, span, trace_dir, use_trace
+from common.bm25 import release_workspace_retriever, workspace_retriever
+from common.search_index import release_workspace_index
+from common.workspace import use_workspace
+from file_cache import release_workspace_cache
+from llm_cache import installed_cache
+from metrics_callback import MetricsCallbackHandler
+from your_langgraph_agent_moduleOpenAi import MAX_ITERATIONS, checkpointed_agent, run_agent
+
+RUNNER = "langgraph"
 WORKSPACE_ROOT = os.environ.get("WORKSPACE_ROOT")
 
 
-async def handle_task(index):
-    api_url = f"{API_URL}{index}"
-    print(f"Fetching test case {index} from {api_url}...")
-    repo_dir = os.path.join(WORKSPACE_ROOT, f"repo_{index}")  # Use unique repo directory per task
-    start_dir = os.getcwd()  # Remember original working directory
-    os.environ["REPO_NAME"] = f"repo_{index}"
-
-    try:
-        response = requests.get(api_url)
-        if response.status_code != 200:
-            raise Exception(f"Invalid response: {response.status_code}")
-
-        testcase = response.json()
-        prompt = testcase["Problem_statement"]
-        git_clone = testcase["git_clone"]
-        fail_tests = json.loads(testcase.get("FAIL_TO_PASS", "[]"))
-        pass_tests = json.loads(testcase.get("PASS_TO_PASS", "[]"))
-        instance_id = testcase["instance_id"]
-
-        # Extract repo URL and commit hash
-        parts = git_clone.split("&&")
-        clone_part = parts[0].strip()
-        checkout_part = parts[-1].strip() if len(parts) > 1 else None
-
-        repo_url = clone_part.split()[2]
-
-        print(f"Cloning repository {repo_url} into {repo_dir}...")
-        env = os.environ.copy()
-        env["GIT_TERMINAL_PROMPT"] = "0"
-        if not os.path.isdir(os.environ.get('WORKSPACE_ROOT', '') +'\\'+ os.environ.get('REPO_NAME', '')):
-            subprocess.run(["git", "clone", repo_url, repo_dir], check=True, env=env)
-
-        if checkout_part:
-           commit_hash = checkout_part.split()[-1]
-           print(f"Checking out commit: {commit_hash}")
-           subprocess.run(["git", "checkout", commit_hash], cwd=repo_dir, check=True, env=env)
-
-        # Build full prompt for the agent
-        full_prompt = (
-            f"You are a team of agents with the following roles:\n"
-            f"- Planner: breaks down the problem into coding tasks\n"
-            f"- Coder: makes actual changes to the code files in the Git repository\n"
-            f"Work in the directory: repo_{index}. This is a Git repository.\n"
-            f"Your goal is to fix the problem described below.\n"
-            f"All code changes must be saved to the files, so they appear in `git diff`.\n"
-            f"The fix will be verified by running the affected tests. Do not run tests yourself\n\n"
-            f"Problem description:\n"
-            f"{prompt}\n\n"
-            f"Make sure the fix is minimal and only touches what's necessary to resolve the failing tests."
-        )
-
-        # Launch Agent here
-        print(f"Launching agent...")
-
-
-
-        agent_input = {
-            "input": full_prompt,
-            "repo_path": repo_dir,
-            "FAIL_TO_PASS": fail_tests,
-            "PASS_TO_PASS": pass_tests,
-            "instance_id": instance_id,
-        }
-
-        response = await coding_agent.ainvoke(agent_input)
-        print("Agent finished:", response)
-
-        # Token usage
-        #token_total = extract_last_token_total_from_logs() Todo
-
-        # Call REST service instead for evaluation changes from agent
-        print(f"Calling SWE-Bench REST service with repo: {repo_dir}")
-        test_payload = {
-            "instance_id": instance_id,
-            "repoDir": f"/repos/repo_{index}",  # mount with docker
-            "FAIL_TO_PASS": fail_tests,
-            "PASS_TO_PASS": pass_tests
-        }
-        res = requests.post("http://localhost:8082/test", json=test_payload)
-        res.raise_for_status()
-        result_raw = res.json().get("harnessOutput", "{}")
-        result_json = json.loads(result_raw)
-        if not result_json:
-            raise ValueError("No data in harnessOutput – possible evaluation error or empty result")
-        instance_id = next(iter(result_json))
-        tests_status = result_json[instance_id]["tests_status"]
-        fail_pass_results = tests_status["FAIL_TO_PASS"]
-        fail_pass_total = len(fail_pass_results["success"]) + len(fail_pass_results["failure"])
-        fail_pass_passed = len(fail_pass_results["success"])
-        pass_pass_results = tests_status["PASS_TO_PASS"]
-        pass_pass_total = len(pass_pass_results["success"]) + len(pass_pass_results["failure"])
-        pass_pass_passed = len(pass_pass_results["success"])
-
-        # Log results
-        os.chdir(start_dir)
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\n--- TESTCASE {index} ---\n")
-            log.write(f"FAIL_TO_PASS passed: {fail_pass_passed}/{fail_pass_total}\n")
-            log.write(f"PASS_TO_PASS passed: {pass_pass_passed}/{pass_pass_total}\n")
-            log.write(f"Total Tokens Used: {"not "}\n") # Todo
-        print(f"Test case {index} completed and logged.")
-
-    except Exception as e:
-     os.chdir(start_dir)
-     with open(LOG_FILE, "a", encoding="utf-8") as log:
-        log.write(f"\n--- TESTCASE {index} ---\n")
-        log.write(f"Error: {e}\n")
-     print(f"Error in test case {index}: {e}")
-
-
-def extract_last_token_total_from_logs():
-    log_dir = r"logs"
-    log_files = [f for f in os.listdir(log_dir) if f.endswith(".log")]
-    if not log_files:
-        return "No logs found"
-
-    log_files.sort(reverse=True)
-
-    latest_log_path = os.path.join(log_dir, log_files[0])
-    with open(latest_log_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-
-    for line in reversed(lines):
-        match = re.search(r'Cumulative Total=(\d+)', line)
-        if match:
-            return int(match.group(1))
-
-    return "Cumulative Total not found"
+async def prepare_task(index):
+    """Load a test case and check its repository out into the task's workspace."""
+    trace = Trace(f"repo_{index}")
+    with use_trace(trace):
+        return await _prepare_task(index, trace)
+
+
+async def _prepare_task(index, trace):
+    print(f"Loading test case {index}...")
+    with span("fetch task", "http"):
+        record = await load_task(index)
+    trace.name = f"repo_{index}-{record.instance_id}"
+
+    task = {
+        "index": index,
+        "repo_name": f"repo_{index}",  # Use unique repo directory per task
+        "repo_dir": os.path.join(WORKSPACE_ROOT, f"repo_{index}"),
+        "repo_url": record.repo_url,
+        "commit_hash": record.commit_hash,
+        "prompt": record.problem_statement,
+        "fail_tests": record.fail_to_pass,
+        "pass_tests": record.pass_to_pass,
+        "instance_id": record.instance_id,
+        "trace": trace,
+    }
+
+    print(f"Checking out {task['repo_url']} at {task['commit_hash'] or 'HEAD'} into {task['repo_dir']}...")
+    with span("checkout", "git"):
+        await asyncio.to_thread(default_store().add_worktree, task["repo_url"], task["commit_hash"], task["repo_dir"])
+    # the search index (built or updated from a nearby commit) and the BM25 retriever on top of it
+    # are prepared while the previous task is still with the agent
+    with span("index", "index"):
+        await asyncio.to_thread(workspace_retriever, os.path.normpath(task["repo_dir"]), task["repo_url"], task["commit_hash"])
+    return task
+
+
+async def solve_task(task, agent, fresh=False):
+    """Run the checkpointed LangGraph agent on a prepared task, resuming an interrupted run of it."""
+    index = task["index"]
+    # Build full prompt for the agent
+    full_prompt = (
+        f"You are a team of agents with the following roles:\n"
+        f"- Planner: breaks down the problem into coding tasks\n"
+        f"- Coder: makes actual changes to the code files in the Git repository\n"
+        f"Work in the directory: repo_{index}. This is a Git repository.\n"
+        f"Your goal is to fix the problem described below.\n"
+        f"All code changes must be saved to the files, so they appear in `git diff`.\n"
+        f"The fix will be verified by running the affected tests. Do not run tests yourself\n\n"
+        f"Problem description:\n"
+        f"{task['prompt']}\n\n"
+        f"Make sure the fix is minimal and only touches what's necessary to resolve the failing tests."
+    )
+
+    # Launch Agent here
+    print(f"Launching agent...")
+
+    agent_input = {
+        "input": full_prompt,
+        "problem_statement": task["prompt"],
+        "repo_path": task["repo_dir"],
+        "repo_url": task["repo_url"],
+        "commit_hash": task["commit_hash"],
+        "FAIL_TO_PASS": task["fail_tests"],
+        "PASS_TO_PASS": task["pass_tests"],
+        "instance_id": task["instance_id"],
+    }
+
+    with use_workspace(WORKSPACE_ROOT, task["repo_name"]), \
+            track_task(task["instance_id"]) as metrics, use_trace(task["trace"]):
+        task["metrics"] = metrics
+        handler = MetricsCallbackHandler(metrics, task["trace"])
+        with span("agent", "node"):
+            # each repair iteration takes two steps (coder and tester) on top of the fixed nodes
+            config = {"callbacks": [handler], "recursion_limit": 2 * MAX_ITERATIONS + 10,
+                      "configurable": {"thread_id": task["instance_id"]}}
+            response = await run_agent(agent, agent_input, config, fresh)
+    print("Agent finished:", response)
+    print(metrics.summary())
+    return task
+
+
+async def evaluate_task(task):
+    """Evaluate the agent's changes with the SWE-Bench REST service."""
+    index = task["index"]
+    # Call REST service instead for evaluation changes from agent
+    print(f"Calling SWE-Bench REST service with repo: {task['repo_dir']}")
+    test_payload = {
+        "instance_id": task["instance_id"],
+        "repoDir": f"/repos/repo_{index}",  # mount with docker
+        "FAIL_TO_PASS": task["fail_tests"],
+        "PASS_TO_PASS": task["pass_tests"]
+    }
+    with use_trace(task["trace"]):
+        res = await evaluate(task["repo_dir"], test_payload)
+    result = TaskResult(RUNNER, index, task["instance_id"], repo_name(task["repo_url"]))
+    result.add_tests(res)
+    task["result"] = result
+    print(f"Test case {index} evaluated.")
+    return task
+
+
+async def cleanup_task(task):
+    """Release the task's caches and remove its worktree; runs for failed tasks too."""
+    repo_path = os.path.normpath(task["repo_dir"])
+    print(f"Test case {task['index']} {release_workspace_cache(repo_path).stats()}")
+    release_workspace_index(repo_path)
+    release_workspace_retriever(repo_path)
+    with use_trace(task["trace"]), span("remove worktree", "git"):
+        await asyncio.to_thread(default_store().remove_worktree, task["repo_url"], task["repo_dir"])
+    print(f"Trace of test case {task['index']} written to {task['trace'].save(trace_dir())}")
+
+
+async def run_batch(indices, concurrency=4, prefetch=2, rerun=False):
+    """
+    Run many tasks as a pipeline: prepare (fetch + checkout) -> agent -> evaluate.
+
+    The prepare stage runs up to `prefetch` tasks ahead of the agents, at most `concurrency`
+    agents run at once, and evaluation overlaps with the next agent run. Progress, per-stage
+    timings and the achieved throughput are printed as tasks finish.
+
+    Tasks in the ledger are skipped and interrupted agent runs resume from their checkpoints,
+    unless `rerun` is set, which runs the given tasks again from the start.
+    """
+    indices = tasks_to_run(RUNNER, indices, rerun)
+    total = len(indices)
+    done = 0
+    passed = 0
+    sweep = Metrics("sweep", tasks=0)
+    started = time.perf_counter()
+
+    async def on_done(job):
+        nonlocal done, passed
+        task = job.value if isinstance(job.value, dict) else {}
+        result = task.get("result") or TaskResult(RUNNER, job.key, task.get("instance_id", ""), repo_name(task.get("repo_url")))
+        result.timings = dict(job.timings)
+        await record_result(result, job.error, task.get("metrics"))
+        if isinstance(job.value, dict):
+            if "metrics" in job.value:
+                sweep.merge(job.value["metrics"])
+            await cleanup_task(job.value)
+        done += 1
+        passed += 1 if job.error is None else 0
+        elapsed = time.perf_counter() - started
+        timings = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in job.timings.items())
+        print(f"[{done}/{total}] test case {job.key} {'finished' if job.error is None else 'failed'} "
+              f"({timings}; {done / elapsed * 60:.2f} tasks/min)")
+
+    print(f"Running {total} tasks with concurrency {concurrency} and prefetch {prefetch}...")
+    async with checkpointed_agent() as agent:
+        await run_pipeline(indices, [
+            Stage("prepare", prepare_task, workers=1, queue_size=1),
+            Stage("agent", functools.partial(solve_task, agent=agent, fresh=rerun), workers=concurrency,
+                  queue_size=prefetch),
+            Stage("evaluate", evaluate_task, workers=1, queue_size=concurrency),
+        ], on_done=on_done)
+
+    elapsed = time.perf_counter() - started
+    print(f"Batch finished: {done} tasks ({passed} without errors) in {elapsed:.1f}s, "
+          f"throughput {done / elapsed * 60:.2f} tasks/min")
+    print(default_cache().stats())
+    if installed_cache() is not None:
+        print(installed_cache().stats())
+    print(sweep.summary())
+    await asyncio.to_thread(default_results_store().flush)
+    print(f"Results are in {default_results_store().path}; summarize them with python -m common.results_store report")
 
 
 async def main():
-     #for i in range(1, 31):
-        await handle_task(1)
+    parser = argparse.ArgumentParser(description="Run the LangGraph agent on SWE-Bench-Lite tasks.")
+    parser.add_argument("--tasks", default="1", help='Task indices, e.g. "1-30" or "1,4,9" (default: 1)')
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of tasks running at once")
+    parser.add_argument("--prefetch", type=int, default=2, help="Number of tasks prepared ahead of the agents")
+    parser.add_argument("--rerun", action="store_true",
+                        help="Run tasks again even if the ledger lists them as finished, discarding their checkpoints")
+    args = parser.parse_args()
+
+    try:
+        await run_batch(parse_indices(args.tasks), args.concurrency, args.prefetch, args.rerun)
+    finally:
+        await close_client()
 
 
 if __name__ == "__main__":
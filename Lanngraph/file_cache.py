@@ -0,0 +1,111 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from common.workspace import current_workspace
+
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+
+
+class FileCache:
+    """
+    LRU cache of decoded file contents for one workspace.
+
+    An entry is only served while the file's (mtime_ns, size) still match, so edits made outside
+    the tools are picked up; the tools themselves update or invalidate entries when they write.
+    """
+
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, file_path: str) -> str:
+        return self._entry(file_path)[2]
+
+    def read_lines(self, file_path: str):
+        """
+        Return (content, offsets) where offsets[i] is where line i + 1 starts in content.
+
+        Lines are split on newlines exactly like readlines() in the line editing tools, and the
+        index is built once per file version, so any window is a single slice of content.
+        """
+        entry = self._entry(file_path)
+        if entry[3] is None:
+            content = entry[2]
+            offsets = [0] if content else []
+            position = content.find("\n")
+            while position != -1:
+                offsets.append(position + 1)
+                position = content.find("\n", position + 1)
+            if offsets and offsets[-1] == len(content):
+                offsets.pop()  # the file ends with a newline, there is no empty last line
+            entry[3] = offsets
+        return entry[2], entry[3]
+
+    def _entry(self, file_path: str):
+        stat = os.stat(file_path)
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self.hits += 1
+                self._entries.move_to_end(file_path)
+                return entry
+            self.misses += 1
+
+        with open(file_path, "r") as file:
+            content = file.read()
+        return self._store(file_path, stat, content)
+
+    def put(self, file_path: str, content: str):
+        """Record `content` as the current content of a file that was just written."""
+        self._store(file_path, os.stat(file_path), content)
+
+    def invalidate(self, file_path: str):
+        with self._lock:
+            entry = self._entries.pop(file_path, None)
+            if entry is not None:
+                self._bytes -= sys.getsizeof(entry[2])
+
+    def _store(self, file_path, stat, content):
+        size = sys.getsizeof(content)
+        entry = [stat.st_mtime_ns, stat.st_size, content, None]
+        with self._lock:
+            old = self._entries.pop(file_path, None)
+            if old is not None:
+                self._bytes -= sys.getsizeof(old[2])
+            if size > self.max_bytes:
+                return entry
+            self._entries[file_path] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= sys.getsizeof(evicted[2])
+        return entry
+
+    def stats(self) -> str:
+        reads = self.hits + self.misses
+        rate = self.hits / reads * 100 if reads else 0.0
+        return (f"file cache: {self.hits}/{reads} reads served from cache ({rate:.0f}% hit rate), "
+                f"{len(self._entries)} files, {self._bytes / 1024 / 1024:.1f} MB")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def workspace_cache(repo_path: str = None) -> FileCache:
+    """The file cache of the given repository, or of the workspace bound to the current task."""
+    repo_path = repo_path or current_workspace().repo_path
+    with _caches_lock:
+        return _caches.setdefault(repo_path, FileCache())
+
+
+def release_workspace_cache(repo_path: str) -> FileCache:
+    """Drop a finished task's cache and return it so its statistics can still be reported."""
+    with _caches_lock:
+        return _caches.pop(repo_path, None) or FileCache()
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import time
+from typing import Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.globals import set_llm_cache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+
+from common.defaults import default_path
+from common.sqlite_store import SQLiteStore
+
+MODES = ("record", "replay", "passthrough")
+
+
+class LLMCacheMiss(RuntimeError):
+    """Raised in replay mode when a call was not recorded."""
+
+
+class SQLiteLLMCache(SQLiteStore, BaseCache):
+    """
+    LangChain LLM cache in SQLite, keyed by a hash of the llm_string and the prompt. For chat
+    models LangChain builds the llm_string from the model, its parameters and the bound tool
+    schemas, and the prompt from the serialized messages.
+
+    Modes:
+      record       serve recorded responses, call the model and record on a miss
+      replay       serve recorded responses only; a miss raises LLMCacheMiss
+      passthrough  (not installed at all) every call goes to the model
+
+    The least recently used entries are evicted beyond `max_entries`.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS generations (
+            key TEXT PRIMARY KEY,
+            llm_string TEXT NOT NULL,
+            generations TEXT NOT NULL,
+            last_used REAL NOT NULL
+        )"""
+
+    def __init__(self, path: str, mode: str = "record", max_entries: int = 20000):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown LLM cache mode {mode!r}, expected record or replay")
+        super().__init__(path)
+        self.mode = mode
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT generations FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+        if row is None:
+            if self.mode == "replay":
+                raise LLMCacheMiss(f"LLM call not recorded in {self.path} (replay mode)")
+            return None
+        return loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]):
+        if self.mode == "replay":
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?)",
+                               (self._key(prompt, llm_string), llm_string, dumps(list(return_val)), time.time()))
+            self._evict_least_recently_used("generations", self.max_entries)
+            self._conn.commit()
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM generations")
+            self._conn.commit()
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return f"llm cache ({self.mode}): {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+
+_installed_cache = None
+
+
+def install_llm_cache() -> Optional[SQLiteLLMCache]:
+    """
+    Install the cache for all LangChain models according to $LLM_CACHE_MODE (record, replay or
+    passthrough; default passthrough), stored in $LLM_CACHE or WORKSPACE_ROOT/llm_cache.db.
+    """
+    global _installed_cache
+    mode = (os.environ.get("LLM_CACHE_MODE") or "passthrough").lower()
+    if mode not in MODES:
+        raise ValueError(f"LLM_CACHE_MODE must be one of {', '.join(MODES)}, not {mode!r}")
+    if mode == "passthrough":
+        _installed_cache = None
+    else:
+        path = default_path("LLM_CACHE", "llm_cache.db")
+        _installed_cache = SQLiteLLMCache(path, mode)
+        print(f"LLM cache in {mode} mode: {path}")
+    set_llm_cache(_installed_cache)
+    return _installed_cache
+
+
+def installed_cache() -> Optional[SQLiteLLMCache]:
+    return _installed_cache
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from common.instrumentation import Metrics
+from common.tracing import Trace, now_us
+
+
+def _token_usage(response):
+    """(prompt, completion) tokens of an LLMResult, from usage_metadata or the provider's llm_output."""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if not prompt_tokens and not completion_tokens:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records LLM calls (latency and tokens, attributed to the LangGraph node they run in) and tool
+    calls of a graph run into a task's Metrics, and as spans into its Trace if one is given.
+    Pass it as a callback when invoking the graph.
+    """
+
+    run_inline = True
+
+    def __init__(self, metrics: Metrics, trace: Trace = None):
+        self.metrics = metrics
+        self.trace = trace
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, label):
+        with self._lock:
+            self._started[run_id] = (time.perf_counter(), now_us(), label)
+
+    def _finish(self, run_id, category, **args):
+        with self._lock:
+            started, started_us, label = self._started.pop(run_id, (None, None, None))
+        if started is None:
+            return 0.0, None
+        if self.trace is not None:
+            self.trace.add(f"{category} {label}", category, started_us, now_us(), args)
+        return time.perf_counter() - started, label
+
+    @staticmethod
+    def _node(metadata):
+        return (metadata or {}).get("langgraph_node", "graph")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, self._node(metadata))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, self._node(metadata))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_tokens, completion_tokens = _token_usage(response)
+        seconds, node = self._finish(run_id, "llm", prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self.metrics.record_llm(node or "graph", seconds, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        seconds, node = self._finish(run_id, "llm", error=repr(error))
+        self.metrics.record_llm(node or "graph", seconds, error=True)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, (serialized or {}).get("name") or kwargs.get("name") or "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        seconds, tool = self._finish(run_id, "tool")
+        self.metrics.record_tool(tool or "tool", seconds)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        seconds, tool = self._finish(run_id, "tool", error=repr(error))
+        self.metrics.record_tool(tool or "tool", seconds, error=True)
@@ -0,0 +1,211 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# How many context lines may be ignored at either end of a hunk that does not match otherwise,
+# like the fuzz factor of GNU patch.
+MAX_FUZZ = 2
+
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    header: str
+    # (tag, text) with tag ' ' for context, '-' for removed and '+' for added lines; text has no line break
+    lines: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def old_lines(self) -> List[str]:
+        return [text for tag, text in self.lines if tag != "+"]
+
+    @property
+    def new_lines(self) -> List[str]:
+        return [text for tag, text in self.lines if tag != "-"]
+
+    def complete(self) -> bool:
+        return len(self.old_lines) >= self.old_count and len(self.new_lines) >= self.new_count
+
+
+@dataclass
+class FilePatch:
+    old_path: Optional[str]
+    new_path: Optional[str]
+    hunks: List[Hunk] = field(default_factory=list)
+
+    @property
+    def path(self) -> str:
+        return self.new_path or self.old_path
+
+
+@dataclass
+class Rejection:
+    number: int
+    hunk: Hunk
+    reason: str
+
+    def __str__(self):
+        body = "\n".join(tag + text for tag, text in self.hunk.lines)
+        return f"hunk #{self.number} ({self.hunk.header}) rejected: {self.reason}\n{body}"
+
+
+class PatchError(ValueError):
+    pass
+
+
+def _patch_path(header: str) -> Optional[str]:
+    path = header[4:].split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    if path.startswith(("a/", "b/")):
+        path = path[2:]
+    return path
+
+
+def parse_patch(text: str) -> List[FilePatch]:
+    """
+    Parse a unified diff covering one or more files.
+
+    The parser is lenient with what LLMs produce: hunk line counts may be off, and a context line
+    whose leading space got lost is still read as context while the hunk expects more lines.
+    """
+    files: List[FilePatch] = []
+    hunk: Optional[Hunk] = None
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        # "-- x" removed and "++ y" added inside a hunk look like file headers, so only a complete hunk can end here
+        at_file_boundary = hunk is None or hunk.complete()
+        if at_file_boundary and line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            files.append(FilePatch(_patch_path(line), _patch_path(lines[i + 1])))
+            hunk = None
+            i += 2
+            continue
+        if line.startswith("diff "):
+            hunk = None
+        elif line.startswith("@@"):
+            match = HUNK_HEADER.match(line)
+            if not match or not files:
+                raise PatchError(f"Malformed hunk header or hunk without file header: {line!r}")
+            old_start, old_count, new_start, new_count = match.groups()
+            hunk = Hunk(int(old_start), int(old_count if old_count is not None else 1),
+                        int(new_start), int(new_count if new_count is not None else 1), line.split("@@")[1].strip())
+            files[-1].hunks.append(hunk)
+        elif hunk is not None:
+            if line[:1] in ("+", "-", " "):
+                hunk.lines.append((line[0], line[1:]))
+            elif line.startswith("\\"):
+                pass  # "\ No newline at end of file"
+            elif not hunk.complete():
+                hunk.lines.append((" ", line))
+            else:
+                hunk = None
+        i += 1
+
+    if not files:
+        raise PatchError("No file headers ('--- a/...' / '+++ b/...') found in patch")
+    return files
+
+
+def _normalize(line: str) -> str:
+    return " ".join(line.split())
+
+
+def _matches_at(file_lines: List[str], old: List[str], position: int, loose: bool) -> bool:
+    if position < 0 or position + len(old) > len(file_lines):
+        return False
+    if loose:
+        return all(_normalize(a) == _normalize(b) for a, b in zip(file_lines[position:position + len(old)], old))
+    return file_lines[position:position + len(old)] == old
+
+
+def _search(file_lines: List[str], old: List[str], expected: int, loose: bool) -> Optional[int]:
+    """Find `old` in the file, trying the positions closest to `expected` first."""
+    expected = min(max(expected, 0), len(file_lines))
+    for distance in range(len(file_lines) + 1):
+        for position in (expected - distance, expected + distance):
+            if _matches_at(file_lines, old, position, loose):
+                return position
+        if expected - distance < 0 and expected + distance > len(file_lines):
+            break
+    return None
+
+
+def _trim_context(hunk_lines, lead: int, trail: int):
+    """Drop `lead` leading and `trail` trailing lines, which must all be context lines."""
+    end = len(hunk_lines) - trail
+    trimmed = hunk_lines[lead:end]
+    dropped = hunk_lines[:lead] + hunk_lines[end:]
+    if not trimmed or any(tag != " " for tag, _ in dropped):
+        return None
+    return trimmed
+
+
+def locate(file_lines: List[str], hunk: Hunk, offset: int):
+    """
+    Find where a hunk applies: exact match first, then ignoring whitespace differences, then with up
+    to MAX_FUZZ context lines ignored at either end.
+
+    Returns (position, hunk lines to apply, number of leading context lines dropped, how) or None.
+    """
+    for fuzz in range(MAX_FUZZ + 1):
+        for lead, trail in sorted({(fuzz, fuzz), (fuzz, 0), (0, fuzz)}):
+            hunk_lines = _trim_context(hunk.lines, lead, trail)
+            if hunk_lines is None:
+                continue
+            old = [text for tag, text in hunk_lines if tag != "+"]
+            expected = hunk.old_start - 1 + lead + offset
+            for loose in (False, True):
+                position = _search(file_lines, old, expected, loose)
+                if position is not None:
+                    how = "exact" if not loose and fuzz == 0 else ("whitespace" if fuzz == 0 else f"fuzz {fuzz}")
+                    return position, hunk_lines, lead, how
+    return None
+
+
+def apply_hunks(file_lines: List[str], hunks: List[Hunk]):
+    """
+    Apply hunks to the lines of a file (without line breaks).
+
+    Returns (new lines, list of "hunk #n applied ..." notes, list of Rejection). Hunks that cannot
+    be located are rejected while the others are still applied.
+    """
+    result = list(file_lines)
+    notes, rejected = [], []
+    offset = 0
+    for number, hunk in enumerate(hunks, 1):
+        if not hunk.old_lines:
+            # pure insertion: "@@ -5,0 +6,2 @@" inserts after line 5
+            position = min(max(hunk.old_start + offset, 0), len(result))
+            result[position:position] = hunk.new_lines
+            offset += len(hunk.new_lines)
+            notes.append(f"hunk #{number} inserted at line {position + 1}")
+            continue
+
+        found = locate(result, hunk, offset)
+        if found is None:
+            rejected.append(Rejection(number, hunk, "its context and removed lines were not found in the file"))
+            continue
+        position, hunk_lines, lead, how = found
+
+        replacement = []
+        cursor = position
+        for tag, text in hunk_lines:
+            if tag == " ":
+                replacement.append(result[cursor])  # keep the file's own version of context lines
+                cursor += 1
+            elif tag == "-":
+                cursor += 1
+            else:
+                replacement.append(text)
+        old_length = cursor - position
+        result[position:cursor] = replacement
+
+        offset = position - lead - (hunk.old_start - 1) + len(replacement) - old_length
+        notes.append(f"hunk #{number} applied at line {position + 1} ({how})")
+    return result, notes, rejected
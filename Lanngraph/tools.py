@@ -1,14 +1,34 @@
+import io
 import os
 import re
-from typing import List, Any
+import shutil
+import tempfile
+import tokenize
+from typing import List, Any, Literal, Optional
 
 from langchain_core.tools import tool
 
 from langchain.tools import StructuredTool
 from pydantic import BaseModel, Field
 
+from common.outline import default_cache as outline_cache, format_outline
+from common.search_index import iter_repo_files, mark_stale, workspace_index
+from common.symbols import lookup, module_name
+from common.workspace import current_workspace
+from file_cache import workspace_cache
+import patching
+
 WORKSPACE_ROOT = os.getenv('WORKSPACE_ROOT')
 
+
+def file_changed(file_path: str, content: Optional[str] = None):
+    """Update the caches after a tool wrote (with its new `content`) or removed a file."""
+    if content is None:
+        workspace_cache().invalidate(file_path)
+    else:
+        workspace_cache().put(file_path, content)
+    mark_stale(current_workspace().repo_path, [file_path])
+
 class OverwriteFileInput(BaseModel):
     file_path: str
     content: str
@@ -29,15 +49,7 @@ def overwrite_file(
         str: Result of the operation or the content of the file.
     """
 
-   # file_path = f"{os.environ.get('WORKSPACE_ROOT')}/{os.environ.get('REPO_NAME')}/{file_path}"
-    # Convert to absolute path if needed
-    file_path = file_path.strip().strip('"').strip("'")
-
-    if not os.path.isabs(file_path):
-        file_path = os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), file_path)
-
-    # Normalize the path
-    file_path = os.path.normpath(file_path)
+    file_path = current_workspace().resolve(file_path)
 
     git_dir = '.git'
 
@@ -56,6 +68,7 @@ def overwrite_file(
         with open(file_path, "w") as file:
             print(f"WRITE FILE {file_path}")
             file.write(content)
+        file_changed(file_path, content)
         return f"File {file_path} written successfully."
     except Exception as e:
         return f"An error occurred while writing to the file: {e}"
@@ -77,14 +90,7 @@ def find_and_replace(
 
     Returns:
         str: Result of the operation or the content of the file."""
-    # Convert to absolute path if needed
-    file_path = file_path.strip().strip('"').strip("'")
-
-    if not os.path.isabs(file_path):
-        file_path = os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), file_path)
-
-    # Normalize the path
-    file_path = os.path.normpath(file_path)
+    file_path = current_workspace().resolve(file_path)
 
     git_dir = '.git'
 
@@ -97,12 +103,12 @@ def find_and_replace(
     if not os.path.exists(file_path):
         return f"Error: File '{file_path}' not found."
     try:
-        with open(file_path, "r") as file:
-            content = file.read()
+        content = workspace_cache().read(file_path)
 
         modified_content = re.sub(pattern, replacement, content)
         with open(file_path, "w") as file:
             file.write(modified_content)
+        file_changed(file_path, modified_content)
     except Exception as e:
         return f"An error occurred while writing to the file: {e}"
     return f"FIND AND REPLACE in {file_path} successful!"
@@ -118,8 +124,7 @@ def list_files_in_repository() -> list[str]:
     """
 
     max_files: int = 500
-    repo_path = f"{os.environ.get('WORKSPACE_ROOT')}/{os.environ.get('REPO_NAME')}"
-    repo_path = os.path.normpath(repo_path)
+    repo_path = current_workspace().repo_path
     print(repo_path)
     try:
         if not os.path.exists(repo_path):
@@ -159,12 +164,13 @@ def replace_string(string_to_find : str, replacement : str, file_path : str):
 
     print(f"trying to replace string \r\n {string_to_find} \r\n\r\n with  \r\n\r\n {replacement} \r\n in file {file_path}")
     try:
-        with open(os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), file_path), "r") as file:
-            content = file.read()
+        file_path = current_workspace().resolve(file_path)
+        content = workspace_cache().read(file_path)
 
         modified_content = content.replace(string_to_find, replacement,1)
-        with open(os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), file_path), "w") as file:
+        with open(file_path, "w") as file:
             file.write(modified_content)
+        file_changed(file_path, modified_content)
     except Exception as e:
         print(f"failure on Error")
         return 'failure'
@@ -188,12 +194,7 @@ def list_dir(path: str, recursive: bool = False, max_items: int = 50) -> List[st
     """
 
 
-    if not os.path.isabs(path):
-        repo_path = os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), path)
-    else:
-        repo_path = path
-
-    repo_path = os.path.normpath(repo_path)
+    repo_path = current_workspace().resolve(path)
 
     if not os.path.exists(repo_path):
         return f"Directory not found: {repo_path}"
@@ -216,25 +217,113 @@ def list_dir(path: str, recursive: bool = False, max_items: int = 50) -> List[st
 
     return paths
 
-@tool
-def read_file(file_path: str) -> str:
+class SearchCodeInput(BaseModel):
+    query: str = Field(description="Text to search for, e.g. 'def get_or_create' or 'TIME_ZONE'.")
+    regex: bool = Field(default=False, description="Treat the query as a Python regular expression.")
+    case_sensitive: bool = False
+    path_glob: Optional[str] = Field(default=None, description="Only search files matching this glob, e.g. 'django/db/*.py'.")
+    max_results: int = Field(default=50, description="Maximum number of hits to return.")
+
+@tool(args_schema=SearchCodeInput)
+def search_code(query: str, regex: bool = False, case_sensitive: bool = False,
+                path_glob: Optional[str] = None, max_results: int = 50) -> str:
     """
-    Reads the content of a file and returns it as a string.
+    Search the contents of all files in the repository, like grep, using a prebuilt index.
+    Use this instead of listing directories and reading files to find where something is used.
+
+    Returns:
+        str: One 'path:line: text' hit per line, or a message that nothing matched.
+    """
+    repo_path = current_workspace().repo_path
+    try:
+        hits = workspace_index(repo_path).search(repo_path, query, regex, case_sensitive, path_glob, max_results)
+    except re.error as e:
+        return f"Error: invalid regular expression: {e}"
+    if not hits:
+        return f"No matches for {query!r}"
+    return "\n".join(hits)
 
-    Args:
-        file_path (str): Path to the file to be read.
+
+class FindSymbolInput(BaseModel):
+    name: str = Field(description="Name of a class, function or method, optionally qualified like 'QuerySet.get_or_create'.")
+    kind: Optional[Literal["class", "function", "method"]] = None
+    max_results: int = 20
+
+@tool(args_schema=FindSymbolInput)
+def find_symbol(name: str, kind: Optional[str] = None, max_results: int = 20) -> str:
+    """
+    Find where classes, functions and methods are defined in the repository's Python files.
 
     Returns:
-        str: Content of the file or an error message.
+        str: One 'path:first_line-last_line: kind qualified.name' entry per line; read_file
+        with those line numbers shows the definition.
     """
-    # Convert to absolute path if needed
-    file_path = file_path.strip().strip('"').strip("'")
+    repo_path = current_workspace().repo_path
+    definitions = workspace_index(repo_path).find_symbols(name, kind, max_results)
+    if not definitions:
+        return f"No definitions found for {name!r}"
+    return "\n".join(definitions)
+
+class OutlineInput(BaseModel):
+    path: str = Field(description="A Python file or a directory, relative to the repository root. Use '.' for the whole repository.")
+    max_depth: Optional[int] = Field(default=1, description="0 lists top level classes and functions only, 1 adds methods, None shows everything.")
+    max_files: int = Field(default=100, description="Maximum number of files to outline for a directory.")
+
+@tool(args_schema=OutlineInput)
+def outline(path: str, max_depth: Optional[int] = 1, max_files: int = 100) -> str:
+    """
+    Show the classes, functions and methods of a Python file, or of all Python files in a directory,
+    with their line spans (e.g. 'def get_or_create  L920-960'). Much cheaper than read_file for
+    finding where something is defined; then read only those lines with read_file.
 
-    if not os.path.isabs(file_path):
-        file_path = os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), file_path)
+    Returns:
+        str: One outline per file, or an error message.
+    """
+    repo_path = current_workspace().repo_path
+    full_path = os.path.normpath(os.path.join(repo_path, path))
+    if os.path.isfile(full_path):
+        file_paths = [full_path]
+    elif os.path.isdir(full_path):
+        file_paths = sorted(os.path.join(full_path, relative) for relative in iter_repo_files(full_path)
+                            if relative.endswith(".py"))
+    else:
+        return f"Error: '{path}' not found in the repository."
+
+    omitted = max(len(file_paths) - max_files, 0)
+    outlines = outline_cache().outlines(file_paths[:max_files])
+    result = [format_outline(os.path.relpath(file_path, repo_path).replace(os.sep, "/"), entry, max_depth)
+              for file_path, entry in outlines.items()]
+    if omitted:
+        result.append(f"[... {omitted} more files; call outline on a subdirectory to see them]")
+    return "\n".join(result)
+
+READ_FILE_MAX_BYTES = 40000
+
+class ReadFileInput(BaseModel):
+    file_path: str
+    start_line: int = Field(default=1, description="First line to return (1-based).")
+    end_line: Optional[int] = Field(default=None, description="Last line to return (inclusive). Defaults to the end of the file.")
+    max_bytes: int = Field(default=READ_FILE_MAX_BYTES, description="Stop before the returned text exceeds this many bytes.")
+
+@tool(args_schema=ReadFileInput)
+def read_file(file_path: str, start_line: int = 1, end_line: Optional[int] = None,
+              max_bytes: int = READ_FILE_MAX_BYTES) -> str:
+    """
+    Reads a file, or a window of its lines, and returns the lines prefixed with their line numbers.
+    The numbers are the ones delete_lines, insert_at_line and replace_lines expect.
+    If the file has more lines than were returned, the output ends with a marker telling
+    which start_line to use to continue reading.
+
+    Args:
+        file_path (str): Path to the file to be read.
+        start_line (int): First line to return (1-based).
+        end_line (int): Last line to return (inclusive), defaults to the end of the file.
+        max_bytes (int): Maximum size of the returned text.
 
-    # Normalize the path
-    file_path = os.path.normpath(file_path)
+    Returns:
+        str: Numbered lines of the file or an error message.
+    """
+    file_path = current_workspace().resolve(file_path)
 
     git_dir = '.git'
 
@@ -248,14 +337,43 @@ def read_file(file_path: str) -> str:
         return f"Error: File '{file_path}' not found."
 
     try:
-        with open(file_path, "r") as file:
-            return file.read()
+        content, offsets = workspace_cache().read_lines(file_path)
+        return format_line_window(content, offsets, start_line, end_line, max_bytes)
     except FileNotFoundError:
         return f"Error: File '{file_path}' not found."
     except Exception as e:
         return f"Error: An error occurred while reading the file: {e}"
 
 
+def format_line_window(content: str, offsets: List[int], start_line: int = 1, end_line: Optional[int] = None,
+                       max_bytes: int = READ_FILE_MAX_BYTES) -> str:
+    """Render lines start_line..end_line as "<number>| <line>", cut off at max_bytes."""
+    total = len(offsets)
+    start_line = max(start_line, 1)
+    end_line = total if end_line is None else min(end_line, total)
+    if start_line > end_line:
+        return f"[no lines {start_line}-{end_line}: the file has {total} lines]"
+
+    width = len(str(end_line))
+    output = []
+    used = 0
+    last = start_line - 1
+    for number in range(start_line, end_line + 1):
+        stop = offsets[number] if number < total else len(content)
+        text = content[offsets[number - 1]:stop].rstrip("\n")
+        line = f"{number:>{width}}| {text}\n"
+        used += len(line.encode("utf-8"))
+        if used > max_bytes and output:
+            break
+        output.append(line)
+        last = number
+
+    if last < total:
+        output.append(f"[... more available: lines {last + 1}-{total} of {total}; "
+                      f"call read_file with start_line={last + 1} to continue]\n")
+    return "".join(output)
+
+
 @tool
 def delete_lines(file_path: str, start_line: int, end_line: int) -> None:
     """
@@ -274,14 +392,7 @@ def delete_lines(file_path: str, start_line: int, end_line: int) -> None:
         start_line += 1
     if end_line == 0:
         end_line += 1
-        # Convert to absolute path if needed
-    file_path = file_path.strip().strip('"').strip("'")
-
-    if not os.path.isabs(file_path):
-        file_path = os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), file_path)
-
-    # Normalize the path
-    file_path = os.path.normpath(file_path)
+    file_path = current_workspace().resolve(file_path)
 
     git_dir = '.git'
 
@@ -304,6 +415,7 @@ def delete_lines(file_path: str, start_line: int, end_line: int) -> None:
 
     with open(file_path, 'w', encoding='utf-8') as file:
         file.writelines(lines)
+    file_changed(file_path)
 
 
 class InsertAtLineInput(BaseModel):
@@ -327,14 +439,7 @@ def insert_at_line(file_path: str, line_number: int, content: str) -> str | None
     """
     if line_number == 0:
         line_number += 1
-        # Convert to absolute path if needed
-    file_path = file_path.strip().strip('"').strip("'")
-
-    if not os.path.isabs(file_path):
-        file_path = os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), file_path)
-
-    # Normalize the path
-    file_path = os.path.normpath(file_path)
+    file_path = current_workspace().resolve(file_path)
 
     git_dir = '.git'
 
@@ -358,6 +463,7 @@ def insert_at_line(file_path: str, line_number: int, content: str) -> str | None
 
         with open(file_path, 'w', encoding='utf-8') as file:
             file.writelines(lines)
+        file_changed(file_path)
     except FileNotFoundError:
         return f"Error: File '{file_path}' not found."
     except Exception as e:
@@ -384,13 +490,7 @@ def replace_lines(file_path: str, start_line: int, end_line: int, new_content: l
     if end_line == 0:
         end_line += 1
 
-    file_path = file_path.strip().strip('"').strip("'")
-
-    if not os.path.isabs(file_path):
-        file_path = os.path.join(os.environ.get('WORKSPACE_ROOT', ''),os.environ.get('REPO_NAME', ''), file_path)
-
-    # Normalize the path
-    file_path = os.path.normpath(file_path)
+    file_path = current_workspace().resolve(file_path)
 
     git_dir = '.git'
 
@@ -410,6 +510,7 @@ def replace_lines(file_path: str, start_line: int, end_line: int, new_content: l
 
         with open(file_path, 'w', encoding='utf-8') as file:
             file.writelines(lines)
+        file_changed(file_path)
     except FileNotFoundError:
         return f"Error: File '{file_path}' not found."
     except Exception as e:
@@ -438,6 +539,296 @@ replace_lines_tool = StructuredTool.from_function(
         IOError: If the file cannot be read or written.
     """
 )
+
+class LineEdit(BaseModel):
+    file_path: str
+    action: Literal["replace", "insert", "delete"] = Field(description="replace or delete start_line..end_line, or insert before start_line.")
+    start_line: int = Field(description="1-based line number in the ORIGINAL file, before any edit of this batch.")
+    end_line: Optional[int] = Field(default=None, description="Last line (inclusive) for replace/delete, defaults to start_line.")
+    content: List[str] = Field(default_factory=list, description="New lines for replace/insert.")
+
+class BatchEditInput(BaseModel):
+    edits: List[LineEdit]
+
+@tool(args_schema=BatchEditInput)
+def batch_edit(edits: List[LineEdit]) -> str:
+    """
+    Apply several line edits to one or more files in a single step.
+
+    All line numbers refer to the files as they are BEFORE this call, so there is no need to
+    re-read a file between edits. Either every edit is applied or, if any edit is invalid,
+    none is and no file is changed.
+
+    Args:
+        edits (list): Edits with file_path, action ("replace", "insert" or "delete"),
+            start_line, end_line (for replace/delete) and content (list of lines for replace/insert).
+
+    Returns:
+        str: A summary of the changes or an error message.
+    """
+    by_file = {}
+    for edit in edits:
+        edit = LineEdit(**edit) if isinstance(edit, dict) else edit
+        file_path = current_workspace().resolve(edit.file_path)
+        if '.git' in file_path or is_in_git_dir(file_path):
+            return f"Error: File '{file_path}' is inside forbidden dir"
+        if not os.path.exists(file_path):
+            return f"Error: File '{file_path}' not found."
+        by_file.setdefault(file_path, []).append(edit)
+
+    # Compute every new file content before touching the disk.
+    originals, updates = {}, {}
+    for file_path, file_edits in by_file.items():
+        # newline='' keeps the file's own line endings; lines are split like readlines() in the other line tools
+        with open(file_path, 'r', encoding='utf-8', newline='') as file:
+            lines = file.readlines()
+        originals[file_path] = "".join(lines)
+        try:
+            updates[file_path] = apply_line_edits(lines, file_edits)
+        except ValueError as e:
+            return f"Error: {file_path}: {e}. No file was changed."
+
+    written = []
+    try:
+        for file_path, content in updates.items():
+            atomic_write(file_path, content)
+            written.append(file_path)
+            file_changed(file_path)
+    except Exception as e:
+        for file_path in written:
+            atomic_write(file_path, originals[file_path])
+            file_changed(file_path)
+        return f"Error: An error occurred while writing {file_path}: {e}. All files were restored."
+
+    summary = ", ".join(
+        f"{path} ({len(originals[path].splitlines())} -> {len(updates[path].splitlines())} lines)" for path in updates)
+    return f"Applied {len(edits)} edits: {summary}"
+
+
+def apply_line_edits(lines: List[str], edits: List[LineEdit]) -> str:
+    """Apply edits addressed to the original line numbers of `lines`; raise ValueError if any is invalid."""
+    newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    inserts = {}
+    ranges = {}
+    for edit in edits:
+        start = edit.start_line
+        new_lines = [line if line.endswith('\n') else line + newline for line in edit.content]
+        if edit.action == "insert":
+            if start < 1 or start > len(lines) + 1:
+                raise ValueError(f"insert at line {start} is outside 1-{len(lines) + 1}")
+            inserts.setdefault(start, []).extend(new_lines)
+            continue
+        end = edit.end_line if edit.end_line is not None else start
+        if start < 1 or end > len(lines) or start > end:
+            raise ValueError(f"{edit.action} of lines {start}-{end} is outside 1-{len(lines)}")
+        for other_start, (other_end, _) in ranges.items():
+            if start <= other_end and other_start <= end:
+                raise ValueError(f"lines {start}-{end} overlap lines {other_start}-{other_end} of another edit")
+        ranges[start] = (end, new_lines if edit.action == "replace" else [])
+
+    for position in inserts:
+        for start, (end, _) in ranges.items():
+            if start < position <= end:
+                raise ValueError(f"insert at line {position} falls inside lines {start}-{end} of another edit")
+
+    output = []
+
+    def extend(new_lines):
+        # a last line without line break must get one before anything is added after it
+        if new_lines and output and not output[-1].endswith(('\n', '\r')):
+            output[-1] += newline
+        output.extend(new_lines)
+
+    number = 1
+    while number <= len(lines) + 1:
+        extend(inserts.get(number, []))
+        if number in ranges:
+            end, new_lines = ranges[number]
+            extend(new_lines)
+            number = end + 1
+            continue
+        if number <= len(lines):
+            output.append(lines[number - 1])
+        number += 1
+    return "".join(output)
+
+
+def atomic_write(file_path: str, content: str):
+    """Write content to a temporary file next to file_path and rename it over the original."""
+    directory = os.path.dirname(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(file_path))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+            file.write(content)
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ApplyPatchInput(BaseModel):
+    patch: str = Field(description="A unified diff like `git diff` prints it. It may change several files and contain several hunks per file.")
+
+@tool(args_schema=ApplyPatchInput)
+def apply_patch(patch: str) -> str:
+    """
+    Apply a unified diff to the repository. Prefer this over overwrite_file: only send the changed
+    lines with about 3 lines of context. Hunks are located even if the line numbers are off or the
+    indentation of context lines differs slightly. Hunks that cannot be located are rejected and
+    reported; all other hunks are applied, so only resend the rejected ones.
+
+    Args:
+        patch (str): The unified diff, with '--- a/<path>' and '+++ b/<path>' headers per file.
+
+    Returns:
+        str: Which hunks were applied or rejected per file, or an error message.
+    """
+    try:
+        file_patches = patching.parse_patch(patch)
+    except patching.PatchError as e:
+        return f"Error: {e}"
+
+    report = []
+    repo_path = current_workspace().repo_path
+    for file_patch in file_patches:
+        file_path = os.path.normpath(os.path.join(repo_path, file_patch.path))
+        if not is_in_repo(file_path, repo_path):
+            report.append(f"{file_patch.path}: Error: File '{file_path}' is outside the repository")
+            continue
+        if '.git' in file_path or is_in_git_dir(file_path):
+            report.append(f"{file_patch.path}: Error: File '{file_path}' is inside forbidden dir")
+            continue
+
+        if file_patch.new_path is None:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                file_changed(file_path)
+            report.append(f"{file_patch.path}: deleted")
+            continue
+
+        newline, trailing_newline, lines = '\n', True, []
+        if file_patch.old_path is None and os.path.exists(file_path):
+            report.append(f"{file_patch.path}: Error: File '{file_path}' already exists; patch it against its "
+                          f"current content instead of creating it from /dev/null.")
+            continue
+        if file_patch.old_path is not None:
+            if not os.path.exists(file_path):
+                report.append(f"{file_patch.path}: Error: File '{file_path}' not found.")
+                continue
+            with open(file_path, 'r', encoding='utf-8', newline='') as file:
+                content = file.read()
+            newline = '\r\n' if '\r\n' in content else '\n'
+            trailing_newline = content.endswith('\n')
+            # split on line breaks only; str.splitlines() would also split on form feeds and the like
+            lines = content.replace('\r\n', '\n').split('\n') if content else []
+            if trailing_newline:
+                lines.pop()
+
+        new_lines, notes, rejected = patching.apply_hunks(lines, file_patch.hunks)
+        if len(rejected) < len(file_patch.hunks):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            atomic_write(file_path, newline.join(new_lines) + (newline if trailing_newline and new_lines else ''))
+            file_changed(file_path)
+        report.append(f"{file_patch.path}: {len(file_patch.hunks) - len(rejected)}/{len(file_patch.hunks)} hunks applied")
+        report.extend("  " + note for note in notes)
+        report.extend("  " + str(rejection).replace("\n", "\n    ") for rejection in rejected)
+    return "\n".join(report)
+
+
+class ReplaceDefinitionInput(BaseModel):
+    file_path: str
+    qualified_name: str = Field(description="The class, function or method to edit, e.g. 'QuerySet.get_or_create' or 'django.db.models.query.QuerySet.get_or_create'.")
+    new_source: str = Field(description="Complete source of the new definition, including decorators. Its indentation is adjusted automatically.")
+    mode: Literal["replace", "insert_before", "insert_after"] = Field(default="replace", description="Replace the definition or add new_source before or after it.")
+
+@tool(args_schema=ReplaceDefinitionInput)
+def reindent(source: str, indent: str) -> List[str]:
+    """
+    The lines of `source` moved from their common indentation to `indent`. Lines that start inside
+    a multi-line string keep their exact text, since their whitespace is part of the string's value.
+    """
+    lines = source.strip("\n").split("\n")
+    in_string = set()
+    try:
+        for token in tokenize.generate_tokens(io.StringIO("\n".join(lines) + "\n").readline):
+            in_string.update(range(token.start[0], token.end[0]))  # 0-based indices of the rows after the first
+    except (tokenize.TokenError, SyntaxError):
+        pass  # not valid Python; the compile check of the result reports it
+    code = [line for number, line in enumerate(lines) if number not in in_string and line.strip()]
+    common = os.path.commonprefix([line[:len(line) - len(line.lstrip())] for line in code])
+    return [line if number in in_string else (indent + line[len(common):].rstrip() if line.strip() else "")
+            for number, line in enumerate(lines)]
+
+
+def replace_definition(file_path: str, qualified_name: str, new_source: str, mode: str = "replace") -> str:
+    """
+    Replace a class, function or method in a Python file by its name, or insert new code right
+    before or after it. No line numbers or exact old text are needed, so this is the most reliable
+    way to rewrite a whole definition. The file is only written if it is still valid Python.
+
+    Returns:
+        str: Success with the new line span, or an error message.
+    """
+    file_path = current_workspace().resolve(file_path)
+    if '.git' in file_path or is_in_git_dir(file_path):
+        return f"Error: File '{file_path}' is inside forbidden dir"
+    if not os.path.exists(file_path):
+        return f"Error: File '{file_path}' not found."
+
+    symbols = outline_cache().outlines([file_path])[file_path]
+    if isinstance(symbols, str):
+        return f"Error: {file_path} {symbols}"
+    repo_path = current_workspace().repo_path
+    module = module_name(os.path.relpath(file_path, repo_path).replace(os.sep, "/"))
+    matches = lookup(symbols, qualified_name, module)
+    if not matches:
+        owner = qualified_name.strip().rpartition(".")[0]
+        if owner and not lookup(symbols, owner, module):
+            return f"Error: No class '{owner}' in {file_path}, so '{qualified_name}' cannot be edited there. Use outline to list its definitions."
+        return f"Error: No class, function or method '{qualified_name}' in {file_path}. Use outline to list its definitions."
+    if len(matches) > 1:
+        spans = ", ".join(f"L{symbol.line}-{symbol.end_line}" for symbol in matches)
+        return f"Error: '{qualified_name}' is defined {len(matches)} times in {file_path} ({spans}); edit it with replace_lines instead."
+    symbol = matches[0]
+
+    # newline='' keeps the file's line endings, and splitting like ast does keeps the line numbers aligned
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        lines = file.readlines()
+    newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    first = lines[symbol.line - 1]
+    indent = first[:len(first) - len(first.lstrip())]
+    new_lines = [line + newline for line in reindent(new_source, indent)]
+
+    start, end = symbol.line - 1, symbol.end_line
+    if lines[end - 1:end] and not lines[end - 1].endswith(('\n', '\r')):
+        lines[end - 1] += newline  # the definition ends the file without a trailing newline
+    separator = [newline] * (1 if indent else 2)
+    if mode == "replace":
+        lines[start:end] = new_lines
+        new_start = start
+    elif mode == "insert_before":
+        lines[start:start] = new_lines + separator
+        new_start = start
+    else:
+        lines[end:end] = separator + new_lines
+        new_start = end + len(separator)
+
+    content = "".join(lines)
+    try:
+        compile(content, file_path, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return f"Error: The result would not be valid Python ({e.msg} at line {e.lineno}); {file_path} was not changed."
+
+    atomic_write(file_path, content)
+    file_changed(file_path)
+    action = {"replace": "Replaced", "insert_before": "Inserted before", "insert_after": "Inserted after"}[mode]
+    return (f"{action} {symbol.kind} {symbol.qualname} in {file_path}; "
+            f"the new code is at lines {new_start + 1}-{new_start + len(new_lines)}")
+
+
 def is_in_git_dir(path: str) -> bool:
     path = os.path.abspath(os.path.normpath(path))
     git_dir = os.path.abspath(os.path.normpath('git'))
@@ -449,4 +840,13 @@ def is_in_git_dir(path: str) -> bool:
         return common == git_dir
     except ValueError:
         # If paths are on different drives (Windows), commonpath throws ValueError
-        return False
\ No newline at end of file
+        return False
+
+
+def is_in_repo(path: str, repo_path: str) -> bool:
+    """Whether `path` is `repo_path` or inside it, so "../" paths cannot reach other files."""
+    try:
+        return os.path.commonpath([os.path.realpath(path), os.path.realpath(repo_path)]) == os.path.realpath(repo_path)
+    except ValueError:
+        # different drives on Windows
+        return False
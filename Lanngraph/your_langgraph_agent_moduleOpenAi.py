@@ -9,32 +9,69 @@ from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langgraph.graph import StateGraph, END
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langchain_core.tools import tool
 from langchain.agents import AgentExecutor, create_tool_calling_agent,Tool
+from langchain.agents.agent import RunnableMultiActionAgent
 from pydantic import BaseModel
 
 
 from dotenv import load_dotenv
-import subprocess, requests, os, difflib
+import asyncio, json, subprocess, os, tempfile, time
+from contextlib import asynccontextmanager
 import tools
+from file_cache import release_workspace_cache
+from llm_cache import install_llm_cache
+from common.eval_cache import evaluate
+from common.instrumentation import current_metrics, timed_node, wrap_tool_run
+from common.bm25 import workspace_retriever
+from common.localization import localize
+from common.mirror import default_store
+from common.search_index import release_workspace_index, workspace_index
+from common.tracing import span
+from common.workspace import closing_workspace, guarded, use_workspace
 
 load_dotenv()
+install_llm_cache()
 
 api_key = os.getenv('openai_api_key')
 WORKSPACE_ROOT=os.getenv('WORKSPACE_ROOT')
 
+# Budgets of the coder -> tester -> coder repair loop
+MAX_ITERATIONS = int(os.getenv("MAX_REPAIR_ITERATIONS", "3"))
+MAX_TASK_SECONDS = float(os.getenv("MAX_TASK_SECONDS", "1800"))
+MAX_TASK_TOKENS = int(os.getenv("MAX_TASK_TOKENS", "500000"))
+
+# Speculative coding: with more than one branch the coder runs that many times concurrently, each
+# in its own worktree and at its own temperature, and the candidates are evaluated in parallel
+SPECULATIVE_BRANCHES = int(os.getenv("SPECULATIVE_BRANCHES", "1"))
+BRANCH_TEMPERATURES = [float(t) for t in (os.getenv("BRANCH_TEMPERATURES") or "0.0,0.4,0.7,1.0").split(",")
+                       if t.strip()] or [0.0]
+# How long a cancelled branch waits for its running tool calls before its worktree is removed anyway
+BRANCH_CLOSE_TIMEOUT = float(os.getenv("BRANCH_CLOSE_TIMEOUT", "120"))
+
 # -----------------------------
 # TypedDict for Graph State
 # -----------------------------
 class AgentState(TypedDict):
     input: str
+    problem_statement: Optional[str]
     repo_path: str
+    repo_url: Optional[str]
+    commit_hash: Optional[str]
     plan: Optional[str]
     code_diff: Optional[str]
     test_result: Optional[Dict[str, Any]]
     FAIL_TO_PASS: List[str]
     PASS_TO_PASS: List[str]
     instance_id: str
+    localization: Optional[str]
+    retrieved: Optional[str]
+    iteration: Optional[int]  # number of coder runs so far
+    tested_diff: Optional[str]  # the diff the last test_result belongs to
+    feedback: Optional[str]  # failing tests of the last evaluation, for the next coder run
+    candidates: Optional[List[Dict[str, Any]]]  # the branches of the speculative coder
+    worktree_patch: Optional[str]  # all changes of the repository, to restore them when a task resumes
 
 # -----------------------------
 # Setup local LLM ()
@@ -46,7 +83,32 @@ class AgentState(TypedDict):
 #    max_tokens=8096,
 #    api_key=api_key
 # )
-llm = init_chat_model("google_genai:gemini-2.0-flash")
+LLM_MODEL = "google_genai:gemini-2.0-flash"
+llm = init_chat_model(LLM_MODEL)
+# -----------------------------
+# LOCALIZER NODE
+# -----------------------------
+@timed_node("localizer")
+async def localizer_node(state: AgentState) -> Dict[str, Any]:
+    print("Localizer is ranking candidate files from the failing tests...")
+    repo_path = os.path.normpath(state["repo_path"])
+    index = await asyncio.to_thread(workspace_index, repo_path)
+    report = await asyncio.to_thread(localize, index, repo_path, state["FAIL_TO_PASS"],
+                                     state.get("problem_statement") or state["input"])
+    print("Localizer output:\n", report)
+    return {"localization": report, "iteration": 0}
+
+# -----------------------------
+# RETRIEVER NODE
+# -----------------------------
+@timed_node("retriever")
+async def retriever_node(state: AgentState) -> Dict[str, Any]:
+    print("Retriever is searching the repository for the bug report...")
+    retriever = await asyncio.to_thread(workspace_retriever, os.path.normpath(state["repo_path"]))
+    hits = retriever.search(state.get("problem_statement") or state["input"])
+    print("Retriever output:\n", hits)
+    return {"retrieved": hits}
+
 # -----------------------------
 # PLANNER NODE
 # -----------------------------
@@ -56,14 +118,25 @@ You are a software engineer. Given the following bug report and failing test cas
 Bug Description:
 {input}
 
+Failing tests and the code they most likely exercise (ranked by static analysis, may be incomplete):
+{localization}
+
+Files and definitions that best match the bug report (BM25 text search):
+{retrieved}
+
 Write your step-by-step plan below:
 """)
 
 planner_chain = PLANNER_PROMPT | llm | StrOutputParser()
 
-def planner_node(state: AgentState) -> Dict[str, Any]:
+@timed_node("planner")
+async def planner_node(state: AgentState) -> Dict[str, Any]:
     print("Planner is generating a plan...")
-    plan = planner_chain.invoke({"input": state["input"]})
+    plan = await planner_chain.ainvoke({
+        "input": state["input"],
+        "localization": state.get("localization") or "(none)",
+        "retrieved": state.get("retrieved") or "(none)",
+    })
     print("Planner output:\n", plan)
     return {"plan": plan}
 
@@ -79,7 +152,6 @@ def list_python_files(repo_path: str) -> list:
     if not os.path.isabs(repo_path):
         repo_path = os.path.join(WORKSPACE_ROOT, repo_path)
 
-    repo_path = r"D:\ProgrammingProjekts\ASE\repos\repo_13"
     py_files = []
     for root, _, files in os.walk(repo_path):
         for file in files:
@@ -94,27 +166,10 @@ def read_file(file_path: str) -> str:
     with open(file_path, "r", encoding="utf-8") as f:
         return f.read()
 
-class ApplyPatchInput(BaseModel):
-    file_path: str
-    diff: str
-
-#@tool(args_schema=ApplyPatchInput)
-def apply_patch(file_path: str, diff: str) -> str:
-    """
-    Apply a unified-diff patch to the file at file_path.
-    Only the hunks present in `diff` are applied.
-    """
-    print("Apply Patch:  " + file_path)
-    file_path = file_path.strip('"').strip("'")
-    print("Apply Patch:  " + file_path)
-
-    original = open(file_path, 'r', encoding='utf-8').read().splitlines(keepends=True)
-    patched = ''.join(difflib.restore(diff.splitlines(keepends=True), 1))
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(patched)
-    return f"Patch applied to {file_path}"
-
-toolSetO=[tools.replace_string,tools.list_files_in_repository,tools.list_dir,tools.read_file,tools.delete_lines,tools.insert_at_line,tools.replace_lines_tool,tools.overwrite_file,tools.find_and_replace]
+toolSetO=[tools.replace_string,tools.list_files_in_repository,tools.list_dir,tools.search_code,tools.find_symbol,tools.outline,tools.read_file,tools.delete_lines,tools.insert_at_line,tools.replace_lines_tool,tools.batch_edit,tools.replace_definition,tools.apply_patch,tools.overwrite_file,tools.find_and_replace]
+# a cancelled speculative branch waits for its running tool calls before its worktree is removed
+for _tool in toolSetO:
+    wrap_tool_run(_tool, guarded)
 
 # -----------------------------
 # CODER NODE
@@ -135,60 +190,305 @@ coder_prompt = ChatPromptTemplate.from_messages([
 ])
 
 prompt = coder_prompt  # your structured prompt from above
-agent = create_tool_calling_agent(llm, toolSetO, prompt)
-agent_executor = AgentExecutor(agent=agent, tools=toolSetO, verbose=True)
+
+
+def build_coder_executor(model) -> AgentExecutor:
+    agent = create_tool_calling_agent(model, toolSetO, prompt)
+    # stream_runnable=False: the executor invokes the model instead of streaming it, and only
+    # invoked calls go through the LLM cache
+    return AgentExecutor(agent=RunnableMultiActionAgent(runnable=agent, stream_runnable=False),
+                         tools=toolSetO, verbose=True)
+
+
+agent_executor = build_coder_executor(llm)
+_branch_executors = {}
+
+
+def branch_executor(temperature: float) -> AgentExecutor:
+    """The coder executor of a speculative branch, on a model sampling at `temperature`."""
+    if temperature not in _branch_executors:
+        _branch_executors[temperature] = build_coder_executor(init_chat_model(LLM_MODEL, temperature=temperature))
+    return _branch_executors[temperature]
 
 
 #agent_executor = initialize_agent( tools, llm, agent="zero-shot-react-description", verbose=True)
+def coder_input(state: AgentState) -> str:
+    text = state["plan"]
+    if state.get("retrieved"):
+        text += f"\n\nFiles and definitions that best match the bug report:\n{state['retrieved']}"
+    if state.get("feedback"):
+        text += (f"\n\nYour previous change was applied, but the tests still fail. The current diff is:\n"
+                 f"{state['tested_diff'] or '(empty)'}\n\n{state['feedback']}\n"
+                 f"Revise the code so these tests pass; do not start over from scratch.")
+    return text
+
 # --- CODER NODE ---
-def coder_node(state: AgentState) -> Dict[str, Any]:
+@timed_node("coder")
+async def coder_node(state: AgentState) -> Dict[str, Any]:
     print("Coder agent is repairing the code...")
-    result = agent_executor.invoke({
-        "input": state["plan"],
+    result = await agent_executor.ainvoke({
+        "input": coder_input(state),
         "repo_path": state["repo_path"]
     })
 
-
-    diff = subprocess.run(["git", "diff"], cwd=state["repo_path"], capture_output=True, text=True)
-    return {"code_diff": diff.stdout}
+    # the worktree patch, unlike `git diff`, includes the files the coder created, so a change that only
+    # adds a file still counts as a change
+    with span("git diff", "git"):
+        patch = await asyncio.to_thread(worktree_patch, state["repo_path"])
+    return {"code_diff": patch, "worktree_patch": patch, "iteration": (state.get("iteration") or 0) + 1}
 # -----------------------------
 # TESTER NODE
 # -----------------------------
-def run_tests(repo_path: str, fail_tests: list, pass_tests: list, instance_id: str) -> dict:
+async def run_tests(repo_path: str, fail_tests: list, pass_tests: list, instance_id: str) -> dict:
     payload = {
         "instance_id": instance_id,
-        "repoDir": repo_path.replace("\\", "/").replace("D:/ProgrammingProjekts/ASE", ""),  # adjust for Docker mount
+        # WORKSPACE_ROOT is mounted as /repos in docker, as in agentMain.evaluate_task
+        "repoDir": f"/repos/{os.path.basename(os.path.normpath(repo_path))}",
         "FAIL_TO_PASS": fail_tests,
         "PASS_TO_PASS": pass_tests
     }
-    res = requests.post("http://localhost:8082/test", json=payload)
-    res.raise_for_status()
-    return res.json()
+    return await evaluate(repo_path, payload)
 
-def tester_node(state: AgentState) -> Dict[str, Any]:
+@timed_node("tester")
+async def tester_node(state: AgentState) -> Dict[str, Any]:
     print("Tester is running test suite...")
-    result = run_tests(
+    result = await run_tests(
         repo_path=state["repo_path"],
         fail_tests=state["FAIL_TO_PASS"],
         pass_tests=state["PASS_TO_PASS"],
         instance_id=state["instance_id"]
     )
     print("Test results:", result)
-    return {"test_result": result}
+    return {"test_result": result, "tested_diff": state["code_diff"], "feedback": test_feedback(result)}
+
+
+def tests_status(result: dict) -> Optional[dict]:
+    """The "tests_status" of an evaluation's harness output, or None if it has none."""
+    harness_output = json.loads(result.get("harnessOutput") or "{}")
+    if not harness_output:
+        return None
+    return (next(iter(harness_output.values())) or {}).get("tests_status") or None
+
+
+def test_feedback(result: dict) -> Optional[str]:
+    """The failing tests of an evaluation as text for the coder, or None if everything passed."""
+    if result.get("pregate"):
+        return result["pregate"]
+    status = tests_status(result)
+    if status is None:
+        return "The evaluation returned no results; the change may break the test run (e.g. a syntax or import error)."
+    failing = []
+    for group in ("FAIL_TO_PASS", "PASS_TO_PASS"):
+        failures = status.get(group, {}).get("failure", [])
+        if failures:
+            failing.append(f"{group} tests failing ({len(failures)}):\n" + "\n".join(f"  {test}" for test in failures[:30]))
+    return "\n".join(failing) or None
+
+
+def test_score(result: dict) -> tuple:
+    """(FAIL_TO_PASS passed, PASS_TO_PASS passed) of an evaluation, for ranking candidates."""
+    status = tests_status(result) or {}
+    return (len(status.get("FAIL_TO_PASS", {}).get("success", [])),
+            len(status.get("PASS_TO_PASS", {}).get("success", [])))
+
+
+def budget_exceeded(state: AgentState) -> Optional[str]:
+    if (state.get("iteration") or 0) >= MAX_ITERATIONS:
+        return f"iteration budget of {MAX_ITERATIONS} used"
+    metrics = current_metrics()
+    if metrics is not None and time.time() - metrics.started_at > MAX_TASK_SECONDS:
+        return f"wall clock budget of {MAX_TASK_SECONDS:.0f}s used"
+    if metrics is not None and metrics.total_tokens > MAX_TASK_TOKENS:
+        return f"token budget of {MAX_TASK_TOKENS} used ({metrics.total_tokens} tokens)"
+    return None
+
+
+def route_after_coder(state: AgentState) -> str:
+    if state.get("tested_diff") is not None and state["code_diff"] == state["tested_diff"]:
+        print("Coder did not change the diff since the last evaluation, stopping")
+        return "stop_unchanged"
+    return "tester"
+
+
+def route_after_tester(state: AgentState) -> str:
+    if state.get("feedback") is None:
+        print("All tests pass")
+        return "stop_passed"
+    reason = budget_exceeded(state)
+    if reason:
+        print(f"Stopping the repair loop: {reason}")
+        return "stop_budget"
+    print(f"Tests still fail, starting repair iteration {state['iteration'] + 1}")
+    return "coder"
+
+# -----------------------------
+# SPECULATIVE CODER NODE
+# -----------------------------
+def worktree_patch(repo_path: str) -> str:
+    """All changes of a worktree, untracked files included, as a binary patch; its index is left alone."""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmp, "index"))
+        subprocess.run(["git", "add", "-A"], cwd=repo_path, env=env, check=True, capture_output=True)
+        return subprocess.run(["git", "diff", "--cached", "--binary", "HEAD"], cwd=repo_path, env=env, check=True,
+                              capture_output=True, text=True).stdout
+
+
+def apply_worktree_patch(repo_path: str, patch: str):
+    subprocess.run(["git", "apply", "--binary", "--whitespace=nowarn", "-"], cwd=repo_path, input=patch,
+                   check=True, capture_output=True, text=True)
+
+
+async def run_branch(state: AgentState, candidate: Dict[str, Any]):
+    """Run the coder in a fresh worktree of the task's commit and evaluate what it changed into `candidate`."""
+    branch_path = candidate["repo_path"]
+    store = default_store()
+    started = time.perf_counter()
+    try:
+        with span(f"branch {candidate['branch']}", "node", temperature=candidate["temperature"]), \
+                use_workspace(os.path.dirname(branch_path), os.path.basename(branch_path)):
+            await asyncio.to_thread(guarded(store.add_worktree), state["repo_url"], state["commit_hash"], branch_path)
+            # the clean checkout loads the index of the task's commit instead of building its own
+            await asyncio.to_thread(guarded(workspace_index), branch_path, state["repo_url"], state["commit_hash"])
+            await branch_executor(candidate["temperature"]).ainvoke({
+                "input": coder_input(state),
+                "repo_path": branch_path
+            })
+            candidate["patch"] = await asyncio.to_thread(guarded(worktree_patch), branch_path)
+            result = await run_tests(branch_path, state["FAIL_TO_PASS"], state["PASS_TO_PASS"], state["instance_id"])
+            candidate["test_result"] = result
+            candidate["feedback"] = test_feedback(result)
+            candidate["score"] = test_score(result)
+            candidate["status"] = "passed" if candidate["feedback"] is None else "failed"
+    except Exception as e:
+        candidate["status"] = "error"
+        candidate["error"] = repr(e)
+    finally:
+        candidate["seconds"] = round(time.perf_counter() - started, 2)
+        await asyncio.to_thread(remove_branch_worktree, state["repo_url"], branch_path)
+
+
+def remove_branch_worktree(repo_url: str, branch_path: str):
+    """Remove a branch's worktree once the tool calls and git commands its cancelled task left running are done."""
+    with closing_workspace(branch_path, BRANCH_CLOSE_TIMEOUT) as idle:
+        if not idle:
+            print(f"Calls on {branch_path} still running after {BRANCH_CLOSE_TIMEOUT:.0f}s, removing it anyway")
+        release_workspace_index(branch_path)
+        release_workspace_cache(branch_path)
+        default_store().remove_worktree(repo_url, branch_path)
+
+
+@timed_node("speculative coder")
+async def speculative_coder_node(state: AgentState) -> Dict[str, Any]:
+    print(f"Running {SPECULATIVE_BRANCHES} coder branches...")
+    repo_path = os.path.normpath(state["repo_path"])
+    candidates = [{"branch": branch, "temperature": BRANCH_TEMPERATURES[branch % len(BRANCH_TEMPERATURES)],
+                   "repo_path": f"{repo_path}-c{branch}", "status": "cancelled", "patch": "", "score": (0, 0),
+                   "test_result": None, "feedback": None, "error": None, "seconds": None}
+                  for branch in range(SPECULATIVE_BRANCHES)]
+    branches = [asyncio.create_task(run_branch(state, candidate)) for candidate in candidates]
+    winner = None
+    try:
+        for finished in asyncio.as_completed(branches):
+            await finished
+            passing = [candidate for candidate in candidates if candidate["status"] == "passed"]
+            if passing:
+                winner = passing[0]
+                break
+    finally:
+        # stop the branches still running; each one removes its worktree on the way out
+        for branch in branches:
+            branch.cancel()
+        await asyncio.gather(*branches, return_exceptions=True)
+
+    if winner is None:
+        finished = [candidate for candidate in candidates if candidate["status"] == "failed" and candidate["patch"]]
+        winner = max(finished, key=lambda candidate: candidate["score"], default=None)
+    for candidate in candidates:
+        print(f"  branch {candidate['branch']} (temperature {candidate['temperature']}): {candidate['status']}, "
+              f"score {candidate['score']}, {candidate['seconds']}s" + (f", {candidate['error']}" if candidate["error"] else ""))
+
+    if winner is not None:
+        print(f"Applying the diff of branch {winner['branch']}")
+        # the task's repository gets the same working tree diff, so evaluating it again hits the eval cache
+        await asyncio.to_thread(apply_worktree_patch, repo_path, winner["patch"])
+    with span("git diff", "git"):
+        diff = await asyncio.to_thread(worktree_patch, repo_path)
+    return {
+        "candidates": [{key: value for key, value in candidate.items() if key not in ("patch", "test_result")}
+                       for candidate in candidates],
+        "code_diff": diff,
+        "worktree_patch": winner["patch"] if winner else "",
+        "tested_diff": diff,
+        "test_result": winner["test_result"] if winner else None,
+        "feedback": winner["feedback"] if winner else "None of the coder branches produced a change.",
+        "iteration": (state.get("iteration") or 0) + 1,
+    }
 
 # -----------------------------
 # LANGGRAPH COMPOSITION
 # -----------------------------
 builder = StateGraph(AgentState)
 
+builder.add_node("localizer", localizer_node)
+builder.add_node("retriever", retriever_node)
 builder.add_node("planner", planner_node)
 builder.add_node("coder", coder_node)
+builder.add_node("tester", tester_node)
+if SPECULATIVE_BRANCHES > 1:
+    builder.add_node("speculative_coder", speculative_coder_node)
 
 
-builder.set_entry_point("planner")
-builder.add_edge("planner", "coder")
+builder.set_entry_point("localizer")
+builder.add_edge("localizer", "retriever")
+builder.add_edge("retriever", "planner")
+if SPECULATIVE_BRANCHES > 1:
+    # the first attempt fans out; the branches are evaluated already, so repairs continue from the winner
+    builder.add_edge("planner", "speculative_coder")
+    builder.add_conditional_edges("speculative_coder", route_after_tester,
+                                  {"coder": "coder", "stop_passed": END, "stop_budget": END})
+else:
+    builder.add_edge("planner", "coder")
 
-builder.add_edge("coder", END)
+builder.add_conditional_edges("coder", route_after_coder, {"tester": "tester", "stop_unchanged": END})
+builder.add_conditional_edges("tester", route_after_tester,
+                              {"coder": "coder", "stop_passed": END, "stop_budget": END})
 
 
 coding_agent = builder.compile()
+
+
+def checkpoint_path() -> str:
+    return os.getenv("CHECKPOINT_DB") or os.path.join(WORKSPACE_ROOT or "", "checkpoints.db")
+
+
+@asynccontextmanager
+async def checkpointed_agent(path: str = None):
+    """
+    The coding agent compiled with a SQLite checkpointer ($CHECKPOINT_DB or WORKSPACE_ROOT/checkpoints.db):
+    the state is saved after every node under the run's thread_id, so an interrupted task can
+    resume with the node it did not finish (see run_agent).
+    """
+    async with AsyncSqliteSaver.from_conn_string(path or checkpoint_path()) as saver:
+        yield builder.compile(checkpointer=saver)
+
+
+async def run_agent(graph, agent_input: AgentState, config: dict, fresh: bool = False) -> Dict[str, Any]:
+    """
+    Run a checkpointed graph on a task, continuing an earlier run of the same thread_id if one was
+    interrupted, or returning its final state if it had finished. `fresh` discards earlier runs.
+    """
+    thread_id = config["configurable"]["thread_id"]
+    if fresh:
+        await graph.checkpointer.adelete_thread(thread_id)
+    snapshot = await graph.aget_state(config)
+    if not snapshot.values:
+        return await graph.ainvoke(agent_input, config=config)
+
+    # the repository was checked out again; restore the changes the checkpointed state belongs to
+    if snapshot.values.get("worktree_patch"):
+        await asyncio.to_thread(apply_worktree_patch, agent_input["repo_path"], snapshot.values["worktree_patch"])
+    if not snapshot.next:
+        print(f"Reusing the finished agent run of {thread_id}")
+        return snapshot.values
+    print(f"Resuming the agent run of {thread_id} at {', '.join(snapshot.next)}")
+    return await graph.ainvoke(None, config=config)
@@ -1,14 +1,27 @@
 import asyncio
-import json
 import os
-import requests
 import subprocess
+import sys
+import time
 from dotenv import load_dotenv
 
 # Prevent PraisonAI from crashing if OpenAI variables are missing
 os.environ.setdefault("OPENAI_API_KEY", "not-needed")
 os.environ.setdefault("OPENAI_API_BASE", "http://localhost:1234/v1")
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.batch import record_result, tasks_to_run
+from common.bm25 import release_workspace_retriever, workspace_retriever
+from common.mirror import default_store
+from common.eval_cache import evaluate
+from common.instrumentation import Metrics, install_litellm_hooks, timed_tool, track_task
+from common.results_store import TaskResult, repo_name
+from common.service_client import close_client
+from common.search_index import release_workspace_index
+from common.task_store import load_task
+from common.tracing import Trace, span, trace_dir, use_trace
+from common.workspace import use_workspace
 from prompts import planner_prompt, coder_prompt, tester_prompt
 from praisonaiagents import Agent, Agents, Tools
 from praisonaiagents.tools import execute_code, analyze_code, format_code, lint_code, disassemble_code
@@ -24,10 +37,8 @@ os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "FALSE"
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
 
-API_URL = "http://localhost:8081/task/index/"
-TEST_URL = "http://localhost:8082/test"
 REPOS_DIR = "repos"
-LOG_FILE = "results.log"
+RUNNER = "praisonai"
 WORKSPACE_ROOT = os.environ.get("WORKSPACE_ROOT")
 os.environ.get("WORKSPACE_ROOT")
 os.environ["GOOGLE_API_KEY"] = API_KEY
@@ -49,116 +60,106 @@ llm_config = {
 
 async def handle_task(index):
 
-    print(f"Fetching test case {index} from {API_URL}...")
-    repo_dir = os.path.join(WORKSPACE_ROOT, f"repo_{index}")  # Use unique repo directory per task
-    start_dir = os.getcwd()  # Remember original working directory
-    os.environ["REPO_NAME"] = f"repo_{index}"
-    load_dotenv()
-
-    try:
-        response = requests.get(f"{API_URL}{index}")
-        if response.status_code != 200:
-            raise Exception(f"Invalid response: {response.status_code}")
-
-        testcase = response.json()
-        prompt = testcase["Problem_statement"]
-        git_clone = testcase["git_clone"]
-        fail_tests = json.loads(testcase.get("FAIL_TO_PASS", "[]"))
-        pass_tests = json.loads(testcase.get("PASS_TO_PASS", "[]"))
-        instance_id = testcase["instance_id"]
-
-        # Extract repo URL and commit hash
-        parts = git_clone.split("&&")
-        clone_part = parts[0].strip()
-        checkout_part = parts[-1].strip() if len(parts) > 1 else None
-
-        repo_url = clone_part.split()[2]
-
-        print(f"Cloning repository {repo_url} into {repo_dir}...")
-        env = os.environ.copy()
-        env["GIT_TERMINAL_PROMPT"] = "0"
-        if not os.path.isdir(os.environ.get('WORKSPACE_ROOT', '') +'\\'+ os.environ.get('REPO_NAME', '')):
-            subprocess.run(["git", "clone", repo_url, repo_dir], check=True, env=env)
-
-        if checkout_part:
-           commit_hash = checkout_part.split()[-1]
-           print(f"Checking out commit: {commit_hash}")
-           subprocess.run(["git", "checkout", commit_hash], cwd=repo_dir, check=True, env=env)
-
-
-        tools = [execute_code, analyze_code, format_code, lint_code, disassemble_code]
-
-        planner = Agent(
-            instructions=planner_prompt,
-            llm=llm_config
-        )
-
-        coder = Agent(
-            instructions=coder_prompt,
-            llm=llm_config,
-            tools=tools
-        )
-
-        tester = Agent(
-            instructions=tester_prompt,
-            llm=llm_config,
-            tools=tools
-        )
-
-        agents = Agents(agents=[planner, coder, tester])
-
-        full_prompt = (
-            f"Work in the directory: {os.environ.get("WORKSPACE_ROOT")}\\repo_{index}. This is a Git repository.\n"
-            f"Your goal is to fix the problem described below.\n"
-            f"All code changes must be saved to the files, so they appear in `git diff`.\n"
-            f"Problem description:\n"
-            f"{prompt}\n\n"
-            f"Make sure the fix is minimal and only touches what's necessary to resolve the failing tests."
-        )
-
-        agents.start(task_content=full_prompt)
-
-        test_payload = {
-            "instance_id": instance_id,
-            "repoDir": f"/repos/repo_{index}",
-            "FAIL_TO_PASS": fail_tests,
-            "PASS_TO_PASS": pass_tests
-        }
-
-        res = requests.post(TEST_URL, json=test_payload)
-        res.raise_for_status()
-        result_raw = res.json().get("harnessOutput", "{}")
-        result_json = json.loads(result_raw)
-        if not result_json:
-            raise ValueError("No data in harnessOutput – possible evaluation error or empty result")
-        instance_id = next(iter(result_json))
-        tests_status = result_json[instance_id]["tests_status"]
-        fail_pass_results = tests_status["FAIL_TO_PASS"]
-        fail_pass_total = len(fail_pass_results["success"]) + len(fail_pass_results["failure"])
-        fail_pass_passed = len(fail_pass_results["success"])
-        pass_pass_results = tests_status["PASS_TO_PASS"]
-        pass_pass_total = len(pass_pass_results["success"]) + len(pass_pass_results["failure"])
-        pass_pass_passed = len(pass_pass_results["success"])
-
-        # Log results
-        os.chdir(start_dir)
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\n--- TESTCASE {index} ---\n")
-            log.write(f"FAIL_TO_PASS passed: {fail_pass_passed}/{fail_pass_total}\n")
-            log.write(f"PASS_TO_PASS passed: {pass_pass_passed}/{pass_pass_total}\n")
-        print(f"Test case {index} completed and logged.")
-
-    except Exception as e:
-        os.chdir(start_dir)
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\n--- TESTCASE {index} ---\n")
-            log.write(f"Error: {e}\n")
-        print(f"Error in test case {index}: {e}")
+    print(f"Loading test case {index}...")
+    with use_workspace(WORKSPACE_ROOT, f"repo_{index}") as workspace, \
+            track_task(f"repo_{index}") as metrics, use_trace(Trace(f"repo_{index}")) as trace:
+        repo_dir = workspace.repo_path  # Use unique repo directory per task
+        repo_url = None
+        result = TaskResult(RUNNER, index)
+        error = None
+        started = time.perf_counter()
+        load_dotenv()
+
+        try:
+            with span("fetch task", "http"):
+                record = await load_task(index)
+            prompt = record.problem_statement
+            fail_tests = record.fail_to_pass
+            pass_tests = record.pass_to_pass
+            instance_id = record.instance_id
+            repo_url = record.repo_url
+            commit_hash = record.commit_hash
+            result.instance_id, result.repo = instance_id, repo_name(repo_url)
+            print(f"Checking out {repo_url} at {commit_hash or 'HEAD'} into {repo_dir}...")
+            with span("checkout", "git"):
+                await asyncio.to_thread(default_store().add_worktree, repo_url, commit_hash, repo_dir)
+            with span("index", "index"):
+                retriever = await asyncio.to_thread(workspace_retriever, repo_dir, repo_url, commit_hash)
+                retrieved = retriever.search(prompt)
+            result.timings["prepare"] = time.perf_counter() - started
+
+            tools = [timed_tool(tool) for tool in (execute_code, analyze_code, format_code, lint_code, disassemble_code)]
+
+            planner = Agent(
+                instructions=planner_prompt,
+                llm=llm_config
+            )
+
+            coder = Agent(
+                instructions=coder_prompt,
+                llm=llm_config,
+                tools=tools
+            )
+
+            tester = Agent(
+                instructions=tester_prompt,
+                llm=llm_config,
+                tools=tools
+            )
+
+            agents = Agents(agents=[planner, coder, tester])
+
+            full_prompt = (
+                f"Work in the directory: {repo_dir}. This is a Git repository.\n"
+                f"Your goal is to fix the problem described below.\n"
+                f"All code changes must be saved to the files, so they appear in `git diff`.\n"
+                f"Problem description:\n"
+                f"{prompt}\n\n"
+                f"Files and definitions that best match the problem description (BM25 text search):\n"
+                f"{retrieved}\n\n"
+                f"Make sure the fix is minimal and only touches what's necessary to resolve the failing tests."
+            )
+
+            with span("agents", "node"):
+                agents.start(task_content=full_prompt)
+            result.timings["agent"] = time.perf_counter() - started - result.timings["prepare"]
+
+            test_payload = {
+                "instance_id": instance_id,
+                "repoDir": f"/repos/repo_{index}",
+                "FAIL_TO_PASS": fail_tests,
+                "PASS_TO_PASS": pass_tests
+            }
+
+            res = await evaluate(repo_dir, test_payload)
+            result.add_tests(res)
+            result.timings["evaluate"] = time.perf_counter() - started - sum(result.timings.values())
+
+        except Exception as e:
+            error = e
+
+        finally:
+            release_workspace_retriever(repo_dir)
+            release_workspace_index(repo_dir)
+            if repo_url:
+                with span("remove worktree", "git"):
+                    await asyncio.to_thread(default_store().remove_worktree, repo_url, repo_dir)
+            print(f"Trace of test case {index} written to {trace.save(trace_dir())}")
+            await record_result(result, error, metrics)
+        print(metrics.summary())
+        return metrics
 
 
 async def main():
     #for i in range(1, 10):
-        await handle_task(13)
+        install_litellm_hooks()
+        sweep = Metrics("sweep", tasks=0)
+        try:
+            for index in tasks_to_run(RUNNER, [13]):
+                sweep.merge(await handle_task(index))
+        finally:
+            print(sweep.summary())
+            await close_client()
 
 
 if __name__ == "__main__":
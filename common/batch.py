@@ -0,0 +1,37 @@
+import asyncio
+from typing import List, Optional
+
+from common.instrumentation import Metrics
+from common.ledger import default_ledger
+from common.results_store import TaskResult, default_results_store
+
+
+async def record_result(result: TaskResult, error: Optional[BaseException] = None, metrics: Optional[Metrics] = None):
+    """
+    Write the outcome of a task to the results store and, unless it raised `error`, mark it as
+    finished in the ledger. Shared by all runners so the two stay in the same order.
+    """
+    if error is not None:
+        result.error = f"{type(error).__name__}: {error}"
+    if metrics is not None:
+        result.add_metrics(metrics)
+    result.seconds = sum(result.timings.values())
+    store = default_results_store()
+    store.record(result)
+    if error is None:
+        # the ledger must never list a task whose result is still only queued
+        await asyncio.to_thread(store.flush)
+        default_ledger().mark_done(result.framework, result.task_index, result.instance_id)
+    print(result.summary())
+
+
+def tasks_to_run(runner: str, indices: List[int], rerun: bool = False) -> List[int]:
+    """
+    The tasks of a sweep: those a previous run of `runner` finished are skipped, unless `rerun`
+    drops them from the ledger to run them again.
+    """
+    ledger = default_ledger()
+    if rerun:
+        ledger.forget(runner, indices)
+        return list(indices)
+    return ledger.pending(runner, indices)
@@ -0,0 +1,145 @@
+import heapq
+import math
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from common.code_tokens import code_tokens, token_counts
+from common.localization import is_test_path
+from common.search_index import read_text, workspace_index
+from common.symbols import Symbol
+from common.tracing import traced
+
+K1 = 1.2
+B = 0.75
+
+
+@dataclass(frozen=True)
+class Document:
+    path: str
+    symbol: Optional[Symbol] = None  # None if the document is the whole file
+
+    def label(self) -> str:
+        if self.symbol is None:
+            return self.path
+        return f"{self.path}:{self.symbol.line}-{self.symbol.end_line} {self.symbol.kind} {self.symbol.qualname}"
+
+
+class BM25Index:
+    """Okapi BM25 over code tokens; postings are kept as compact arrays of (document, term frequency)."""
+
+    def __init__(self, k1: float = K1, b: float = B):
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Document] = []
+        self.lengths = array("i")
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.idf: Dict[str, float] = {}
+        self._norms: List[float] = []
+
+    def add(self, document: Document, counts: Counter):
+        """Add a document given the number of occurrences of each of its tokens."""
+        doc_id = len(self.documents)
+        self.documents.append(document)
+        self.lengths.append(sum(counts.values()))
+        for token, count in counts.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = (array("i"), array("i"))
+            postings[0].append(doc_id)
+            postings[1].append(count)
+
+    def finalize(self):
+        """Compute the collection statistics; call once after the last add()."""
+        count = len(self.documents)
+        average = sum(self.lengths) / count if count else 1.0
+        self.idf = {token: math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+                    for token, (ids, _) in self.postings.items()}
+        self._norms = [self.k1 * (1 - self.b + self.b * length / average) for length in self.lengths]
+
+    def query(self, text: str, top_k: int = 10) -> List[Tuple[float, Document]]:
+        scores: Dict[int, float] = {}
+        k1_plus_1 = self.k1 + 1
+        norms = self._norms
+        for token in set(code_tokens(text)):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            idf = self.idf[token]
+            for doc_id, frequency in zip(*postings):
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * k1_plus_1 / (frequency + norms[doc_id])
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, self.documents[doc_id]) for doc_id, score in best]
+
+
+class Retriever:
+    """
+    Lexical retrieval over the non-test Python files of a repository and over their definitions,
+    e.g. to find the code a bug report talks about.
+    """
+
+    def __init__(self):
+        self.files = BM25Index()
+        self.definitions = BM25Index()
+        self.build_seconds = 0.0
+
+    @traced("bm25 build", "index")
+    def build(self, repo_path: str, symbols: Dict[str, List[Symbol]]):
+        started = time.perf_counter()
+        for path in sorted(symbols):
+            if is_test_path(path):
+                continue
+            text = read_text(os.path.join(repo_path, path))
+            if text is None:
+                continue
+            self.files.add(Document(path), token_counts(path) + token_counts(text))
+            lines = text.splitlines()
+            file_symbols = symbols[path]
+            for position, symbol in enumerate(file_symbols):
+                end = symbol.end_line
+                if symbol.kind == "class" and position + 1 < len(file_symbols):
+                    # a class document is its header, docstring and attributes; the methods are documents of their own
+                    end = min(end, max(file_symbols[position + 1].line - 1, symbol.line))
+                self.definitions.add(Document(path, symbol), token_counts("\n".join(lines[symbol.line - 1:end])))
+        self.files.finalize()
+        self.definitions.finalize()
+        self.build_seconds = time.perf_counter() - started
+
+    def search(self, query: str, top_files: int = 10, top_definitions: int = 10) -> str:
+        """The best matching files and definitions for the query, one per line with their scores."""
+        started = time.perf_counter()
+        files = self.files.query(query, top_files)
+        definitions = self.definitions.query(query, top_definitions)
+        print(f"BM25 query took {(time.perf_counter() - started) * 1000:.0f}ms")
+        lines = ["Files:"]
+        lines.extend(f"  {document.label()} ({score:.1f})" for score, document in files)
+        lines.append("Definitions:")
+        lines.extend(f"  {document.label()} ({score:.1f})" for score, document in definitions)
+        return "\n".join(lines)
+
+
+_retrievers: Dict[str, Retriever] = {}
+_retrievers_lock = threading.Lock()
+
+
+def workspace_retriever(repo_path: str, repo_url: Optional[str] = None, commit: Optional[str] = None) -> Retriever:
+    """The retriever of a workspace, built once from its search index and kept until released."""
+    with _retrievers_lock:
+        retriever = _retrievers.get(repo_path)
+    if retriever is not None:
+        return retriever
+    retriever = Retriever()
+    retriever.build(repo_path, workspace_index(repo_path, repo_url, commit).symbol_table())
+    print(f"BM25 index for {repo_path}: {len(retriever.files.documents)} files, "
+          f"{len(retriever.definitions.documents)} definitions, built in {retriever.build_seconds:.2f}s")
+    with _retrievers_lock:
+        return _retrievers.setdefault(repo_path, retriever)
+
+
+def release_workspace_retriever(repo_path: str):
+    with _retrievers_lock:
+        _retrievers.pop(repo_path, None)
@@ -0,0 +1,66 @@
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import List, Set, Tuple
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# lowerUpper boundaries, acronym boundaries ("HTTPResponse" -> HTTP, Response) and letter/digit runs
+CAMEL_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def split_identifier(identifier: str) -> List[str]:
+    """Split snake_case and camelCase identifiers into lower-case parts: "getHTTP_response2" -> get, http, response, 2."""
+    parts = []
+    for chunk in identifier.split("_"):
+        parts.extend(part.lower() for part in CAMEL_PART.findall(chunk))
+    return parts
+
+
+def token_set(text: str, min_length: int = 2) -> Set[str]:
+    """The distinct tokens of code_tokens(text); splits every distinct identifier only once."""
+    tokens = set()
+    for identifier in set(IDENTIFIER.findall(text)):
+        lowered = identifier.lower()
+        if len(lowered) >= min_length:
+            tokens.add(lowered)
+        if "_" in identifier or not (identifier.islower() or identifier.isupper()):
+            tokens.update(part for part in split_identifier(identifier) if len(part) >= min_length)
+    return tokens
+
+
+@lru_cache(maxsize=200_000)
+def _identifier_tokens(identifier: str, min_length: int) -> Tuple[str, ...]:
+    tokens = []
+    lowered = identifier.lower()
+    if len(lowered) >= min_length:
+        tokens.append(lowered)
+    parts = split_identifier(identifier)
+    if len(parts) > 1:
+        tokens.extend(part for part in parts if len(part) >= min_length)
+    return tuple(tokens)
+
+
+def token_counts(text: str, min_length: int = 2) -> Counter:
+    """How often each token of code_tokens(text) occurs; identifiers are split once and memoized."""
+    counts = Counter()
+    for identifier, count in Counter(IDENTIFIER.findall(text)).items():
+        for token in _identifier_tokens(identifier, min_length):
+            counts[token] += count
+    return counts
+
+
+def code_tokens(text: str, min_length: int = 2) -> List[str]:
+    """
+    Tokenize source code or prose: every identifier in lower case plus its snake/camel case parts.
+
+    "QuerySet.get_or_create" gives queryset, query, set, get_or_create, get, or, create.
+    """
+    tokens = []
+    for identifier in IDENTIFIER.findall(text):
+        lowered = identifier.lower()
+        if len(lowered) >= min_length:
+            tokens.append(lowered)
+        parts = split_identifier(identifier)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if len(part) >= min_length)
+    return tokens
@@ -0,0 +1,26 @@
+import functools
+import os
+import threading
+
+
+def default_path(env_var: str, file_name: str) -> str:
+    """$env_var, or file_name inside WORKSPACE_ROOT: where the process wide stores keep their files."""
+    return os.environ.get(env_var) or os.path.join(os.environ.get("WORKSPACE_ROOT", ""), file_name)
+
+
+def process_default(factory):
+    """
+    Decorator turning a factory into the getter of a process wide instance, created on the first
+    call under a lock so concurrent tasks never end up with two of them.
+    """
+    instance = None
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get():
+        nonlocal instance
+        with lock:
+            if instance is None:
+                instance = factory()
+            return instance
+    return get
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import time
+from typing import List, Optional
+
+from common import pregate
+from common.defaults import default_path, process_default
+from common.service_client import get_client
+from common.sqlite_store import SQLiteStore
+from common.tracing import span
+from common.workspace import guarded
+
+
+def working_tree_diff(repo_dir: str) -> str:
+    """`git diff` of the repository plus the content of untracked files the agent created."""
+    diff = subprocess.run(["git", "diff"], cwd=repo_dir, capture_output=True, text=True, check=True).stdout
+    # -z: names are neither quoted nor split at spaces
+    untracked = subprocess.run(["git", "ls-files", "--others", "--exclude-standard", "-z"],
+                               cwd=repo_dir, capture_output=True, text=True, check=True).stdout.split("\0")
+    for path in sorted(path for path in untracked if path):
+        with open(os.path.join(repo_dir, path), "rb") as f:
+            diff += f"\nUNTRACKED {path} {hashlib.sha256(f.read()).hexdigest()}"
+    return diff
+
+
+def cache_key(instance_id: str, diff: str, fail_tests: List[str], pass_tests: List[str]) -> str:
+    diff_hash = hashlib.sha256(diff.encode("utf-8")).hexdigest()
+    material = json.dumps([instance_id, diff_hash, sorted(fail_tests), sorted(pass_tests)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def unchanged_result(instance_id: str, fail_tests: List[str], pass_tests: List[str]) -> dict:
+    """The evaluation of an untouched repository: every FAIL_TO_PASS test fails, PASS_TO_PASS still passes."""
+    harness_output = {instance_id: {"tests_status": {
+        "FAIL_TO_PASS": {"success": [], "failure": list(fail_tests)},
+        "PASS_TO_PASS": {"success": list(pass_tests), "failure": []},
+    }}}
+    return {"harnessOutput": json.dumps(harness_output)}
+
+
+class EvalCache(SQLiteStore):
+    """
+    Results of the /test service keyed by (instance_id, diff hash, FAIL_TO_PASS, PASS_TO_PASS).
+
+    Entries are kept in SQLite and the least recently used ones are evicted beyond `max_entries`.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            instance_id TEXT NOT NULL,
+            result TEXT NOT NULL,
+            last_used REAL NOT NULL
+        )"""
+
+    def __init__(self, path: str, max_entries: int = 5000):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.short_circuits = 0
+        self.rejections = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, instance_id: str, result: dict):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                               (key, instance_id, json.dumps(result), time.time()))
+            self._evict_least_recently_used("results", self.max_entries)
+            self._conn.commit()
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return (f"eval cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+                f"{self.short_circuits} empty diffs skipped, {self.rejections} rejected by the local gate")
+
+
+@process_default
+def default_cache() -> EvalCache:
+    """The process wide evaluation cache in $EVAL_CACHE, or WORKSPACE_ROOT/eval_cache.db."""
+    return EvalCache(default_path("EVAL_CACHE", "eval_cache.db"))
+
+
+async def evaluate(repo_dir: str, payload: dict, cache: EvalCache = None) -> dict:
+    """
+    Evaluate the changes in `repo_dir` like the /test service would, serving repeats from the cache.
+
+    An empty diff cannot fix anything, so it is answered without calling the service at all, and
+    neither are diffs that fail the local checks of common.pregate. Those results carry the reason
+    under "pregate" for the agent and no test results.
+    """
+    cache = cache or default_cache()
+    instance_id, fail_tests, pass_tests = payload["instance_id"], payload["FAIL_TO_PASS"], payload["PASS_TO_PASS"]
+    with span("git diff", "git"):
+        diff = await asyncio.to_thread(guarded(working_tree_diff, repo_dir), repo_dir)
+    if not diff.strip():
+        cache.short_circuits += 1
+        print(f"Empty diff for {instance_id}, skipping evaluation")
+        return unchanged_result(instance_id, fail_tests, pass_tests)
+
+    key = cache_key(instance_id, diff, fail_tests, pass_tests)
+    result = cache.get(key)
+    if result is not None:
+        print(f"Reusing cached evaluation for {instance_id}")
+        return result
+
+    with span("pre-evaluation gate", "eval"):
+        gate = await asyncio.to_thread(guarded(pregate.check, repo_dir), repo_dir, fail_tests)
+    for note in gate.notes:
+        print(f"Pre-evaluation gate for {instance_id}: {note}")
+    if not gate.passed:
+        cache.rejections += 1
+        print(f"Rejected the diff of {instance_id} locally in {gate.seconds:.2f}s:\n{gate.feedback()}")
+        # no test ran, so there are no test results; TaskResult records this as an error
+        return {"harnessOutput": "{}", "pregate": gate.feedback()}
+
+    with span("evaluation POST /test", "http", instance_id=instance_id):
+        result = await get_client().run_tests(payload)
+    # don't remember harness errors, they are usually not a property of the diff
+    if json.loads(result.get("harnessOutput", "{}")):
+        cache.put(key, instance_id, result)
+    return result
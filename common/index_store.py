@@ -0,0 +1,107 @@
+import os
+import subprocess
+import time
+from typing import List, Optional, Tuple
+
+from common.mirror import mirror_name
+from common.tracing import span
+
+# How many previously indexed commits of a repository are compared against a new one
+MAX_BASE_CANDIDATES = 10
+
+
+def _git(args, cwd) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True, check=True).stdout
+
+
+def changed_paths(repo_path: str, base_commit: str) -> List[str]:
+    """Files of the working tree that differ from `base_commit`, including untracked ones."""
+    changed = _git(["diff", "--name-only", "--no-renames", "-z", base_commit], repo_path).split("\0")
+    untracked = _git(["ls-files", "--others", "--exclude-standard", "-z"], repo_path).split("\0")
+    return sorted({path for path in changed + untracked if path})
+
+
+class CommitIndexStore:
+    """
+    Per-repository analyses (the search index, ...) stored on disk per upstream commit as
+    <root>/<kind>/<repository>/<commit>.pkl.
+
+    Many benchmark tasks share a repository at nearby commits. A task on a commit that was not
+    indexed yet starts from the indexed commit with the fewest changed files and only reparses
+    those, instead of building the analysis from scratch.
+
+    Indexes must provide build(repo_path), update(repo_path, paths), adopt_stats(repo_path),
+    save(path) and a static load(path).
+    """
+
+    def __init__(self, root: str, kind: str):
+        self.root = os.path.join(root, kind)
+        self.kind = kind
+
+    def path(self, repo_url: str, commit: str) -> str:
+        return os.path.join(self.root, mirror_name(repo_url), f"{commit}.pkl")
+
+    def commits(self, repo_url: str) -> List[str]:
+        """The indexed commits of a repository, most recently used first."""
+        directory = os.path.join(self.root, mirror_name(repo_url))
+        if not os.path.isdir(directory):
+            return []
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith(".pkl")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        return [entry.name[:-4] for entry in entries]
+
+    def nearest(self, repo_path: str, repo_url: str, commit: str) -> Optional[Tuple[str, List[str]]]:
+        """The indexed commit closest to the working tree in `repo_path`, with the files that differ."""
+        candidates = self.commits(repo_url)
+        if commit in candidates:
+            candidates.remove(commit)
+            candidates.insert(0, commit)
+        best = None
+        for candidate in candidates[:MAX_BASE_CANDIDATES]:
+            try:
+                changed = changed_paths(repo_path, candidate)
+            except subprocess.CalledProcessError:
+                continue  # e.g. the commit is no longer in the mirror
+            if best is None or len(changed) < len(best[1]):
+                best = (candidate, changed)
+            if not changed:
+                break
+        return best
+
+    def load(self, repo_path: str, repo_url: str, commit: Optional[str], factory):
+        """
+        Return the index of the working tree in `repo_path`, a checkout of `commit` of `repo_url`.
+
+        The index is saved under `commit` as long as the working tree is clean, so the
+        agent's own edits never end up in the shared copy.
+        """
+        with span(f"{self.kind} index", "index"):
+            return self._load(repo_path, repo_url, commit, factory)
+
+    def _load(self, repo_path: str, repo_url: str, commit: Optional[str], factory):
+        started = time.perf_counter()
+        commit = commit or _git(["rev-parse", "HEAD"], repo_path).strip()
+        base = self.nearest(repo_path, repo_url, commit)
+
+        if base is None:
+            index = factory()
+            index.build(repo_path)
+            how = "built from scratch"
+        else:
+            base_commit, changed = base
+            base_path = self.path(repo_url, base_commit)
+            index = factory.load(base_path)
+            os.utime(base_path)
+            index.update(repo_path, changed)
+            # a fresh checkout gives every file a new mtime; the unchanged ones need no reparse
+            index.adopt_stats(repo_path)
+            if base_commit == commit and not changed:
+                how = "loaded"
+            else:
+                how = f"updated from {base_commit[:12]} ({len(changed)} changed files)"
+        index.commit = commit
+
+        if how != "loaded" and not _git(["status", "--porcelain"], repo_path).strip():
+            index.save(self.path(repo_url, commit))
+        print(f"{self.kind} index for {repo_path} at {commit[:12]} {how} in {time.perf_counter() - started:.2f}s")
+        return index
@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from common.tracing import current_trace, span
+
+
+@dataclass
+class CallStats:
+    calls: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def add(self, other: "CallStats"):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.seconds += other.seconds
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+
+
+class Metrics:
+    """
+    What one task (or, merged, a whole sweep) spent where: wall time per graph node, LLM calls,
+    latency and tokens per node or agent, and call count and latency per tool.
+    """
+
+    def __init__(self, name: str, tasks: int = 1):
+        self.name = name
+        self.nodes: Dict[str, CallStats] = {}
+        self.llm: Dict[str, CallStats] = {}
+        self.tools: Dict[str, CallStats] = {}
+        self.tasks = tasks
+        # time.time() when this process started the task; not part of any checkpoint, so a resumed
+        # task gets a fresh wall clock budget
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def _stats(self, table: Dict[str, CallStats], key: str) -> CallStats:
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = CallStats()
+        return stats
+
+    def record_node(self, node: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self._stats(self.nodes, node)
+            stats.calls += 1
+            stats.errors += error
+            stats.seconds += seconds
+
+    def record_llm(self, component: str, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                   error: bool = False):
+        with self._lock:
+            stats = self._stats(self.llm, component)
+            stats.calls += 1
+            stats.errors += error
+            stats.seconds += seconds
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+
+    def record_tool(self, tool: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self._stats(self.tools, tool)
+            stats.calls += 1
+            stats.errors += error
+            stats.seconds += seconds
+
+    def merge(self, other: "Metrics"):
+        """Add another task's metrics, e.g. to aggregate a sweep."""
+        with self._lock, other._lock:
+            for table, other_table in ((self.nodes, other.nodes), (self.llm, other.llm), (self.tools, other.tools)):
+                for key, stats in other_table.items():
+                    self._stats(table, key).add(stats)
+            self.tasks += other.tasks
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(stats.prompt_tokens for stats in self.llm.values())
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(stats.completion_tokens for stats in self.llm.values())
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def llm_calls(self) -> int:
+        return sum(stats.calls for stats in self.llm.values())
+
+    @property
+    def tool_calls(self) -> int:
+        return sum(stats.calls for stats in self.tools.values())
+
+    def summary(self) -> str:
+        """A table of all recorded nodes, LLM components and tools."""
+        with self._lock:
+            lines = [f"Metrics for {self.name} ({self.tasks} task{'s' if self.tasks != 1 else ''}): "
+                     f"{self.total_tokens} tokens ({self.prompt_tokens} prompt, {self.completion_tokens} completion), "
+                     f"{self.llm_calls} LLM calls, {self.tool_calls} tool calls"]
+            for title, table in (("node", self.nodes), ("llm", self.llm), ("tool", self.tools)):
+                for key, stats in sorted(table.items(), key=lambda item: -item[1].seconds):
+                    average = stats.seconds / stats.calls if stats.calls else 0.0
+                    line = f"  {title:<5} {key:<32} {stats.calls:>5} calls {stats.seconds:>8.1f}s (avg {average:.2f}s)"
+                    if stats.errors:
+                        line += f" {stats.errors} errors"
+                    if title == "llm":
+                        line += f" {stats.prompt_tokens} prompt / {stats.completion_tokens} completion tokens"
+                    lines.append(line)
+            return "\n".join(lines)
+
+
+_current_metrics = contextvars.ContextVar("metrics", default=None)
+_active: Dict[int, Metrics] = {}
+_active_lock = threading.Lock()
+
+
+def current_metrics() -> Optional[Metrics]:
+    """
+    The metrics of the running task. Callbacks that run on threads without the task's context
+    (like LiteLLM's) still find it as long as only a single task is active.
+    """
+    metrics = _current_metrics.get()
+    if metrics is None:
+        with _active_lock:
+            if len(_active) == 1:
+                return next(iter(_active.values()))
+    return metrics
+
+
+@contextmanager
+def track_task(name: str):
+    """Collect the metrics of everything running inside the with-block into a new Metrics."""
+    metrics = Metrics(name)
+    token = _current_metrics.set(metrics)
+    with _active_lock:
+        _active[id(metrics)] = metrics
+    try:
+        yield metrics
+    finally:
+        with _active_lock:
+            _active.pop(id(metrics), None)
+        _current_metrics.reset(token)
+
+
+def timed_node(name: str):
+    """Decorator recording the wall time of a (sync or async) graph node in the task's metrics and trace."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started, error = time.perf_counter(), False
+                try:
+                    with span(name, "node"):
+                        return await func(*args, **kwargs)
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    metrics = current_metrics()
+                    if metrics is not None:
+                        metrics.record_node(name, time.perf_counter() - started, error)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started, error = time.perf_counter(), False
+                try:
+                    with span(name, "node"):
+                        return func(*args, **kwargs)
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    metrics = current_metrics()
+                    if metrics is not None:
+                        metrics.record_node(name, time.perf_counter() - started, error)
+        return wrapper
+    return decorator
+
+
+def timed_tool(func, name: str = None):
+    """Wrap a plain tool function so its calls and latency are recorded; the signature is preserved."""
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started, error = time.perf_counter(), False
+        try:
+            with span(name, "tool"):
+                return func(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            metrics = current_metrics()
+            if metrics is not None:
+                metrics.record_tool(name, time.perf_counter() - started, error)
+    return wrapper
+
+
+def wrap_tool_run(tool, wrapper):
+    """Replace the _run method of a tool object (CrewAI and LangChain BaseTool) with wrapper(_run), in place."""
+    # object.__setattr__ because pydantic based tools refuse assignments to non-field attributes
+    object.__setattr__(tool, "_run", wrapper(tool._run))
+    return tool
+
+
+def instrument_tool_object(tool, name: str = None):
+    """Record the calls of a tool object with a _run method (CrewAI and LangChain BaseTool) in place."""
+    return wrap_tool_run(tool, lambda run: timed_tool(run, name or getattr(tool, "name", type(tool).__name__)))
+
+
+def _litellm_success(kwargs, completion_response, start_time, end_time):
+    _record_litellm(kwargs, completion_response, start_time, end_time, error=False)
+
+
+def _litellm_failure(kwargs, completion_response, start_time, end_time):
+    _record_litellm(kwargs, completion_response, start_time, end_time, error=True)
+
+
+def _record_litellm(kwargs, completion_response, start_time, end_time, error):
+    usage = getattr(completion_response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    seconds = (end_time - start_time).total_seconds() if start_time and end_time else 0.0
+    component = f"litellm:{kwargs.get('model', 'unknown')}"
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.record_llm(component, seconds, prompt_tokens, completion_tokens, error)
+    trace = current_trace()
+    if trace is not None and start_time and end_time:
+        trace.add(component, "llm", int(start_time.timestamp() * 1e6), int(end_time.timestamp() * 1e6),
+                  {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "error": error})
+
+
+_litellm_installed = False
+
+
+def install_litellm_hooks():
+    """Record every LiteLLM completion (CrewAI and PraisonAI call their models through LiteLLM)."""
+    global _litellm_installed
+    if _litellm_installed:
+        return
+    import litellm
+    litellm.success_callback.append(_litellm_success)
+    litellm.failure_callback.append(_litellm_failure)
+    _litellm_installed = True
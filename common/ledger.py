@@ -0,0 +1,52 @@
+import time
+from typing import List, Set
+
+from common.defaults import default_path, process_default
+from common.sqlite_store import SQLiteStore
+
+
+class Ledger(SQLiteStore):
+    """
+    SQLite file of the tasks each runner has finished (agent run, evaluation and result logged), so
+    a restarted sweep skips them instead of paying for their LLM calls again.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS finished (
+            runner TEXT NOT NULL,
+            instance_id TEXT NOT NULL,
+            task_index INTEGER NOT NULL,
+            finished_at REAL NOT NULL,
+            PRIMARY KEY (runner, instance_id)
+        )"""
+
+    def mark_done(self, runner: str, index: int, instance_id: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO finished VALUES (?, ?, ?, ?)",
+                               (runner, instance_id, index, time.time()))
+            self._conn.commit()
+
+    def done_indices(self, runner: str) -> Set[int]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT task_index FROM finished WHERE runner = ?", (runner,))}
+
+    def forget(self, runner: str, indices: List[int]):
+        """Drop tasks from the ledger, e.g. to run them again."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM finished WHERE runner = ? AND task_index = ?",
+                                   [(runner, index) for index in indices])
+            self._conn.commit()
+
+    def pending(self, runner: str, indices: List[int]) -> List[int]:
+        """`indices` without the ones already finished, in their original order."""
+        done = self.done_indices(runner)
+        skipped = [index for index in indices if index in done]
+        if skipped:
+            print(f"Skipping {len(skipped)} tasks {runner} already finished (see {self.path})")
+        return [index for index in indices if index not in done]
+
+
+@process_default
+def default_ledger() -> Ledger:
+    """The process wide ledger in $LEDGER, or WORKSPACE_ROOT/ledger.db."""
+    return Ledger(default_path("LEDGER", "ledger.db"))
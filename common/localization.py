@@ -0,0 +1,180 @@
+import os
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from common.code_tokens import IDENTIFIER
+from common.search_index import SearchIndex, read_text
+from common.symbols import Symbol, lookup, module_name
+
+# How far imports are followed from the failing tests, and how much a file counts at each distance
+MAX_IMPORT_DEPTH = 3
+PROXIMITY = {1: 1.0, 2: 0.5, 3: 0.25}
+MAX_SNIPPET_LINES = 40
+
+DJANGO_TEST_ID = re.compile(r"^(\w+) \(([\w.]+)\)")
+
+
+@dataclass
+class TestTarget:
+    """Where a FAIL_TO_PASS test id points: a file and/or a (qualified) test name."""
+    test_id: str
+    path: Optional[str] = None
+    module: Optional[str] = None
+    qualname: Optional[str] = None
+
+
+def parse_test_id(test_id: str) -> TestTarget:
+    """
+    Understand the test id formats of SWE-bench:
+    pytest "tests/test_x.py::TestA::test_b[1]", django "test_b (app.tests.TestA)" and plain
+    function names like sympy's "test_issue_1234".
+    """
+    first_line = test_id.strip().splitlines()[0] if test_id.strip() else ""
+    if "::" in first_line:
+        path, *names = first_line.split("::")
+        names = [name.split("[")[0] for name in names]
+        return TestTarget(test_id, path=path, qualname=".".join(names) or None)
+    match = DJANGO_TEST_ID.match(first_line)
+    if match:
+        method, dotted = match.groups()
+        parts = dotted.split(".")
+        if parts[-1] == method:  # Python 3.11+ unittest ids repeat the method name
+            parts.pop()
+        return TestTarget(test_id, module=".".join(parts[:-1]), qualname=f"{parts[-1]}.{method}")
+    name = first_line.split("[")[0].split(" ")[0]
+    return TestTarget(test_id, qualname=name or None)
+
+
+def is_test_path(path: str) -> bool:
+    parts = path.lower().split("/")
+    return any(part in ("tests", "test", "testing") for part in parts[:-1]) or \
+        parts[-1].startswith("test_") or parts[-1].endswith(("_test.py", "_tests.py", "tests.py"))
+
+
+class Localizer:
+    """
+    Ranks the source files and functions most likely involved in a bug, starting from the failing
+    tests: the modules they import (transitively, through the static import graph of the search
+    index) and the definitions named in the test bodies and the bug report.
+    """
+
+    def __init__(self, index: SearchIndex, repo_path: str):
+        self.index = index
+        self.repo_path = repo_path
+        self.modules: Dict[str, str] = {}
+        for path in index.symbols:
+            self.modules[module_name(path)] = path
+        for path in index.symbols:
+            # also reachable without the first component: src/ layouts, django's tests/ directory
+            self.modules.setdefault(module_name(path).partition(".")[2], path)
+        self.definitions: Dict[str, Set[str]] = {}  # symbol name -> files defining it
+        for path, symbols in index.symbols.items():
+            for symbol in symbols:
+                self.definitions.setdefault(symbol.name, set()).add(path)
+
+    def resolve_module(self, name: str) -> Optional[str]:
+        return self.modules.get(name)
+
+    def resolve_test(self, target: TestTarget) -> List[Tuple[str, Optional[Symbol]]]:
+        """The files (and test definitions, where found) a failing test refers to."""
+        paths = []
+        if target.path and target.path in self.index.symbols:
+            paths = [target.path]
+        elif target.module and self.resolve_module(target.module):
+            paths = [self.resolve_module(target.module)]
+        elif target.qualname:
+            name = target.qualname.split(".")[-1]
+            paths = sorted(path for path in self.definitions.get(name, ()) if is_test_path(path))
+
+        resolved = []
+        for path in paths:
+            matches = lookup(self.index.symbols[path], target.qualname, module_name(path)) if target.qualname else []
+            resolved.append((path, matches[0] if matches else None))
+        return resolved
+
+    def import_distances(self, seeds: List[str]) -> Dict[str, int]:
+        """Breadth-first distances from the seed files along import edges."""
+        distances = {seed: 0 for seed in seeds}
+        queue = deque(seeds)
+        while queue:
+            path = queue.popleft()
+            if distances[path] >= MAX_IMPORT_DEPTH:
+                continue
+            for imported in self.index.imports.get(path, ()):
+                target = self.resolve_module(imported)
+                if target is not None and target not in distances:
+                    distances[target] = distances[path] + 1
+                    queue.append(target)
+        return distances
+
+    def source_lines(self, path: str, symbol: Symbol) -> List[str]:
+        text = read_text(os.path.join(self.repo_path, path)) or ""
+        return text.splitlines()[symbol.line - 1:symbol.end_line]
+
+    def snippet(self, path: str, symbol: Symbol) -> str:
+        lines = self.source_lines(path, symbol)
+        if len(lines) > MAX_SNIPPET_LINES:
+            lines = lines[:MAX_SNIPPET_LINES] + [f"... ({symbol.end_line - symbol.line + 1 - MAX_SNIPPET_LINES} more lines)"]
+        body = "\n".join(f"{symbol.line + offset}: {line}" for offset, line in enumerate(lines))
+        return f"{path}:{symbol.line}-{symbol.end_line} {symbol.kind} {symbol.qualname}\n{body}"
+
+    def localize(self, fail_tests: List[str], bug_report: str = "", top_files: int = 8, top_functions: int = 5) -> str:
+        """A report of the failing tests and the top ranked candidate files and functions, for a prompt."""
+        tests = []
+        for test_id in fail_tests:
+            tests.extend(self.resolve_test(parse_test_id(test_id)))
+        seeds = list(dict.fromkeys(path for path, _ in tests))
+        distances = self.import_distances(seeds)
+
+        test_names = set()
+        for path, symbol in tests:
+            if symbol is not None:
+                test_names.update(IDENTIFIER.findall("\n".join(self.source_lines(path, symbol))))
+        bug_names = set(IDENTIFIER.findall(bug_report))
+
+        file_scores: Dict[str, float] = {}
+        for path, distance in distances.items():
+            if distance and not is_test_path(path):
+                file_scores[path] = PROXIMITY.get(distance, 0.0)
+        for names, factor in ((test_names, 2.0), (bug_names, 1.0)):
+            for name in names:
+                paths = self.definitions.get(name)
+                if not paths or len(name) < 3:
+                    continue
+                for path in paths:
+                    if not is_test_path(path):
+                        # names defined in many files (setUp, get, __init__) say little about where the bug is
+                        file_scores[path] = file_scores.get(path, 0.0) + factor / len(paths)
+        ranked_files = sorted(file_scores, key=lambda path: (-file_scores[path], path))[:top_files]
+
+        function_scores = []
+        for path in ranked_files:
+            for symbol in self.index.symbols.get(path, ()):
+                if symbol.kind == "class":
+                    continue
+                score = 2.0 * (symbol.name in test_names) + 1.0 * (symbol.name in bug_names)
+                if score:
+                    function_scores.append((score + file_scores[path], path, symbol))
+        function_scores.sort(key=lambda item: (-item[0], item[1], item[2].line))
+
+        report = ["Failing tests:"]
+        for path, symbol in tests[:3]:
+            report.append(self.snippet(path, symbol) if symbol is not None else path)
+        if not tests:
+            report.append("(could not be located in the repository)")
+        report.append("\nCandidate source files (most relevant first):")
+        report.extend(f"{path} (score {file_scores[path]:.2f})" for path in ranked_files)
+        if function_scores:
+            report.append("\nCandidate functions:")
+            report.extend(self.snippet(path, symbol) for _, path, symbol in function_scores[:top_functions])
+        return "\n".join(report)
+
+
+def localize(index: SearchIndex, repo_path: str, fail_tests: List[str], bug_report: str = "") -> str:
+    started = time.perf_counter()
+    report = Localizer(index, repo_path).localize(fail_tests, bug_report)
+    print(f"Localization for {len(fail_tests)} failing tests took {time.perf_counter() - started:.2f}s")
+    return report
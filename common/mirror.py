@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+import shutil
+import stat
+import subprocess
+import threading
+
+from common.defaults import default_path, process_default
+from common.tracing import span
+
+
+def _git(args, cwd=None, check=True):
+    env = os.environ.copy()
+    env["GIT_TERMINAL_PROMPT"] = "0"
+    return subprocess.run(["git", *args], cwd=cwd, env=env, check=check, capture_output=True, text=True)
+
+
+def mirror_name(repo_url: str) -> str:
+    """A readable, collision free directory name for a repository URL, e.g. django-3f2a9c01de."""
+    name = repo_url.rstrip("/").split("/")[-1]
+    if name.endswith(".git"):
+        name = name[:-4]
+    digest = hashlib.sha1(repo_url.encode("utf-8")).hexdigest()[:10]
+    return f"{name}-{digest}"
+
+
+def _force_remove(func, path, _exc_info):
+    # git marks pack files read-only, which makes rmtree fail on Windows
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+
+def _supports_relative_worktrees() -> bool:
+    match = re.search(r"(\d+)\.(\d+)", _git(["version"]).stdout)
+    return bool(match) and (int(match.group(1)), int(match.group(2))) >= (2, 48)
+
+
+def _relativize_gitdir(worktree: str):
+    """
+    Make the worktree's .git file point to its metadata in the mirror by a relative path, which
+    git < 2.48 always writes absolute. The link back from the mirror stays absolute: only git on
+    the host uses it, and git < 2.48 resolves a relative one against its working directory.
+    """
+    git_file = os.path.join(worktree, ".git")
+    with open(git_file, "r", encoding="utf-8") as f:
+        gitdir = f.read().strip()[len("gitdir: "):]
+    if os.path.isabs(gitdir):
+        relative = os.path.relpath(gitdir, worktree).replace(os.sep, "/")
+        with open(git_file, "w", encoding="utf-8") as f:
+            f.write(f"gitdir: {relative}\n")
+
+
+class MirrorStore:
+    """
+    One bare repository per upstream URL, shared by every task on that repository.
+
+    Tasks get a `git worktree` of the mirror checked out at their commit instead of a full clone,
+    so a sweep clones django, sympy, ... once and each task only pays for the checkout.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._relative_paths = None
+        self.prune()
+
+    def mirror_path(self, repo_url: str) -> str:
+        return os.path.join(self.root, mirror_name(repo_url) + ".git")
+
+    def _lock(self, repo_url: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(repo_url, threading.Lock())
+
+    def has_commit(self, repo_url: str, commit: str) -> bool:
+        result = _git(["cat-file", "-e", f"{commit}^{{commit}}"], cwd=self.mirror_path(repo_url), check=False)
+        return result.returncode == 0
+
+    def ensure_mirror(self, repo_url: str, commit: str = None) -> str:
+        """Clone the mirror on first use and fetch again if it does not contain `commit` yet."""
+        path = self.mirror_path(repo_url)
+        with self._lock(repo_url):
+            if not os.path.isdir(path):
+                print(f"Creating mirror of {repo_url} in {path}...")
+                tmp_path = path + ".tmp"
+                if os.path.isdir(tmp_path):
+                    shutil.rmtree(tmp_path, onerror=_force_remove)
+                with span("git clone --bare", "git", repo_url=repo_url):
+                    _git(["clone", "--bare", repo_url, tmp_path])
+                _git(["config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"], cwd=tmp_path)
+                os.rename(tmp_path, path)
+            elif commit and not self.has_commit(repo_url, commit):
+                print(f"Fetching {repo_url} into mirror {path}...")
+                with span("git fetch", "git", repo_url=repo_url):
+                    _git(["fetch", "--tags", "origin"], cwd=path)
+        return path
+
+    def add_worktree(self, repo_url: str, commit: str, dest: str) -> str:
+        """Check out `commit` of `repo_url` into `dest` as a detached worktree of the mirror."""
+        mirror = self.ensure_mirror(repo_url, commit)
+        dest = os.path.abspath(dest)
+        if os.path.exists(dest):
+            self.remove_worktree(repo_url, dest)
+
+        args = ["worktree", "add", "--detach", "--force"]
+        if self._relative_paths is None:
+            self._relative_paths = _supports_relative_worktrees()
+        if self._relative_paths:
+            # keeps the worktree usable when WORKSPACE_ROOT is mounted elsewhere (e.g. /repos in docker)
+            args.append("--relative-paths")
+        with span("git worktree add", "git", commit=commit or "HEAD"):
+            _git([*args, dest, commit or "HEAD"], cwd=mirror)
+        if not self._relative_paths:
+            _relativize_gitdir(dest)
+        return dest
+
+    def remove_worktree(self, repo_url: str, dest: str):
+        """Remove a worktree (or a stale plain checkout left by an older run) and prune its metadata."""
+        mirror = self.mirror_path(repo_url)
+        dest = os.path.abspath(dest)
+        if os.path.isdir(mirror):
+            _git(["worktree", "remove", "--force", dest], cwd=mirror, check=False)
+        if os.path.exists(dest):
+            shutil.rmtree(dest, onerror=_force_remove)
+        if os.path.isdir(mirror):
+            _git(["worktree", "prune"], cwd=mirror, check=False)
+
+    def prune(self):
+        """Drop worktree metadata whose directories no longer exist, e.g. after a crash."""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(".git") and os.path.isdir(path):
+                _git(["worktree", "prune"], cwd=path, check=False)
+
+
+@process_default
+def default_store() -> MirrorStore:
+    """The process wide mirror store in $MIRROR_ROOT, or WORKSPACE_ROOT/.mirrors."""
+    return MirrorStore(default_path("MIRROR_ROOT", ".mirrors"))
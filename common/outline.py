@@ -0,0 +1,97 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+
+from common.defaults import process_default
+from common.process_pool import parallel_map
+from common.symbols import Symbol, extract_symbols
+
+# Cold scans with at least this many unparsed files (outline of a directory or the whole
+# repository) are spread over the shared process pool
+PARALLEL_THRESHOLD = 32
+MAX_OUTLINE_ENTRIES = 50000
+
+
+def _parse(source: bytes) -> Union[List[Symbol], str]:
+    """Symbols of a file, or the reason it could not be parsed (runs in the worker processes for cold scans)."""
+    try:
+        return extract_symbols(source.decode("utf-8", errors="replace"))
+    except (SyntaxError, ValueError) as e:
+        return f"could not be parsed: {e}"
+
+
+class OutlineCache:
+    """
+    Outlines (classes, functions, methods and their line spans) of Python files, keyed by a
+    hash of the file content. Identical files in different worktrees share an entry, and a file
+    is parsed again only after it changed.
+    """
+
+    def __init__(self, max_entries: int = MAX_OUTLINE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def outlines(self, file_paths: List[str]) -> Dict[str, Union[List[Symbol], str]]:
+        """Map each file to its symbols, or to an error message if it cannot be read or parsed."""
+        results, missing = {}, {}
+        for file_path in file_paths:
+            try:
+                with open(file_path, "rb") as f:
+                    source = f.read()
+            except OSError as e:
+                results[file_path] = f"could not be read: {e}"
+                continue
+            key = hashlib.sha1(source).hexdigest()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    results[file_path] = entry
+                    continue
+                self.misses += 1
+            missing[file_path] = (key, source)
+
+        parsed = parallel_map(_parse, [source for _, source in missing.values()], PARALLEL_THRESHOLD)
+        for (file_path, (key, _)), entry in zip(missing.items(), parsed):
+            results[file_path] = entry
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return results
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return f"outline cache: {self.hits}/{lookups} files served from cache ({rate:.0f}% hit rate)"
+
+
+def format_outline(relative_path: str, entry: Union[List[Symbol], str], max_depth: Optional[int] = None) -> str:
+    """
+    Render a file outline, nested definitions indented below their parents:
+
+        django/db/models/query.py
+          class QuerySet  L185-2040
+            def get_or_create  L920-960
+    """
+    if isinstance(entry, str):
+        return f"{relative_path}: {entry}"
+    lines = [relative_path]
+    for symbol in entry:
+        depth = symbol.qualname.count(".")
+        if max_depth is not None and depth > max_depth:
+            continue
+        keyword = "class" if symbol.kind == "class" else "def"
+        lines.append(f"{'  ' * (depth + 1)}{keyword} {symbol.name}  L{symbol.line}-{symbol.end_line}")
+    return "\n".join(lines)
+
+
+@process_default
+def default_cache() -> OutlineCache:
+    """The process wide outline cache; content hashes make it safe to share between workspaces."""
+    return OutlineCache()
@@ -0,0 +1,114 @@
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+@dataclass
+class Stage:
+    """One step of a pipeline: `func` turns a job's value into the value handed to the next stage."""
+    name: str
+    func: Callable[[Any], Awaitable[Any]]
+    workers: int = 1
+    # capacity of the queue feeding this stage, i.e. how far the previous stage may run ahead
+    queue_size: int = 1
+
+
+@dataclass
+class Job:
+    key: Any
+    value: Any
+    error: Optional[BaseException] = None
+    failed_stage: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    items: int = 0
+    busy: float = 0.0
+    idle: float = 0.0
+
+    def report(self, wall: float) -> str:
+        average = self.busy / self.items if self.items else 0.0
+        utilisation = self.busy / (wall * self.workers) * 100 if wall else 0.0
+        return (f"{self.name:<10} items={self.items:<4} avg={average:7.2f}s busy={self.busy:8.1f}s "
+                f"idle={self.idle:8.1f}s utilisation={utilisation:5.1f}%")
+
+
+_DONE = object()
+
+
+async def run_pipeline(items, stages: List[Stage],
+                       on_done: Optional[Callable[[Job], Any]] = None) -> List[Job]:
+    """
+    Push `items` through `stages`, each running its own workers and connected by bounded queues.
+
+    While a later stage works on item N, earlier stages already work on N+1..N+k, where k is
+    bounded by the queue sizes. A job whose stage raises keeps flowing with `error` set and
+    skips the remaining stages, so every item comes out of the pipeline exactly once.
+    `on_done` (a function or coroutine function) is called with each job as it leaves.
+    """
+    stats = [StageStats(stage.name, stage.workers) for stage in stages]
+    queues = [asyncio.Queue(maxsize=max(1, stage.queue_size)) for stage in stages]
+    results: List[Job] = []
+    started = time.perf_counter()
+
+    async def feed():
+        for item in items:
+            await queues[0].put(Job(key=item, value=item))
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    async def worker(position: int, finished: List[int]):
+        stage, stat = stages[position], stats[position]
+        inbox = queues[position]
+        outbox = queues[position + 1] if position + 1 < len(stages) else None
+        while True:
+            wait_start = time.perf_counter()
+            job = await inbox.get()
+            stat.idle += time.perf_counter() - wait_start
+            if job is _DONE:
+                break
+            if job.error is None:
+                run_start = time.perf_counter()
+                try:
+                    job.value = await stage.func(job.value)
+                except Exception as e:
+                    job.error, job.failed_stage = e, stage.name
+                job.timings[stage.name] = time.perf_counter() - run_start
+                stat.items += 1
+                stat.busy += job.timings[stage.name]
+            if outbox is not None:
+                await outbox.put(job)
+            else:
+                results.append(job)
+                if on_done is not None:
+                    done = on_done(job)
+                    if inspect.isawaitable(done):
+                        await done
+
+        # the last worker of a stage to finish tells every worker of the next stage to stop
+        finished[0] += 1
+        if outbox is not None and finished[0] == stage.workers:
+            for _ in range(stages[position + 1].workers):
+                await outbox.put(_DONE)
+
+    tasks = [asyncio.create_task(feed())]
+    for position, stage in enumerate(stages):
+        finished = [0]
+        tasks += [asyncio.create_task(worker(position, finished)) for _ in range(stage.workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    wall = time.perf_counter() - started
+    print(f"Pipeline finished {len(results)} items in {wall:.1f}s")
+    for stat in stats:
+        print("  " + stat.report(wall))
+    return results
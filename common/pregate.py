@@ -0,0 +1,210 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from common.process_pool import parallel_map
+
+# Diffs touching at least this many Python files are compiled in the shared process pool
+PARALLEL_THRESHOLD = 16
+IMPORT_TIMEOUT = float(os.environ.get("PREGATE_IMPORT_TIMEOUT", "30"))
+LOCAL_TEST_TIMEOUT = float(os.environ.get("PREGATE_TEST_TIMEOUT", "120"))
+# Files that run code when imported instead of defining a module
+NEVER_IMPORT = {"setup.py", "conftest.py", "__main__.py", "manage.py"}
+
+# Runs in a subprocess with the repository as working directory: imports every module given as
+# [sys.path root, module] pairs and prints where each failed.
+_IMPORT_SCRIPT = r"""
+import importlib, json, os, sys, traceback
+repo = os.getcwd()
+failures = []
+for root, module in json.loads(sys.argv[1]):
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    try:
+        importlib.import_module(module)
+    except BaseException as e:
+        if isinstance(e, SyntaxError) and e.filename:
+            location = e.filename
+        else:
+            frames = [frame.filename for frame in traceback.extract_tb(e.__traceback__)]
+            location = next((name for name in reversed(frames) if name.startswith(repo)), None)
+        failures.append({"root": root, "module": module, "error": f"{type(e).__name__}: {e}",
+                         "file": os.path.relpath(location, repo) if location else None,
+                         "missing": getattr(e, "name", None) if isinstance(e, ImportError) else None})
+print(json.dumps(failures))
+"""
+
+
+@dataclass
+class GateResult:
+    """What the local checks found in a working tree; `passed` is False if the diff is certainly broken."""
+    passed: bool = True
+    problems: List[str] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def reject(self, problem: str):
+        self.passed = False
+        self.problems.append(problem)
+
+    def feedback(self) -> str:
+        return "The change was rejected before running the tests:\n" + "\n".join(f"  {p}" for p in self.problems)
+
+
+def changed_python_files(repo_dir: str) -> List[str]:
+    """Python files that `git diff` reports as modified or added, plus untracked ones (repository relative)."""
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=repo_dir, capture_output=True, text=True, check=True).stdout
+    changed = git("diff", "--name-only", "--diff-filter=d", "-z").split("\0")
+    changed += git("ls-files", "--others", "--exclude-standard", "-z").split("\0")
+    return sorted({path for path in changed if path.endswith(".py")})
+
+
+def _compile_error(path: str) -> Optional[str]:
+    """Byte-compile a file without writing a .pyc (runs in the worker processes for large diffs)."""
+    try:
+        with open(path, "rb") as f:
+            compile(f.read(), path, "exec", dont_inherit=True)
+    except (SyntaxError, ValueError) as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def compile_errors(repo_dir: str, paths: List[str]) -> Dict[str, str]:
+    errors = parallel_map(_compile_error, [os.path.join(repo_dir, path) for path in paths], PARALLEL_THRESHOLD, 1)
+    return {path: error for path, error in zip(paths, errors) if error}
+
+
+def importable_module(repo_dir: str, path: str) -> Optional[List[str]]:
+    """[sys.path root, dotted name] of a file inside a package, or None for scripts and loose files."""
+    if os.path.basename(path) in NEVER_IMPORT:
+        return None
+    directory = os.path.dirname(os.path.join(repo_dir, path))
+    if not os.path.exists(os.path.join(directory, "__init__.py")):
+        return None
+    root = directory
+    while os.path.exists(os.path.join(root, "__init__.py")) and os.path.dirname(root) != root:
+        root = os.path.dirname(root)
+    name = os.path.relpath(os.path.join(repo_dir, path), root)[:-3].replace(os.sep, ".")
+    if name.endswith(".__init__"):
+        name = name[:-len(".__init__")]
+    return [root, name]
+
+
+def _external(failure: dict) -> bool:
+    """Whether an import failure is about a package that is not part of the repository."""
+    if not failure["missing"]:
+        return False
+    top = os.path.join(failure["root"], failure["missing"].split(".")[0])
+    return not (os.path.isdir(top) or os.path.isfile(top + ".py"))
+
+
+def _minimal_env() -> Dict[str, str]:
+    """The environment for running repository code: no API keys or other secrets of the agent."""
+    return {name: os.environ[name] for name in ("PATH", "SYSTEMROOT", "TMPDIR", "TEMP", "TMP") if name in os.environ}
+
+
+def import_failures(repo_dir: str, modules: List[List[str]], timeout: float = IMPORT_TIMEOUT) -> Optional[List[dict]]:
+    """
+    Import `modules` in a fresh, isolated interpreter (-I: no user site-packages and no PYTHON*
+    variables, -B: no .pyc files) with a minimal environment; None if that took longer than `timeout`.
+    """
+    try:
+        result = subprocess.run([sys.executable, "-I", "-B", "-c", _IMPORT_SCRIPT, json.dumps(modules)],
+                                cwd=repo_dir, env=_minimal_env(), capture_output=True, text=True,
+                                timeout=timeout, stdin=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        return None
+    lines = result.stdout.strip().splitlines()
+    return json.loads(lines[-1]) if lines else None
+
+
+def failing_on_head(repo_dir: str, paths: List[str]) -> Optional[Set[str]]:
+    """
+    The modules of `paths` that already fail to import in a clean checkout of HEAD, i.e. failures
+    the diff did not cause. Files that are new in the diff are never in it; None if HEAD could
+    not be checked out or its check timed out.
+    """
+    with tempfile.TemporaryDirectory(prefix="pregate-") as base:
+        head_dir = os.path.join(base, "head")
+        if subprocess.run(["git", "worktree", "add", "--detach", head_dir, "HEAD"], cwd=repo_dir,
+                          capture_output=True).returncode != 0:
+            return None
+        try:
+            modules = [module for module in (importable_module(head_dir, path) for path in paths
+                                             if os.path.isfile(os.path.join(head_dir, path))) if module]
+            failures = import_failures(head_dir, modules) if modules else []
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", head_dir], cwd=repo_dir, capture_output=True)
+            subprocess.run(["git", "worktree", "prune"], cwd=repo_dir, capture_output=True)
+    return None if failures is None else {failure["module"] for failure in failures}
+
+
+def run_local_tests(repo_dir: str, tests: List[str], timeout: float = LOCAL_TEST_TIMEOUT) -> Optional[str]:
+    """Run pytest style test ids; the failure output, or None if they passed or could not run here."""
+    tests = [test for test in tests if "::" in test]
+    if not tests:
+        return None
+    try:
+        result = subprocess.run([sys.executable, "-m", "pytest", "-x", "-q", "-p", "no:cacheprovider", *tests],
+                                cwd=repo_dir, capture_output=True, text=True, timeout=timeout,
+                                stdin=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        return None
+    # 1 is "tests failed"; collection errors, usage errors and missing pytest say nothing about the diff
+    if result.returncode != 1:
+        return None
+    return result.stdout[-3000:]
+
+
+def check(repo_dir: str, fail_tests: Optional[List[str]] = None, local_tests: Optional[bool] = None) -> GateResult:
+    """
+    Cheap local checks of the working tree before paying for a remote evaluation: every changed
+    Python file must compile, and changed modules inside packages must import without failing in
+    a changed file. Failures caused by the environment (missing third-party packages, unconfigured
+    frameworks, an interpreter the repository does not support, timeouts) are not held against the
+    diff: an import failure only rejects it if the same module imports on HEAD.
+
+    With `local_tests` (default: $PREGATE_LOCAL_TESTS) the pytest style FAIL_TO_PASS tests are also
+    run locally, which only helps where the repository's dependencies are installed.
+    """
+    started = time.perf_counter()
+    repo_dir = os.path.abspath(repo_dir)
+    gate = GateResult()
+    paths = [path for path in changed_python_files(repo_dir) if os.path.isfile(os.path.join(repo_dir, path))]
+
+    for path, error in compile_errors(repo_dir, paths).items():
+        gate.reject(f"{path} does not compile: {error}")
+
+    if gate.passed:
+        modules = [module for module in (importable_module(repo_dir, path) for path in paths) if module]
+        failures = import_failures(repo_dir, modules) if modules else []
+        if failures is None:
+            gate.notes.append(f"import check skipped after {IMPORT_TIMEOUT:.0f}s")
+        changed = {os.path.normpath(path) for path in paths}
+        suspects = [failure for failure in failures or []
+                    if failure["file"] and os.path.normpath(failure["file"]) in changed and not _external(failure)]
+        preexisting = failing_on_head(repo_dir, paths) if suspects else set()
+        if preexisting is None:
+            gate.notes.append("import failures not compared with HEAD, so none is held against the diff")
+            suspects = []
+        for failure in failures or []:
+            if failure in suspects and failure["module"] not in preexisting:
+                gate.reject(f"importing {failure['module']} fails in {failure['file']}: {failure['error']}")
+            else:
+                gate.notes.append(f"{failure['module']} not importable here: {failure['error']}")
+
+    if local_tests is None:
+        local_tests = os.environ.get("PREGATE_LOCAL_TESTS", "").lower() in ("1", "true", "yes")
+    if gate.passed and local_tests and fail_tests:
+        output = run_local_tests(repo_dir, fail_tests)
+        if output:
+            gate.reject(f"FAIL_TO_PASS tests fail locally:\n{output}")
+
+    gate.seconds = time.perf_counter() - started
+    return gate
@@ -0,0 +1,47 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shared_pool() -> ProcessPoolExecutor:
+    """
+    The process wide pool for CPU bound batches such as cold outline scans, shut down at exit.
+
+    Workers are started by forkserver (spawn where that is unavailable), never by fork: the pool is
+    first used from tool threads of an asyncio process, and a child forked while threads hold locks
+    can deadlock.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context(method))
+            atexit.register(shutdown_pool)
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def parallel_map(func, items: list, min_items: int, chunksize: int = 8) -> list:
+    """
+    [func(item) for item in items], in the shared pool if there are at least `min_items`. If the
+    pool cannot start (e.g. no forkserver in a frozen or embedded interpreter) it runs in-thread.
+    """
+    if len(items) >= min_items:
+        try:
+            return list(shared_pool().map(func, items, chunksize=chunksize))
+        except (BrokenProcessPool, OSError) as e:
+            print(f"Process pool unavailable ({e!r}), running {len(items)} items in-thread")
+    return [func(item) for item in items]
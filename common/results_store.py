@@ -0,0 +1,266 @@
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field, fields
+from typing import Callable, Dict, List, Optional
+
+from common.defaults import default_path, process_default
+
+# USD per million tokens; the defaults are the list prices of gemini-2.0-flash
+PROMPT_PRICE = float(os.environ.get("PROMPT_PRICE_PER_M", "0.10"))
+COMPLETION_PRICE = float(os.environ.get("COMPLETION_PRICE_PER_M", "0.40"))
+
+
+def default_run_id() -> str:
+    """$RUN_ID, or the start time of this process, which groups the results of one sweep."""
+    return os.environ.get("RUN_ID") or time.strftime("%Y%m%d-%H%M%S")
+
+
+RUN_ID = default_run_id()
+
+
+def repo_name(repo_url: Optional[str]) -> str:
+    """Owner and name of a repository URL, e.g. "django/django" for https://github.com/django/django.git."""
+    if not repo_url:
+        return ""
+    parts = repo_url.rstrip("/").replace(":", "/").split("/")
+    name = "/".join(parts[-2:])
+    return name[:-4] if name.endswith(".git") else name
+
+
+@dataclass
+class TaskResult:
+    """The outcome of one task of a sweep, as one row of the results store."""
+    framework: str
+    task_index: Optional[int]
+    instance_id: str = ""
+    repo: str = ""
+    run_id: str = RUN_ID
+    fail_to_pass_passed: int = 0
+    fail_to_pass_total: int = 0
+    pass_to_pass_passed: int = 0
+    pass_to_pass_total: int = 0
+    seconds: float = 0.0
+    timings: Dict[str, float] = field(default_factory=dict)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    llm_calls: int = 0
+    tool_calls: int = 0
+    error: Optional[str] = None
+    finished_at: float = field(default_factory=time.time)
+
+    @property
+    def resolved(self) -> bool:
+        return (self.error is None and self.fail_to_pass_total > 0
+                and self.fail_to_pass_passed == self.fail_to_pass_total
+                and self.pass_to_pass_passed == self.pass_to_pass_total)
+
+    def add_tests(self, evaluation: dict):
+        """
+        Take the pass counts from an evaluation result (see common.eval_cache.evaluate). A diff the
+        pre-evaluation gate rejected never reached the tests and is recorded as an error.
+        """
+        if evaluation.get("pregate"):
+            self.error = f"rejected before evaluation: {evaluation['pregate']}"
+            return
+        harness_output = json.loads(evaluation.get("harnessOutput") or "{}")
+        if not harness_output:
+            raise ValueError("No data in harnessOutput – possible evaluation error or empty result")
+        tests_status = next(iter(harness_output.values()))["tests_status"]
+        fail_to_pass, pass_to_pass = tests_status["FAIL_TO_PASS"], tests_status["PASS_TO_PASS"]
+        self.fail_to_pass_passed = len(fail_to_pass["success"])
+        self.fail_to_pass_total = len(fail_to_pass["success"]) + len(fail_to_pass["failure"])
+        self.pass_to_pass_passed = len(pass_to_pass["success"])
+        self.pass_to_pass_total = len(pass_to_pass["success"]) + len(pass_to_pass["failure"])
+
+    def add_metrics(self, metrics):
+        """Take tokens and call counts from the task's common.instrumentation.Metrics."""
+        self.prompt_tokens = metrics.prompt_tokens
+        self.completion_tokens = metrics.completion_tokens
+        self.llm_calls = metrics.llm_calls
+        self.tool_calls = metrics.tool_calls
+
+    def cost(self, prompt_price: float = PROMPT_PRICE, completion_price: float = COMPLETION_PRICE) -> float:
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1e6
+
+    def summary(self) -> str:
+        if self.error is not None:
+            return f"test case {self.task_index}: error: {self.error}"
+        return (f"test case {self.task_index} ({self.instance_id}): "
+                f"FAIL_TO_PASS {self.fail_to_pass_passed}/{self.fail_to_pass_total}, "
+                f"PASS_TO_PASS {self.pass_to_pass_passed}/{self.pass_to_pass_total}, "
+                f"{self.prompt_tokens + self.completion_tokens} tokens, {self.seconds:.1f}s")
+
+
+_COLUMNS = [f.name for f in fields(TaskResult)]
+
+
+class ResultsStore:
+    """
+    Task results in SQLite, written by a single background thread: concurrent tasks only put
+    their results on a queue, so rows never interleave and nothing waits on the disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.Queue()
+        self._closed = False
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    framework TEXT NOT NULL,
+                    task_index INTEGER,
+                    instance_id TEXT NOT NULL,
+                    repo TEXT NOT NULL,
+                    run_id TEXT NOT NULL,
+                    fail_to_pass_passed INTEGER NOT NULL,
+                    fail_to_pass_total INTEGER NOT NULL,
+                    pass_to_pass_passed INTEGER NOT NULL,
+                    pass_to_pass_total INTEGER NOT NULL,
+                    seconds REAL NOT NULL,
+                    timings TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    llm_calls INTEGER NOT NULL,
+                    tool_calls INTEGER NOT NULL,
+                    error TEXT,
+                    finished_at REAL NOT NULL
+                )""")
+            conn.commit()
+        finally:
+            conn.close()
+        self._writer = threading.Thread(target=self._write_loop, name="results-writer", daemon=True)
+        self._writer.start()
+
+    def record(self, result: TaskResult):
+        self._queue.put(result)
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path)
+        insert = f"INSERT INTO results ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+        while True:
+            batch = [self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            rows = [result for result in batch if result is not None]
+            try:
+                conn.executemany(insert, [
+                    tuple(json.dumps(value) if name == "timings" else value for name, value in asdict(result).items())
+                    for result in rows])
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Could not write {len(rows)} results to {self.path}: {e}")
+            for _ in batch:
+                self._queue.task_done()
+            if len(rows) != len(batch):
+                break
+        conn.close()
+
+    def flush(self):
+        """Wait until every recorded result is written."""
+        self._queue.join()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._writer.join()
+
+    def results(self, run_id: Optional[str] = None, latest: bool = True) -> List[TaskResult]:
+        """The stored results of one run, or of all runs; `latest` keeps only the newest per framework and task."""
+        query = f"SELECT {', '.join(_COLUMNS)} FROM results"
+        parameters = ()
+        if run_id:
+            query += " WHERE run_id = ?"
+            parameters = (run_id,)
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute(query + " ORDER BY finished_at", parameters).fetchall()
+        finally:
+            conn.close()
+        results = []
+        for row in rows:
+            values = dict(zip(_COLUMNS, row))
+            values["timings"] = json.loads(values["timings"])
+            results.append(TaskResult(**values))
+        if latest:
+            newest = {(result.framework, result.instance_id or result.task_index): result for result in results}
+            results = list(newest.values())
+        return results
+
+
+@process_default
+def default_results_store() -> ResultsStore:
+    """The process wide results store in $RESULTS_DB, or WORKSPACE_ROOT/results.db."""
+    store = ResultsStore(default_path("RESULTS_DB", "results.db"))
+    atexit.register(store.close)
+    return store
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile, p in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(min(rank, len(ordered))) - 1]
+
+
+def report(results: List[TaskResult], prompt_price: float = PROMPT_PRICE,
+           completion_price: float = COMPLETION_PRICE) -> str:
+    """Resolve rate, latency percentiles, tokens and cost per framework and per repository and framework."""
+    def table(title: str, key: Callable[[TaskResult], str]) -> List[str]:
+        groups: Dict[str, List[TaskResult]] = {}
+        for result in results:
+            groups.setdefault(key(result), []).append(result)
+        lines = [f"{title:<40} {'tasks':>5} {'resolved':>8} {'rate':>6} {'errors':>6} "
+                 f"{'p50 s':>7} {'p90 s':>7} {'p99 s':>7} {'tokens/task':>11} {'cost':>8} {'cost/task':>9}"]
+        for name, group in sorted(groups.items()):
+            resolved = sum(result.resolved for result in group)
+            seconds = [result.seconds for result in group if result.error is None]
+            tokens = sum(result.prompt_tokens + result.completion_tokens for result in group)
+            cost = sum(result.cost(prompt_price, completion_price) for result in group)
+            lines.append(f"{name[:40]:<40} {len(group):>5} {resolved:>8} {resolved / len(group) * 100:>5.1f}% "
+                         f"{sum(result.error is not None for result in group):>6} "
+                         f"{percentile(seconds, 50):>7.1f} {percentile(seconds, 90):>7.1f} {percentile(seconds, 99):>7.1f} "
+                         f"{tokens / len(group):>11.0f} {cost:>8.4f} {cost / len(group):>9.4f}")
+        return lines
+
+    if not results:
+        return "No results."
+    lines = table("framework", lambda result: result.framework)
+    lines.append("")
+    lines += table("repository / framework", lambda result: f"{result.repo or '(unknown)'} / {result.framework}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the results of agent sweeps.")
+    parser.add_argument("--db", help="Results database (default: $RESULTS_DB or WORKSPACE_ROOT/results.db)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Resolve rate, latency and cost per framework and repository")
+    report_parser.add_argument("--run", help="Only this run id (default: the latest result of every task)")
+    report_parser.add_argument("--prompt-price", type=float, default=PROMPT_PRICE, help="USD per million prompt tokens")
+    report_parser.add_argument("--completion-price", type=float, default=COMPLETION_PRICE,
+                               help="USD per million completion tokens")
+    list_parser = subparsers.add_parser("list", help="Print the stored results")
+    list_parser.add_argument("--run", help="Only this run id")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db) if args.db else default_results_store()
+    if args.command == "report":
+        print(report(store.results(args.run), args.prompt_price, args.completion_price))
+    else:
+        for result in store.results(args.run, latest=False):
+            print(f"{result.run_id}  {result.framework:<10} {'resolved' if result.resolved else '        '}  {result.summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import ast
+import fnmatch
+import os
+import pickle
+import re
+import string
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from common.code_tokens import IDENTIFIER, token_set
+from common.index_store import CommitIndexStore
+from common.symbols import Symbol, extract_imports, extract_symbols, module_name
+
+# Bump when the pickled layout of SearchIndex changes, so indexes of older versions are rebuilt
+INDEX_VERSION = 2
+SKIP_DIRS = {".git", "__pycache__", "node_modules", ".tox", ".nox", ".venv", "venv", ".mypy_cache", ".pytest_cache"}
+MAX_FILE_BYTES = 1024 * 1024
+
+
+def iter_repo_files(repo_path: str) -> Iterable[str]:
+    """Yield the relative paths of all files below repo_path, skipping VCS and cache directories."""
+    for root, dirs, files in os.walk(repo_path):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            yield os.path.relpath(os.path.join(root, name), repo_path).replace(os.sep, "/")
+
+
+def read_text(full_path: str) -> Optional[str]:
+    """Return the file's text, or None for binary and oversized files."""
+    try:
+        if os.path.getsize(full_path) > MAX_FILE_BYTES:
+            return None
+        with open(full_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if b"\0" in data[:8192]:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+IDENTIFIER_CHARS = string.ascii_letters + string.digits + "_"
+
+
+def _placeholder(token: str) -> str:
+    """
+    What an escape or character class stands for among the literals: a space (a delimiter of the
+    literal next to it) if it can never match an identifier character, otherwise "." (a break, so
+    the literal next to it may be part of a longer identifier).
+    """
+    try:
+        return "." if re.search(token, IDENTIFIER_CHARS) else " "
+    except re.error:
+        return "."
+
+
+def regex_literals(pattern: str) -> List[str]:
+    """Literal runs that every match of the regex must contain (an empty list if that is unclear)."""
+    if "|" in pattern or re.search(r"\)[?*{]", pattern):
+        return []  # alternatives or optional groups: no single literal has to be present
+    # character classes and escapes such as \w, \d or \( (\\. inside a class belongs to the class)
+    pattern = re.sub(r"\[\^?\]?(?:\\.|[^\]])*\]|\\.", lambda m: _placeholder(m.group()), pattern)
+    pattern = re.sub(r".[?*]|.\{[^}]*\}", ".", pattern)  # characters that may be absent
+    return re.split(r"[.^$+()]", pattern)
+
+
+class SearchIndex:
+    """
+    Inverted index from code tokens (identifiers and their snake/camel case parts) to files,
+    plus a table of the classes, functions and methods of every Python file.
+
+    Queries use the index to pick candidate files and only scan those, so a search over a
+    django-sized repository touches a handful of files instead of thousands.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Set[str]] = {}
+        self.file_tokens: Dict[str, Set[str]] = {}
+        self.symbols: Dict[str, List[Symbol]] = {}
+        self.imports: Dict[str, List[str]] = {}  # path -> absolute names of the modules it imports
+        self.stats: Dict[str, tuple] = {}  # path -> (mtime_ns, size) when it was indexed
+        self.commit: Optional[str] = None
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    # -----------------------------
+    # Building and updating
+    # -----------------------------
+    def build(self, repo_path: str):
+        self.update(repo_path, list(iter_repo_files(repo_path)))
+
+    def update(self, repo_path: str, paths: Iterable[str]):
+        """(Re)index the given relative paths; paths that no longer exist are dropped."""
+        with self._lock:
+            for path in paths:
+                self._remove(path)
+                full_path = os.path.join(repo_path, path)
+                if not os.path.isfile(full_path):
+                    continue
+                stat = os.stat(full_path)
+                self.stats[path] = (stat.st_mtime_ns, stat.st_size)
+                text = read_text(full_path)
+                if text is None:
+                    continue
+                tokens = token_set(text)
+                self.file_tokens[path] = tokens
+                for token in tokens:
+                    self.postings.setdefault(token, set()).add(path)
+                if path.endswith(".py"):
+                    try:
+                        tree = ast.parse(text)
+                    except (SyntaxError, ValueError):
+                        continue
+                    self.symbols[path] = extract_symbols(tree)
+                    self.imports[path] = extract_imports(tree, path)
+
+    def _remove(self, path: str):
+        for token in self.file_tokens.pop(path, ()):
+            files = self.postings.get(token)
+            if files is not None:
+                files.discard(path)
+                if not files:
+                    del self.postings[token]
+        self.symbols.pop(path, None)
+        self.imports.pop(path, None)
+        self.stats.pop(path, None)
+
+    def refresh(self, repo_path: str) -> int:
+        """Reindex files that changed on disk since they were indexed; returns how many were updated."""
+        with self._lock:
+            seen, changed = set(), []
+            for path in iter_repo_files(repo_path):
+                seen.add(path)
+                try:
+                    stat = os.stat(os.path.join(repo_path, path))
+                except OSError:
+                    continue
+                if self.stats.get(path) != (stat.st_mtime_ns, stat.st_size):
+                    changed.append(path)
+            changed.extend(path for path in list(self.stats) if path not in seen)
+            self.update(repo_path, changed)
+            return len(changed)
+
+    def adopt_stats(self, repo_path: str):
+        """Record the current (mtime, size) of every indexed file without reindexing it."""
+        with self._lock:
+            for path in list(self.stats):
+                try:
+                    stat = os.stat(os.path.join(repo_path, path))
+                    self.stats[path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    self._remove(path)
+
+    def save(self, file_path: str):
+        directory = os.path.dirname(file_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # a private temporary file, tasks on the same commit may save concurrently
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with self._lock, os.fdopen(fd, "wb") as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def load(file_path: str) -> "SearchIndex":
+        with open(file_path, "rb") as f:
+            return pickle.load(f)
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+    def symbol_table(self) -> Dict[str, List[Symbol]]:
+        """A snapshot of the definitions of every parsed Python file."""
+        with self._lock:
+            return dict(self.symbols)
+
+    def _files_for_token(self, token: str, whole: bool) -> Set[str]:
+        if whole:
+            return set(self.postings.get(token, ()))
+        # possibly part of a longer identifier ("querys" in "get_queryset"): union over matching vocabulary
+        result = set()
+        for candidate, candidate_files in self.postings.items():
+            if token in candidate:
+                result |= candidate_files
+        return result
+
+    def candidates(self, literal_parts: List[str]) -> Optional[Set[str]]:
+        """Files that may contain all literal parts, or None if the parts give no usable filter."""
+        result = None
+        for part in literal_parts:
+            for match in IDENTIFIER.finditer(part):
+                token = match.group().lower()
+                if len(token) < 2:
+                    continue
+                # only identifiers delimited on both sides within the query are whole identifiers
+                whole = 0 < match.start() and match.end() < len(part)
+                files = self._files_for_token(token, whole)
+                result = files if result is None else result & files
+        return result
+
+    def search(self, repo_path: str, query: str, regex: bool = False, case_sensitive: bool = False,
+               path_glob: Optional[str] = None, max_results: int = 50) -> List[str]:
+        """Return "path:line: text" hits for a literal string or a regular expression."""
+        flags = 0 if case_sensitive else re.IGNORECASE
+        pattern = re.compile(query if regex else re.escape(query), flags)
+        parts = regex_literals(query) if regex else [query]
+
+        with self._lock:
+            files = self.candidates(parts)
+            if files is None:
+                files = set(self.file_tokens)
+
+        hits = []
+        for path in sorted(files):
+            if path_glob and not fnmatch.fnmatch(path, path_glob):
+                continue
+            text = read_text(os.path.join(repo_path, path))
+            if text is None:
+                continue
+            for number, line in enumerate(text.splitlines(), 1):
+                if pattern.search(line):
+                    hits.append(f"{path}:{number}: {line.strip()[:200]}")
+                    if len(hits) >= max_results:
+                        return hits
+        return hits
+
+    def find_symbols(self, name: str, kind: Optional[str] = None, max_results: int = 20) -> List[str]:
+        """
+        Look up definitions: an exact name ("get_or_create"), a qualified suffix
+        ("QuerySet.get_or_create") or, if nothing matches exactly, a case-insensitive substring.
+        """
+        exact, partial = [], []
+        lowered = name.lower()
+        with self._lock:
+            for path, symbols in sorted(self.symbols.items()):
+                for symbol in symbols:
+                    if kind and symbol.kind != kind:
+                        continue
+                    entry = f"{path}:{symbol.line}-{symbol.end_line}: {symbol.kind} {symbol.qualname}"
+                    if symbol.name == name or symbol.qualname == name or symbol.qualname.endswith("." + name):
+                        exact.append(entry)
+                    elif lowered in symbol.qualname.lower():
+                        partial.append(entry)
+        return (exact or partial)[:max_results]
+
+
+_indexes: Dict[str, SearchIndex] = {}
+_stale: Dict[str, Set[str]] = {}  # repo_path -> files written since its index was last updated
+_indexes_lock = threading.Lock()
+
+
+def index_dir() -> str:
+    return os.environ.get("INDEX_ROOT") or os.path.join(os.environ.get("WORKSPACE_ROOT", ""), ".index")
+
+
+def workspace_index(repo_path: str, repo_url: Optional[str] = None, commit: Optional[str] = None) -> SearchIndex:
+    """
+    The search index of a workspace, kept in memory for the task. Loading it reindexes whatever
+    changed on disk; after that only the files reported through mark_stale are reindexed, so a
+    query does not have to walk and stat the whole tree.
+
+    Given the repository URL and commit of the checkout, the index is shared on disk per commit
+    (see CommitIndexStore); otherwise it is persisted per workspace directory.
+    """
+    with _indexes_lock:
+        index = _indexes.get(repo_path)
+        stale = _stale.pop(repo_path, set()) if index is not None else set()
+    if index is not None:
+        if stale:
+            index.update(repo_path, sorted(stale))
+        return index
+
+    if repo_url:
+        store = CommitIndexStore(index_dir(), f"search-v{INDEX_VERSION}")
+        index = store.load(repo_path, repo_url, commit, SearchIndex)
+    else:
+        started = time.perf_counter()
+        index_path = os.path.join(index_dir(), f"{os.path.basename(repo_path)}-v{INDEX_VERSION}.pkl")
+        index = SearchIndex.load(index_path) if os.path.exists(index_path) else SearchIndex()
+        updated = index.refresh(repo_path)
+        index.save(index_path)
+        print(f"Search index for {repo_path}: {updated} files (re)indexed in {time.perf_counter() - started:.2f}s")
+    with _indexes_lock:
+        return _indexes.setdefault(repo_path, index)
+
+
+def mark_stale(repo_path: str, file_paths: Iterable[str]):
+    """Record that files of a workspace were written, so its index rereads them on the next query."""
+    with _indexes_lock:
+        if repo_path in _indexes:
+            _stale.setdefault(repo_path, set()).update(
+                os.path.relpath(path, repo_path).replace(os.sep, "/") for path in file_paths)
+
+
+def release_workspace_index(repo_path: str):
+    with _indexes_lock:
+        _indexes.pop(repo_path, None)
+        _stale.pop(repo_path, None)
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import random
+
+import httpx
+
+API_URL = os.environ.get("TASK_API_URL", "http://localhost:8081/task/index/")  # API endpoint for SWE-Bench-Lite
+TEST_URL = os.environ.get("TEST_API_URL", "http://localhost:8082/test")
+
+# Responses worth retrying: the services are local and these only show up while they are busy or restarting.
+RETRY_STATUS = {429, 502, 503, 504}
+# Errors before the request was sent, which are safe to retry for any method.
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Errors after the request may have been sent. They are only retried for GET: on POST /test the harness
+# may already be running (or be done), and a retry would start a full evaluation again.
+RETRY_READ_ERRORS = (httpx.ReadError, httpx.RemoteProtocolError)
+
+
+class ServiceClient:
+    """
+    Async client for the task API (8081) and the evaluation service (8082).
+
+    One keep-alive connection pool is shared by every task in the process; requests have timeouts
+    and transient failures are retried with exponential backoff and full jitter.
+    """
+
+    def __init__(self, max_connections: int = 16, timeout: float = 30.0, test_timeout: float = 1800.0,
+                 retries: int = 4, backoff: float = 0.5, max_backoff: float = 10.0):
+        self.test_timeout = test_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self._client.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+                print(f"{method} {url} returned {response.status_code}, retrying...")
+            except (*RETRY_ERRORS, *RETRY_READ_ERRORS) as e:
+                if attempt == self.retries or (method != "GET" and not isinstance(e, RETRY_ERRORS)):
+                    raise
+                print(f"{method} {url} failed ({e!r}), retrying...")
+            await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    async def get_task(self, index) -> dict:
+        """Fetch the raw test case with the given index from the task API."""
+        response = await self._request("GET", f"{API_URL}{index}")
+        return response.json()
+
+    async def run_tests(self, payload: dict) -> dict:
+        """Post an evaluation request to the test service and return its JSON response."""
+        response = await self._request("POST", TEST_URL, json=payload, timeout=self.test_timeout)
+        return response.json()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_client = None
+_client_loop = None
+
+
+def get_client() -> ServiceClient:
+    """Return the shared client of the running event loop, creating it on first use."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client, _client_loop = ServiceClient(), loop
+    return _client
+
+
+async def close_client():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+        _client, _client_loop = None, None
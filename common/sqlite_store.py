@@ -0,0 +1,24 @@
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    Base of the SQLite files shared by all tasks of a process: one connection used from any
+    thread, serialized by `_lock`. Subclasses give their tables as SCHEMA.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    def _evict_least_recently_used(self, table: str, max_entries: int):
+        """Keep the `max_entries` rows of `table` (with key and last_used columns) used last; call with `_lock` held."""
+        self._conn.execute(
+            f"DELETE FROM {table} WHERE key IN "
+            f"(SELECT key FROM {table} ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (max_entries,))
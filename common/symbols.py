@@ -0,0 +1,88 @@
+import ast
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+
+@dataclass(frozen=True)
+class Symbol:
+    name: str
+    qualname: str  # e.g. "QuerySet.get_or_create"
+    kind: str  # "class", "function" or "method"
+    line: int  # first line, including decorators
+    end_line: int
+
+
+def module_name(path: str) -> str:
+    """The dotted module name of a repository relative path: "django/db/__init__.py" -> "django.db"."""
+    name = path[:-3] if path.endswith(".py") else path
+    name = name.replace("/", ".")
+    return name[:-len(".__init__")] if name.endswith(".__init__") else name
+
+
+def extract_symbols(source: Union[str, ast.AST]) -> List[Symbol]:
+    """Return the classes, functions and methods defined in Python source, in source order."""
+    tree = ast.parse(source) if isinstance(source, str) else source
+    symbols = []
+
+    def visit(node, prefix, in_class):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualname = f"{prefix}.{child.name}" if prefix else child.name
+                if isinstance(child, ast.ClassDef):
+                    kind = "class"
+                else:
+                    kind = "method" if in_class else "function"
+                start = min([child.lineno] + [decorator.lineno for decorator in child.decorator_list])
+                symbols.append(Symbol(child.name, qualname, kind, start, child.end_lineno))
+                visit(child, qualname, isinstance(child, ast.ClassDef))
+            elif not isinstance(child, (ast.Lambda, ast.expr)):
+                # definitions nested in if/try/with blocks still belong to the enclosing scope
+                visit(child, prefix, in_class)
+
+    visit(tree, "", False)
+    return symbols
+
+
+def extract_imports(source: Union[str, ast.AST], path: str) -> List[str]:
+    """
+    The absolute names of the modules the file at `path` imports, relative imports resolved.
+    For `from a import b` both "a" and "a.b" are listed, since b may be a submodule.
+    """
+    tree = ast.parse(source) if isinstance(source, str) else source
+    package = module_name(path)
+    if not path.endswith("__init__.py"):
+        package = package.rpartition(".")[0]
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parent = package
+                for _ in range(node.level - 1):
+                    parent = parent.rpartition(".")[0]
+                base = f"{parent}.{base}".strip(".")
+            if base:
+                imports.append(base)
+            imports.extend(f"{base}.{alias.name}".strip(".") for alias in node.names if alias.name != "*")
+    return list(dict.fromkeys(imports))
+
+
+def lookup(symbols: List[Symbol], dotted_name: str, module: Optional[str] = None) -> List[Symbol]:
+    """
+    The symbols a dotted name refers to. Leading components are only dropped where they name the
+    file's `module` (e.g. "django.db.models.query"), so "django.db.models.query.QuerySet.get" and
+    "query.QuerySet.get" find the method QuerySet.get, while "Model.save" never resolves to a
+    module level save() when the file has no class Model.
+    """
+    parts = dotted_name.strip().split(".")
+    module_parts = module.split(".") if module else []
+    for start in range(min(len(parts), len(module_parts) + 1)):
+        if start and parts[:start] != module_parts[len(module_parts) - start:]:
+            continue
+        qualname = ".".join(parts[start:])
+        matches = [symbol for symbol in symbols if symbol.qualname == qualname]
+        if matches:
+            return matches
+    return []
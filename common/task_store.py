@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import List, Optional
+
+from common.defaults import default_path, process_default
+from common.service_client import close_client, get_client
+from common.sqlite_store import SQLiteStore
+
+
+@dataclass
+class TaskRecord:
+    """A SWE-Bench-Lite test case with its `git_clone` command already parsed."""
+    index: int
+    instance_id: str
+    problem_statement: str
+    repo_url: str
+    commit_hash: Optional[str]
+    fail_to_pass: List[str]
+    pass_to_pass: List[str]
+
+    @classmethod
+    def from_testcase(cls, index: int, testcase: dict) -> "TaskRecord":
+        repo_url, commit_hash = parse_git_clone(testcase["git_clone"])
+        return cls(
+            index=index,
+            instance_id=testcase["instance_id"],
+            problem_statement=testcase["Problem_statement"],
+            repo_url=repo_url,
+            commit_hash=commit_hash,
+            fail_to_pass=json.loads(testcase.get("FAIL_TO_PASS", "[]")),
+            pass_to_pass=json.loads(testcase.get("PASS_TO_PASS", "[]")),
+        )
+
+
+def parse_git_clone(git_clone: str):
+    """Extract (repo_url, commit_hash) from e.g. "git clone <url> && cd <dir> && git checkout <hash>"."""
+    repo_url, commit_hash = None, None
+    for command in git_clone.split("&&"):
+        words = command.split()
+        if words[:2] == ["git", "clone"]:
+            # skip options such as "--depth 1"; the repository is the first word that looks like a URL or path
+            repo_url = next(word for word in words[2:] if not word.startswith("-") and ("/" in word or ":" in word))
+        elif words[:2] == ["git", "checkout"]:
+            commit_hash = words[-1]
+    if repo_url is None:
+        raise ValueError(f"No 'git clone' command in {git_clone!r}")
+    return repo_url, commit_hash
+
+
+def parse_indices(spec):
+    """Parse a task selection like "1-30", "3,7,12" or "1-10,15" into a list of indices."""
+    indices = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            indices.extend(range(int(start), int(end) + 1))
+        else:
+            indices.append(int(part))
+    return list(dict.fromkeys(indices))
+
+
+class TaskStore(SQLiteStore):
+    """SQLite file holding parsed task records, so repeated runs do not need the task API."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_index INTEGER PRIMARY KEY,
+            instance_id TEXT NOT NULL,
+            problem_statement TEXT NOT NULL,
+            repo_url TEXT NOT NULL,
+            commit_hash TEXT,
+            fail_to_pass TEXT NOT NULL,
+            pass_to_pass TEXT NOT NULL
+        )"""
+
+    def get(self, index: int) -> Optional[TaskRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT task_index, instance_id, problem_statement, repo_url, commit_hash, fail_to_pass, pass_to_pass "
+                "FROM tasks WHERE task_index = ?", (index,)).fetchone()
+        if row is None:
+            return None
+        return TaskRecord(row[0], row[1], row[2], row[3], row[4], json.loads(row[5]), json.loads(row[6]))
+
+    def put(self, record: TaskRecord):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record.index, record.instance_id, record.problem_statement, record.repo_url, record.commit_hash,
+                 json.dumps(record.fail_to_pass), json.dumps(record.pass_to_pass)))
+            self._conn.commit()
+
+    def indices(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT task_index FROM tasks ORDER BY task_index")]
+
+
+@process_default
+def default_store() -> TaskStore:
+    """The process wide task store in $TASK_STORE, or WORKSPACE_ROOT/tasks.db."""
+    return TaskStore(default_path("TASK_STORE", "tasks.db"))
+
+
+async def load_task(index: int, store: TaskStore = None) -> TaskRecord:
+    """Return the task from the local store, fetching and storing it on a miss."""
+    store = store or default_store()
+    record = store.get(index)
+    if record is None:
+        record = TaskRecord.from_testcase(index, await get_client().get_task(index))
+        store.put(record)
+    return record
+
+
+async def prefetch(indices, store: TaskStore = None, concurrency: int = 8, refresh: bool = False):
+    """Fill the store with every task in `indices` that it does not hold yet (or all of them with `refresh`)."""
+    store = store or default_store()
+    semaphore = asyncio.Semaphore(concurrency)
+    missing = [index for index in indices if refresh or store.get(index) is None]
+
+    async def fetch(index):
+        async with semaphore:
+            try:
+                store.put(TaskRecord.from_testcase(index, await get_client().get_task(index)))
+                return True
+            except Exception as e:
+                print(f"Could not fetch test case {index}: {e}")
+                return False
+
+    print(f"Fetching {len(missing)} of {len(indices)} test cases into {store.path}...")
+    fetched = sum(await asyncio.gather(*(fetch(index) for index in missing)))
+    print(f"Stored {fetched} test cases, {len(missing) - fetched} failed.")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Manage the local SWE-Bench-Lite task store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fetch_parser = subparsers.add_parser("prefetch", help="Download and store test cases")
+    fetch_parser.add_argument("tasks", help='Task indices, e.g. "1-300" or "1,4,9"')
+    fetch_parser.add_argument("--refresh", action="store_true", help="Download tasks that are already stored again")
+    fetch_parser.add_argument("--concurrency", type=int, default=8)
+    subparsers.add_parser("list", help="Print the stored tasks")
+    args = parser.parse_args()
+
+    store = default_store()
+    if args.command == "prefetch":
+        try:
+            await prefetch(parse_indices(args.tasks), store, args.concurrency, args.refresh)
+        finally:
+            await close_client()
+    else:
+        for index in store.indices():
+            record = store.get(index)
+            print(f"{index:>4}  {record.instance_id:<40} {record.repo_url} {record.commit_hash or ''}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
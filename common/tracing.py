@@ -0,0 +1,121 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+def now_us() -> int:
+    return time.time_ns() // 1000
+
+
+class Trace:
+    """
+    A timeline of one task as Chrome trace events, which chrome://tracing and Perfetto
+    (ui.perfetto.dev) open directly. Spans are "complete" events on the thread they ran on.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.events = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, category: str, start_us: int, end_us: int, args: Optional[dict] = None,
+            thread_id: Optional[int] = None):
+        thread = threading.current_thread()
+        thread_id = thread_id if thread_id is not None else thread.ident
+        event = {"name": name, "cat": category, "ph": "X", "ts": start_us, "dur": max(end_us - start_us, 0),
+                 "pid": os.getpid(), "tid": thread_id}
+        if args:
+            event["args"] = {key: value if isinstance(value, (int, float, bool)) else str(value)
+                             for key, value in args.items()}
+        with self._lock:
+            self.events.append(event)
+            self._threads.setdefault(thread_id, thread.name if thread.ident == thread_id else f"thread {thread_id}")
+
+    def save(self, directory: str) -> str:
+        """Write <directory>/<name>.json and return its path."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.name}.json")
+        with self._lock:
+            metadata = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": self.name}}]
+            metadata += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": name}}
+                         for thread_id, name in self._threads.items()]
+            events = metadata + sorted(self.events, key=lambda event: event["ts"])
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return path
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_active: Dict[int, Trace] = {}
+_active_lock = threading.Lock()
+
+
+def trace_dir() -> str:
+    return os.environ.get("TRACE_DIR") or "traces"
+
+
+def current_trace() -> Optional[Trace]:
+    """The trace of the running task; threads without its context find it while only one task is traced."""
+    trace = _current_trace.get()
+    if trace is None:
+        with _active_lock:
+            if len(_active) == 1:
+                return next(iter(_active.values()))
+    return trace
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]):
+    """Record spans inside the with-block into `trace`, e.g. in each pipeline stage of a task."""
+    token = _current_trace.set(trace)
+    if trace is not None:
+        with _active_lock:
+            _active[id(trace)] = trace
+    try:
+        yield trace
+    finally:
+        if trace is not None:
+            with _active_lock:
+                _active.pop(id(trace), None)
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str, category: str = "task", **args):
+    """Record the with-block as a span of the current trace (a no-op without one)."""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    started = now_us()
+    try:
+        yield
+    except BaseException as e:
+        args["error"] = repr(e)
+        raise
+    finally:
+        trace.add(name, category, started, now_us(), args)
+
+
+def traced(name: str, category: str = "task"):
+    """Decorator recording every call of a sync or async function as a span."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(name, category):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(name, category):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
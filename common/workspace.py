@@ -0,0 +1,105 @@
+import contextvars
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+
+@dataclass(frozen=True)
+class Workspace:
+    """The repository a single task works in: WORKSPACE_ROOT/<repo_name>."""
+    root: str
+    repo_name: str
+
+    @property
+    def repo_path(self) -> str:
+        return os.path.normpath(os.path.join(self.root, self.repo_name))
+
+    def resolve(self, file_path: str) -> str:
+        """Resolve a tool supplied path against this workspace's repository."""
+        file_path = file_path.strip().strip('"').strip("'")
+        if not os.path.isabs(file_path):
+            file_path = os.path.join(self.repo_path, file_path)
+        return os.path.normpath(file_path)
+
+
+# Every asyncio task gets its own copy of this variable, so concurrent tasks never see each other's
+# repository. Threads only see it if they are started with a copy of the context: asyncio.to_thread
+# and LangChain's executor for sync tools copy it, loop.run_in_executor and plain threads do not.
+_current_workspace = contextvars.ContextVar("workspace", default=None)
+
+
+def current_workspace() -> Workspace:
+    """Return the workspace bound to the running task, falling back to WORKSPACE_ROOT/REPO_NAME."""
+    workspace = _current_workspace.get()
+    if workspace is None:
+        return Workspace(os.environ.get("WORKSPACE_ROOT", ""), os.environ.get("REPO_NAME", ""))
+    return workspace
+
+
+@contextmanager
+def use_workspace(root: str, repo_name: str):
+    """Bind a workspace to the current context for the duration of the with-block."""
+    workspace = Workspace(root or "", repo_name)
+    token = _current_workspace.set(workspace)
+    try:
+        yield workspace
+    finally:
+        _current_workspace.reset(token)
+
+
+class WorkspaceClosed(RuntimeError):
+    """A call on a workspace that is being removed."""
+
+
+# Calls still working on a workspace's files, per repo_path. Cancelling an asyncio task does not stop
+# the threads it started (tool calls, git), so a workspace is only removed once they are finished.
+_calls: Dict[str, int] = {}
+_closing: Set[str] = set()
+_calls_changed = threading.Condition()
+
+
+@contextmanager
+def workspace_call(repo_path: Optional[str] = None):
+    """Count a call on the files of a workspace (default: the current one) until it returns."""
+    repo_path = os.path.normpath(repo_path or current_workspace().repo_path)
+    with _calls_changed:
+        if repo_path in _closing:
+            raise WorkspaceClosed(f"{repo_path} is being removed")
+        _calls[repo_path] = _calls.get(repo_path, 0) + 1
+    try:
+        yield
+    finally:
+        with _calls_changed:
+            _calls[repo_path] -= 1
+            if not _calls[repo_path]:
+                del _calls[repo_path]
+            _calls_changed.notify_all()
+
+
+def guarded(func, repo_path: Optional[str] = None):
+    """Wrap `func` so every call runs inside workspace_call."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with workspace_call(repo_path):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def closing_workspace(repo_path: str, timeout: Optional[float] = None):
+    """
+    Refuse new calls on a workspace and wait up to `timeout` seconds for the running ones; the
+    with-block (which removes the workspace) gets whether they all finished.
+    """
+    repo_path = os.path.normpath(repo_path)
+    with _calls_changed:
+        _closing.add(repo_path)
+        idle = _calls_changed.wait_for(lambda: repo_path not in _calls, timeout)
+    try:
+        yield idle
+    finally:
+        with _calls_changed:
+            _closing.discard(repo_path)
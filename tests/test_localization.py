@@ -0,0 +1,30 @@
+from common.localization import is_test_path, parse_test_id
+
+
+def test_parse_pytest_id():
+    target = parse_test_id("tests/test_x.py::TestA::test_b[1-2]")
+    assert (target.path, target.module, target.qualname) == ("tests/test_x.py", None, "TestA.test_b")
+    assert parse_test_id("tests/test_x.py::test_c").qualname == "test_c"
+
+
+def test_parse_django_id():
+    target = parse_test_id("test_b (app.tests.TestA)")
+    assert (target.path, target.module, target.qualname) == (None, "app.tests", "TestA.test_b")
+
+
+def test_parse_django_id_that_repeats_the_method_name():
+    target = parse_test_id("test_b (app.tests.TestA.test_b)")
+    assert (target.module, target.qualname) == ("app.tests", "TestA.test_b")
+
+
+def test_parse_plain_function_name():
+    assert parse_test_id("test_issue_1234").qualname == "test_issue_1234"
+    assert parse_test_id("test_issue_1234 [slow]\nmore output").qualname == "test_issue_1234"
+    assert parse_test_id("  ").qualname is None
+
+
+def test_is_test_path():
+    assert is_test_path("tests/models/base.py")
+    assert is_test_path("django/contrib/admin/tests.py")
+    assert is_test_path("src/test_utils.py")
+    assert not is_test_path("django/db/models/query.py")
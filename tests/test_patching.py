@@ -0,0 +1,184 @@
+import os
+import sys
+
+import pytest
+
+from Lanngraph.patching import PatchError, apply_hunks, parse_patch
+
+LANNGRAPH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Lanngraph")
+
+FILE = [
+    "def add(a, b):",
+    "    return a + b",
+    "",
+    "",
+    "def sub(a, b):",
+    "    return a - b",
+]
+
+PATCH = """\
+--- a/calc.py
++++ b/calc.py
+@@ -5,2 +5,2 @@
+ def sub(a, b):
+-    return a - b
++    return b - a
+"""
+
+
+def test_parse_patch_reads_files_and_hunks():
+    patch = PATCH + """\
+--- /dev/null
++++ b/new.py
+@@ -0,0 +1 @@
++x = 1
+"""
+    files = parse_patch(patch)
+    assert [(f.old_path, f.new_path, f.path) for f in files] == [("calc.py", "calc.py", "calc.py"),
+                                                                 (None, "new.py", "new.py")]
+    hunk = files[0].hunks[0]
+    assert (hunk.old_start, hunk.old_count, hunk.new_start, hunk.new_count) == (5, 2, 5, 2)
+    assert hunk.old_lines == ["def sub(a, b):", "    return a - b"]
+    assert hunk.new_lines == ["def sub(a, b):", "    return b - a"]
+    assert files[1].hunks[0].new_lines == ["x = 1"]
+
+
+def test_parse_patch_keeps_header_like_lines_inside_an_incomplete_hunk():
+    files = parse_patch("""\
+--- a/notes.txt
++++ b/notes.txt
+@@ -1,2 +1,2 @@
+--- old
++++ new
+ end
+""")
+    assert len(files) == 1
+    assert files[0].hunks[0].lines == [("-", "-- old"), ("+", "++ new"), (" ", "end")]
+
+
+def test_parse_patch_reads_context_line_without_leading_space():
+    files = parse_patch(PATCH.replace(" def sub", "def sub"))
+    assert files[0].hunks[0].lines[0] == (" ", "def sub(a, b):")
+
+
+def test_parse_patch_rejects_text_without_file_header():
+    with pytest.raises(PatchError):
+        parse_patch("@@ -1 +1 @@\n-a\n+b\n")
+    with pytest.raises(PatchError):
+        parse_patch("just some text")
+
+
+def test_apply_hunks_finds_hunk_at_an_offset():
+    lines = ["# header", "# more"] + FILE
+    result, notes, rejected = apply_hunks(lines, parse_patch(PATCH)[0].hunks)
+    assert rejected == []
+    assert result[-1] == "    return b - a"
+    assert notes == ["hunk #1 applied at line 7 (exact)"]
+
+
+def test_apply_hunks_ignores_whitespace_and_keeps_the_files_context():
+    lines = FILE[:4] + ["def sub(a,  b):", "    return a - b"]
+    result, notes, rejected = apply_hunks(lines, parse_patch(PATCH)[0].hunks)
+    assert rejected == []
+    assert result[-2:] == ["def sub(a,  b):", "    return b - a"]
+    assert notes == ["hunk #1 applied at line 5 (whitespace)"]
+
+
+def test_apply_hunks_drops_mismatching_context_with_fuzz():
+    patch = """\
+--- a/calc.py
++++ b/calc.py
+@@ -4,3 +4,3 @@
+ # stale comment
+ def sub(a, b):
+-    return a - b
++    return b - a
+"""
+    result, notes, rejected = apply_hunks(FILE, parse_patch(patch)[0].hunks)
+    assert rejected == []
+    assert result[-1] == "    return b - a"
+    assert notes == ["hunk #1 applied at line 5 (fuzz 1)"]
+
+
+def test_apply_hunks_rejects_missing_hunk_and_applies_the_others():
+    patch = """\
+--- a/calc.py
++++ b/calc.py
+@@ -1,2 +1,2 @@
+ def add(a, b):
+-    return a * b
++    return a + b + 0
+@@ -5,2 +5,2 @@
+ def sub(a, b):
+-    return a - b
++    return b - a
+"""
+    result, notes, rejected = apply_hunks(FILE, parse_patch(patch)[0].hunks)
+    assert [rejection.number for rejection in rejected] == [1]
+    assert result[:2] == FILE[:2]
+    assert result[-1] == "    return b - a"
+
+
+def test_apply_hunks_inserts_pure_additions_after_the_given_line():
+    patch = """\
+--- a/calc.py
++++ b/calc.py
+@@ -2,0 +3,2 @@
++
++
+"""
+    result, _, rejected = apply_hunks(FILE, parse_patch(patch)[0].hunks)
+    assert rejected == []
+    assert result == FILE[:2] + ["", ""] + FILE[2:]
+
+
+@pytest.fixture
+def tools():
+    pytest.importorskip("langchain_core")
+    sys.path.insert(0, LANNGRAPH)
+    try:
+        import tools
+        yield tools
+    finally:
+        sys.path.remove(LANNGRAPH)
+
+
+def edit(tools, action, start, end=None, content=()):
+    return tools.LineEdit(file_path="calc.py", action=action, start_line=start, end_line=end, content=list(content))
+
+
+def test_apply_line_edits_uses_the_original_line_numbers(tools):
+    lines = [line + "\n" for line in FILE]
+    edits = [edit(tools, "replace", 6, content=["    return b - a"]),
+             edit(tools, "delete", 3, 4),
+             edit(tools, "insert", 1, content=["import math"])]
+    assert tools.apply_line_edits(lines, edits) == (
+        "import math\ndef add(a, b):\n    return a + b\ndef sub(a, b):\n    return b - a\n")
+
+
+def test_apply_line_edits_rejects_overlapping_edits(tools):
+    lines = [line + "\n" for line in FILE]
+    with pytest.raises(ValueError, match="overlap"):
+        tools.apply_line_edits(lines, [edit(tools, "delete", 1, 2), edit(tools, "replace", 2, 3, ["x"])])
+    with pytest.raises(ValueError, match="falls inside"):
+        tools.apply_line_edits(lines, [edit(tools, "delete", 1, 3), edit(tools, "insert", 2, content=["x"])])
+    with pytest.raises(ValueError, match="outside"):
+        tools.apply_line_edits(lines, [edit(tools, "delete", 6, 7)])
+
+
+def test_batch_edit_changes_no_file_if_an_edit_is_invalid(tools, tmp_path):
+    from common.workspace import use_workspace
+
+    (tmp_path / "repo").mkdir()
+    for name in ("a.py", "b.py"):
+        (tmp_path / "repo" / name).write_text("one\ntwo\n")
+    edits = [{"file_path": "a.py", "action": "replace", "start_line": 1, "content": ["ONE"]},
+             {"file_path": "b.py", "action": "delete", "start_line": 1, "end_line": 2},
+             {"file_path": "b.py", "action": "replace", "start_line": 2, "content": ["TWO"]}]
+    with use_workspace(str(tmp_path), "repo"):
+        result = tools.batch_edit.func(edits)
+        assert result.startswith("Error:") and "No file was changed" in result
+        assert (tmp_path / "repo" / "a.py").read_text() == "one\ntwo\n"
+        assert tools.batch_edit.func(edits[:2]).startswith("Applied 2 edits")
+    assert (tmp_path / "repo" / "a.py").read_text() == "ONE\ntwo\n"
+    assert (tmp_path / "repo" / "b.py").read_text() == ""
@@ -0,0 +1,74 @@
+import asyncio
+
+from common.pipeline import Stage, run_pipeline
+
+
+def run(items, stages, on_done=None):
+    # a hanging shutdown fails the test instead of blocking it
+    return asyncio.run(asyncio.wait_for(run_pipeline(items, stages, on_done), timeout=10))
+
+
+def test_single_worker_stages_keep_the_input_order():
+    async def double(value):
+        await asyncio.sleep(0.001 * (value % 3))
+        return value * 2
+
+    async def increment(value):
+        return value + 1
+
+    jobs = run(range(10), [Stage("double", double), Stage("increment", increment)])
+    assert [job.key for job in jobs] == list(range(10))
+    assert [job.value for job in jobs] == [2 * n + 1 for n in range(10)]
+    assert all(set(job.timings) == {"double", "increment"} for job in jobs)
+
+
+def test_failed_job_skips_the_remaining_stages_and_still_comes_out():
+    seen = []
+
+    async def check(value):
+        if value == 2:
+            raise ValueError("bad item")
+        return value
+
+    async def record(value):
+        seen.append(value)
+        return value
+
+    jobs = run(range(4), [Stage("check", check), Stage("record", record)])
+    assert seen == [0, 1, 3]
+    failed = [job for job in jobs if job.error is not None]
+    assert [(job.key, job.failed_stage, str(job.error)) for job in failed] == [(2, "check", "bad item")]
+    assert "record" not in failed[0].timings
+
+
+def test_multi_worker_stages_shut_down_and_call_on_done_once_per_item():
+    done = []
+
+    async def slow(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def on_done(job):
+        done.append(job.key)
+
+    stages = [Stage("first", slow, workers=3, queue_size=2), Stage("second", slow, workers=2)]
+    jobs = run(range(12), stages, on_done)
+    assert sorted(job.key for job in jobs) == list(range(12))
+    assert sorted(done) == list(range(12))
+
+
+def test_earlier_stage_runs_ahead_of_later_stage():
+    events = []
+
+    async def fetch(value):
+        events.append(("fetch", value))
+        return value
+
+    async def solve(value):
+        events.append(("solve start", value))
+        await asyncio.sleep(0.01)
+        return value
+
+    run(range(3), [Stage("fetch", fetch), Stage("solve", solve)], on_done=lambda job: None)
+    assert events.index(("fetch", 1)) < events.index(("solve start", 1))
+    assert events.index(("fetch", 2)) < events.index(("solve start", 1))
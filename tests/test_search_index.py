@@ -0,0 +1,35 @@
+from common.search_index import SearchIndex, regex_literals
+
+
+def build_index(tmp_path, files):
+    for path, text in files.items():
+        (tmp_path / path).write_text(text)
+    index = SearchIndex()
+    index.build(str(tmp_path))
+    return index
+
+
+def test_regex_search_finds_literal_inside_longer_identifier(tmp_path):
+    index = build_index(tmp_path, {"a.py": "xfooy = 1\n"})
+    for query in (r"\wfoo\w", "[a-z]foo[a-z]", r"\Sfoo"):
+        assert index.search(str(tmp_path), query, regex=True) == ["a.py:1: xfooy = 1"], query
+
+
+def test_regex_literals_keep_delimiters_that_match_no_identifier_character():
+    assert regex_literals(r"foo\(bar") == ["foo bar"]
+    assert regex_literals("foo[ ]bar") == ["foo bar"]
+    assert regex_literals(r"\wfoo\w") == ["", "foo", ""]
+    assert regex_literals("get|set") == []
+
+
+def test_regex_literals_split_on_wildcards_and_optional_characters():
+    assert regex_literals("foo.*bar") == ["foo", "bar"]
+    assert regex_literals("colou?r_name") == ["colo", "r_name"]
+    assert regex_literals("^def main") == ["", "def main"]
+    assert regex_literals(r"x{2,3}yz") == ["", "yz"]
+
+
+def test_regex_literals_give_up_on_alternatives_and_optional_groups():
+    assert regex_literals("(foo)?bar") == []
+    assert regex_literals("(foo)*bar") == []
+    assert regex_literals("foo|bar") == []
@@ -0,0 +1,24 @@
+from common.symbols import extract_symbols, lookup, module_name
+
+SOURCE = '''
+def save():
+    pass
+
+
+class QuerySet:
+    def get(self):
+        pass
+'''
+
+
+def test_lookup_does_not_fall_back_to_module_level_function():
+    symbols = extract_symbols(SOURCE)
+    assert lookup(symbols, "Model.save", module_name("django/db/models/base.py")) == []
+
+
+def test_lookup_strips_the_module_path():
+    symbols = extract_symbols(SOURCE)
+    module = module_name("django/db/models/query.py")
+    for name in ("django.db.models.query.QuerySet.get", "query.QuerySet.get", "QuerySet.get"):
+        assert [symbol.qualname for symbol in lookup(symbols, name, module)] == ["QuerySet.get"]
+    assert lookup(symbols, "other.QuerySet.get", module) == []
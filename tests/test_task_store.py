@@ -0,0 +1,10 @@
+from common.task_store import parse_indices
+
+
+def test_parse_indices():
+    assert parse_indices("1-3,7, 12") == [1, 2, 3, 7, 12]
+    assert parse_indices("5") == [5]
+
+
+def test_parse_indices_drops_duplicates_and_empty_parts():
+    assert parse_indices("3,1-4,,3") == [3, 1, 2, 4]